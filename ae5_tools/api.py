@@ -8,18 +8,26 @@ import json
 import webbrowser
 from os.path import basename, abspath, isfile, isdir, join
 from fnmatch import fnmatch
-from datetime import datetime
-from dateutil import parser
+from datetime import datetime, timedelta, timezone
 import getpass
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, OrderedDict
 from tempfile import TemporaryDirectory
 import tarfile
+import uuid
+import random
+import hashlib
 
 from .config import config
-from .filter import filter_vars, split_filter, filter_list_of_dicts
-from .identifier import Identifier
+from .filter import filter_vars, split_filter, filter_list_of_dicts, exact_matches
+from .identifier import Identifier, RE_ID
+from .retry import RetryPolicy
+from .isodate import parse_isodate
 from .docker import get_dockerfile, get_condarc
 from .docker import build_image
-from .archiver import create_tar_archive
+from .archiver import create_tar_archive, iter_tar_archive, project_manifest, manifest_changes
 from .k8s.client import AE5K8SLocalClient, AE5K8SRemoteClient
 
 from http.cookiejar import LWPCookieJar
@@ -29,11 +37,52 @@ from requests.packages import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 # Maximum page size in keycloak
-KEYCLOAK_PAGE_MAX = os.environ.get('KEYCLOAK_PAGE_MAX', 1000)
+KEYCLOAK_PAGE_MAX = int(os.environ.get('KEYCLOAK_PAGE_MAX', 1000))
 
 # Default subdomain for kubectl service
 DEFAULT_K8S_ENDPOINT = 'k8s'
 
+# Lifetime, in seconds, of the project and deployment indices shared by the record joins
+INDEX_TTL = float(os.environ.get('AE5_INDEX_TTL', 30))
+
+# Maximum number of API requests issued concurrently by a single call
+MAX_CONCURRENCY = int(os.environ.get('AE5_MAX_CONCURRENCY', 8))
+
+# HTTP connection pooling: the number of hosts for which connection pools are
+# retained, the number of connections kept open per host, whether callers wait
+# for a free connection rather than opening a throwaway one, and the number
+# of seconds a pool may sit idle before its connections are closed.
+POOL_CONNECTIONS = int(os.environ.get('AE5_POOL_CONNECTIONS', 10))
+POOL_MAXSIZE = int(os.environ.get('AE5_POOL_MAXSIZE', max(10, MAX_CONCURRENCY)))
+POOL_BLOCK = os.environ.get('AE5_POOL_BLOCK', '').lower() in ('1', 'true', 'yes')
+POOL_IDLE_TIMEOUT = float(os.environ.get('AE5_POOL_IDLE_TIMEOUT', 60))
+
+# Record fields that are passed to the list endpoints as query parameters
+# when a filter requires an exact match on them. The records are still
+# filtered locally, so this is purely an optimization. Session names are
+# not pushed down, because _pre_session replaces them with project names.
+FILTER_PUSHDOWN = os.environ.get('AE5_FILTER_PUSHDOWN', '').lower() in ('1', 'true', 'yes')
+PUSHDOWN_FIELDS = {'projects': ('owner', 'name', 'id'),
+                   'sessions': ('owner', 'id'),
+                   'deployments': ('owner', 'name', 'id'),
+                   'jobs': ('owner', 'name', 'id'),
+                   'runs': ('owner', 'name', 'id')}
+
+# Size, in bytes, of the chunks in which downloads are written to disk
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('AE5_DOWNLOAD_CHUNK_SIZE', 1024 * 1024))
+
+# Polling of long-running actions: the delay bounds, in seconds, of the first
+# and of any later status check, and the initial and largest activity page
+# sizes per project.
+WAIT_BASE = float(os.environ.get('AE5_WAIT_BASE', 0.5))
+WAIT_CAP = float(os.environ.get('AE5_WAIT_CAP', 5))
+WAIT_PAGE_SIZE = int(os.environ.get('AE5_WAIT_PAGE_SIZE', 10))
+WAIT_PAGE_MAX = int(os.environ.get('AE5_WAIT_PAGE_MAX', 100))
+# Job runs take minutes rather than seconds, so they are polled less often;
+# with the jitter of _Backoff, the first check comes after at least 5 seconds.
+RUN_WAIT_BASE = float(os.environ.get('AE5_RUN_WAIT_BASE', 10))
+RUN_WAIT_CAP = float(os.environ.get('AE5_RUN_WAIT_CAP', 30))
+
 K8S_COLUMNS = ('phase', 'since', 'rst', 'usage/mem', 'usage/cpu', 'usage/gpu', 'changes', 'modified', 'node')
 
 # Column labels prefixed with a '?' are not included in an initial empty record list.
@@ -70,12 +119,286 @@ IDENT_FILTERS = {
     'user': 'username={value}|id={value}'
 }
 
+# Record types that can be retrieved directly with a GET <type>s/<id> call.
+# Identifiers that resolve to a complete ID for one of these types can be
+# looked up without downloading and filtering the full record list.
+ID_ENDPOINTS = ('project', 'session', 'deployment', 'job', 'run')
+
+# Record types whose fields are joined from the cached record index. A lookup
+# of one of these that finds nothing refreshes the index once and tries again,
+# in case another client has renamed a project since the index was built.
+INDEXED_RECORDS = ('session', 'endpoint', 'job', 'run')
+
 _DTYPES = {'created': 'datetime', 'updated': 'datetime',
            'since': 'datetime', 'mtime': 'datetime', 'timestamp': 'datetime',
            'createdTimestamp': 'timestamp/ms', 'notBefore': 'timestamp/s',
            'lastLogin': 'timestamp/ms', 'time': 'timestamp/ms'}
 
 
+def _convert_column(values, dtype):
+    # Converts the values of a datetime or timestamp column. Record lists
+    # tend to repeat values, so each distinct value is converted only once.
+    if dtype == 'datetime':
+        def convert(value):
+            try:
+                return parse_isodate(value)
+            except ValueError:
+                return value
+        vtypes = (str,)
+    else:
+        fact = 1000.0 if dtype.rsplit('/', 1)[1] == 'ms' else 1.0
+
+        def convert(value):
+            return datetime.fromtimestamp(value / fact)
+        vtypes = (int, float)
+    cache = {}
+    result = []
+    for value in values:
+        if value and isinstance(value, vtypes):
+            try:
+                value = cache[value]
+            except KeyError:
+                cache[value] = value = convert(value)
+        result.append(value)
+    return result
+
+
+def _save_private_json(path, data):
+    # Writes a file readable only by the user, replacing it atomically. The
+    # file is created private, rather than restricted after writing; and a
+    # leftover partial file is removed first, since os.open keeps its mode.
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    try:
+        os.remove(path + '.part')
+    except FileNotFoundError:
+        pass
+    fd = os.open(path + '.part', os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w') as fp:
+        json.dump(data, fp)
+    os.replace(path + '.part', path)
+
+
+def _drop_overlap(prev, page):
+    # The page is requested with one more record in front of it, which is
+    # the last record of the previous page unless records were inserted
+    # ahead of the scan in between; then the page starts with the last few
+    # records of the previous page instead. The overlap is matched by
+    # position, so identical consecutive records are all kept. If records
+    # were removed instead, nothing matches, and the whole page is new.
+    for n in range(1, min(len(prev), len(page)) + 1):
+        if page[:n] == prev[-n:]:
+            return page[n:]
+    return page
+
+
+class _PageScan(object):
+    '''The request plan of a paginated Keycloak listing.
+
+    The plan is shared by the synchronous and asynchronous admin sessions,
+    which differ only in how they issue the requests. Each request is an
+    (offset, count, anchored) tuple; depth() is the number of requests that
+    should be in flight, and receive() turns each response, in request
+    order, into the records to yield. Every page but the first is anchored:
+    it also includes the last record of the previous page, so that records
+    that shift during the scan are detected by _drop_overlap.
+
+    When the number of records is known in advance, because a limit is
+    given or the caller supplies the total, the pages of that window are
+    requested max_concurrency at a time. Otherwise, and for any records
+    beyond the expected total, one page is requested at a time, so that
+    the next page is retrieved while the caller consumes the current one.
+    '''
+    def __init__(self, first=0, limit=sys.maxsize, total=None, max_concurrency=1):
+        window = limit if total is None else min(limit, max(0, total - first))
+        self.workers = 1
+        self.window_end = first
+        if window < sys.maxsize:
+            self.workers = max(1, min(max_concurrency, -(-window // KEYCLOAK_PAGE_MAX)))
+            self.window_end = first + window
+        self.start = self.offset = first
+        self.end = first + limit
+        self.prev = []
+        self.done = False
+
+    def depth(self):
+        return self.workers if self.offset < self.window_end else 1
+
+    def next_request(self):
+        # Returns the next page to request, or None if there are no more
+        if self.done or self.offset >= self.end:
+            return None
+        end = self.window_end if self.offset < self.window_end else self.end
+        anchor = int(self.offset > self.start)
+        count = min(KEYCLOAK_PAGE_MAX - anchor, end - self.offset)
+        request = (self.offset - anchor, count + anchor, bool(anchor))
+        self.offset += count
+        return request
+
+    @staticmethod
+    def params(request, kwargs):
+        return dict(kwargs, first=request[0], max=request[1])
+
+    def receive(self, request, page):
+        # A short page ends the scan; requests still in flight are discarded
+        if len(page) < request[1]:
+            self.done = True
+        prev, self.prev = self.prev, [dict(rec) for rec in page]
+        # The copies are compared with the next page, since the caller may
+        # modify the yielded records, as _fix_records does
+        return _drop_overlap(prev, page) if request[2] else page
+
+
+class _Backoff(object):
+    '''A capped exponential polling schedule with jitter and a deadline.
+
+    Half of each delay is randomized, so that many waiting clients do not
+    poll in lockstep. delay() returns None once the deadline has passed.
+    '''
+    def __init__(self, timeout=None, base=None, cap=None):
+        self.base = WAIT_BASE if base is None else base
+        self.cap = WAIT_CAP if cap is None else cap
+        self.timeout = timeout
+        self.deadline = None if timeout is None else time.time() + timeout
+        self.attempt = 0
+
+    def delay(self):
+        delay = min(self.cap, self.base * 2 ** self.attempt)
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        self.attempt += 1
+        if self.deadline is not None:
+            remaining = self.deadline - time.time()
+            if remaining <= 0:
+                return None
+            delay = min(delay, remaining)
+        return delay
+
+
+class _ActionWaiter(object):
+    '''Tracks the actions of several API responses until they finish.
+
+    The unfinished actions are grouped by project. For each check, the
+    session retrieves every activity page listed by requests(), and passes
+    it to update(), which updates the action status of the responses in
+    place. The page of a project is enlarged only if one of its pending
+    actions has fallen off of it, up to WAIT_PAGE_MAX records. An action
+    missing even from a page of that size is still polled, as the server
+    may not have listed it yet; only the timeout of the wait ends it.
+    '''
+    def __init__(self, responses):
+        self.pending = {}
+        for response in responses:
+            status = response['action']
+            if not status['done'] and not status['error']:
+                pid = response.get('project_id', response['id'])
+                self.pending.setdefault(pid, {})[status['id']] = response
+        self.sizes = {pid: min(WAIT_PAGE_MAX, max(WAIT_PAGE_SIZE, len(actions)))
+                      for pid, actions in self.pending.items()}
+
+    def requests(self):
+        return [(pid, f'projects/{pid}/activity', {'sort': '-updated', 'page[size]': self.sizes[pid]})
+                for pid in self.pending]
+
+    def update(self, pid, activity):
+        actions = self.pending[pid]
+        seen = set()
+        for status in activity['data']:
+            seen.add(status['id'])
+            response = actions.get(status['id'])
+            if response is not None:
+                response['action'] = status
+                if status['done'] or status['error']:
+                    del actions[status['id']]
+        if not actions:
+            del self.pending[pid]
+        elif not seen.issuperset(actions):
+            self.sizes[pid] = min(WAIT_PAGE_MAX, self.sizes[pid] * 2)
+
+    def timeout_error(self, timeout):
+        actions = ', '.join(a for p in self.pending.values() for a in p)
+        return AEException(f'Timed out after {timeout} seconds waiting for actions: {actions}')
+
+
+class _DeploymentWaiter(object):
+    '''Tracks a batch of deployments until they finish starting.
+
+    The results list holds the records, or errors, of the deployments in
+    submission order; update() applies a snapshot of the deployment list
+    to the deployments still starting.
+    '''
+    def __init__(self, results):
+        self.results = results
+        self.pending = {rec['id']: ndx for ndx, rec in enumerate(results)
+                        if isinstance(rec, dict) and rec['state'] in ('initial', 'starting')}
+        self.expired = []
+
+    def update(self, records):
+        records = {rec['id']: rec for rec in records}
+        for id, ndx in list(self.pending.items()):
+            rec = records.get(id)
+            if rec is None:
+                self.results[ndx] = AEException(f'Deployment {id} disappeared while starting')
+            elif rec['state'] not in ('initial', 'starting'):
+                self.results[ndx] = rec
+            else:
+                continue
+            del self.pending[id]
+
+    def expire(self, timeout):
+        for id, ndx in self.pending.items():
+            self.results[ndx] = AEException(f'Timed out after {timeout} seconds waiting for deployment {id}')
+        self.expired = list(self.pending)
+        self.pending.clear()
+
+    def failures(self):
+        # Replaces the records of deployments that did not start with errors,
+        # and returns the IDs of those deployments and of any that timed out.
+        failed = list(self.expired)
+        for ndx, rec in enumerate(self.results):
+            if isinstance(rec, dict) and rec['state'] != 'started':
+                failed.append(rec['id'])
+                self.results[ndx] = AEException(f'Error completing deployment start: {rec["status_text"]}')
+        return failed
+
+
+class _RunWaiter(object):
+    '''Tracks a set of job runs until they finish.
+
+    For each check, the session retrieves the endpoints listed by requests():
+    the run list if more than two runs are pending, or else each pending run
+    directly. update() applies the raw responses to the runs still pending;
+    the records list holds the latest record of each run, in order.
+    '''
+    def __init__(self, records):
+        self.records = list(records)
+        self.pending = {rec['id']: ndx for ndx, rec in enumerate(self.records)
+                        if rec['state'] not in ('completed', 'error')}
+
+    @staticmethod
+    def backoff(timeout):
+        return _Backoff(timeout, RUN_WAIT_BASE, RUN_WAIT_CAP)
+
+    def requests(self):
+        if len(self.pending) > 2:
+            return ['runs']
+        return [f'runs/{id}' for id in self.pending]
+
+    def update(self, responses):
+        records = {}
+        for response in responses:
+            for rec in (response if isinstance(response, list) else [response]):
+                records[rec['id']] = rec
+        for id, ndx in list(self.pending.items()):
+            rec = records.get(id)
+            if rec is None:
+                raise AEException(f'Run {id} disappeared while waiting for it to finish')
+            self.records[ndx] = rec
+            if rec['state'] in ('completed', 'error'):
+                del self.pending[id]
+
+    def timeout_error(self, timeout):
+        return AEException(f'Timed out after {timeout} seconds waiting for runs: {", ".join(self.pending)}')
+
+
 class EmptyRecordList(list):
     def __init__(self, record_type, columns=None):
         self._record_type = record_type
@@ -113,6 +436,94 @@ class AEUnexpectedResponseError(AEException):
     pass
 
 
+class AEHTTPAdapter(requests.adapters.HTTPAdapter):
+    '''An HTTP adapter with an idle timeout and connection reuse statistics.
+
+    Connections that have not been used for idle_timeout seconds are closed
+    before the next request, rather than being handed back to a caller after
+    the server or a load balancer has likely dropped them.
+    '''
+    def __init__(self, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 pool_block=POOL_BLOCK, idle_timeout=POOL_IDLE_TIMEOUT, **kwargs):
+        self.idle_timeout = idle_timeout
+        self._last_used = time.time()
+        self._closed_stats = {'requests': 0, 'connections': 0}
+        self._idle_resets = 0
+        self._stats_lock = threading.Lock()
+        super(AEHTTPAdapter, self).__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                            pool_block=pool_block, **kwargs)
+
+    def _pool_counts(self):
+        pools = self.poolmanager.pools
+        counts = dict(self._closed_stats)
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                counts['requests'] += pool.num_requests
+                counts['connections'] += pool.num_connections
+        return counts
+
+    def send(self, request, **kwargs):
+        with self._stats_lock:
+            now = time.time()
+            if self.idle_timeout and now - self._last_used > self.idle_timeout:
+                # The pools are discarded along with their counters, so those
+                # are retained here to keep the statistics cumulative.
+                self._closed_stats = self._pool_counts()
+                self.poolmanager.clear()
+                self._idle_resets += 1
+            self._last_used = now
+        return super(AEHTTPAdapter, self).send(request, **kwargs)
+
+    def stats(self):
+        '''Returns connection reuse statistics for this adapter.
+
+        "connections" counts new connections, each of which includes a TLS
+        handshake: that is, pool misses. "reused" counts requests served on
+        an existing connection. A connection count that keeps pace with the
+        request count means callers are not benefiting from keep-alive;
+        for concurrent callers this usually means pool_maxsize is too small.
+        '''
+        with self._stats_lock:
+            counts = self._pool_counts()
+        counts['reused'] = max(0, counts['requests'] - counts['connections'])
+        counts['idle_resets'] = self._idle_resets
+        counts['pool_maxsize'] = self._pool_maxsize
+        return counts
+
+
+def _iter_file(path, chunk_size=1024 * 1024):
+    with open(path, 'rb') as fp:
+        yield from iter(lambda: fp.read(chunk_size), b'')
+
+
+class _MultipartBody(object):
+    '''A multipart/form-data request body with a generated file part.
+
+    Passed to requests as the data argument, this is sent with chunked
+    transfer encoding, without materializing the file content in memory.
+    Each iteration regenerates the body from the start, so that the
+    request can be replayed if it must be retried.
+    '''
+    def __init__(self, fields, name, filename, generator):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        self.fields = fields
+        self.name = name
+        self.filename = filename
+        self.generator = generator
+
+    def __iter__(self):
+        boundary = self.boundary
+        for key, value in self.fields.items():
+            yield (f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n'
+                   f'{value}\r\n').encode('utf-8')
+        yield (f'--{boundary}\r\nContent-Disposition: form-data; name="{self.name}"; '
+               f'filename="{self.filename}"\r\nContent-Type: application/octet-stream\r\n\r\n').encode('utf-8')
+        yield from self.generator()
+        yield f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+
 class AESessionBase(object):
     '''Base class for AE5 API interactions.'''
 
@@ -138,9 +549,20 @@ class AESessionBase(object):
         self.password = password
         self.persist = persist
         self.prefix = prefix.lstrip('/')
+        self.max_concurrency = MAX_CONCURRENCY
+        self.retry_policy = RetryPolicy()
         self.session = requests.Session()
         self.session.verify = False
+        # Separate adapters for the main host and for its subdomains (the
+        # k8s service and deployment endpoints), so that traffic to the
+        # latter does not evict the connections to the former. Subdomains
+        # are mounted as they are first used; see _mount_subdomain.
+        self._adapters = {'host': AEHTTPAdapter(), 'subdomain': AEHTTPAdapter()}
+        self._mount_lock = threading.Lock()
+        self.session.mount(f'https://{hostname}/', self._adapters['host'])
         self.session.cookies = LWPCookieJar()
+        self._auth_lock = threading.Lock()
+        self._auth_count = 0
         if self.persist:
             self._load()
         self.connected = self._connected()
@@ -195,6 +617,7 @@ class AESessionBase(object):
             last_valid = False
         if self._connected():
             self.connected = True
+            self._auth_count += 1
             self._set_header()
             if self.persist:
                 self._save()
@@ -207,6 +630,35 @@ class AESessionBase(object):
             self._save()
         self.connected = False
 
+    def _reauthorize(self, auth_count):
+        # Concurrent requests may all discover an expired session at once.
+        # Only the first of them logs in again; the others simply retry.
+        with self._auth_lock:
+            if self._auth_count == auth_count:
+                self.authorize()
+
+    def pool_stats(self):
+        '''Returns HTTP connection pool statistics.
+
+        The result is a dictionary with "host" and "subdomain" entries, for
+        the main host and for its subdomains, respectively. See
+        AEHTTPAdapter.stats for a description of the fields.
+        '''
+        return {k: v.stats() for k, v in self._adapters.items()}
+
+    def _concurrent_map(self, func, items, max_concurrency=None):
+        '''Applies a function to each item using a bounded pool of threads.
+
+        The results are returned in the same order as the items. The calls
+        share the connection pool of the underlying requests session.
+        '''
+        items = list(items)
+        nthreads = min(max_concurrency or self.max_concurrency, len(items))
+        if nthreads <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            return list(executor.map(func, items))
+
     def _filter_records(self, filter, records):
         if not filter or not records:
             return records
@@ -241,34 +693,48 @@ class AESessionBase(object):
             msg += ':\n  - ' + '\n  - '.join(matches)
         raise AEException(msg)
 
-    def _fix_records(self, record_type, records, filter=None, **kwargs):
-        pre = f'_pre_{record_type}'
+    @staticmethod
+    def _unwrap_records(records):
+        # Returns the records as a list, and whether a single record was given
         if isinstance(records, dict) and 'data' in records:
             records = records['data']
         is_single = isinstance(records, dict)
-        if is_single:
-            records = [records]
+        return ([records] if is_single else records), is_single
+
+    def _pre_records(self, record_type, records, filter):
+        # The stages of _fix_records before the _post_* method, which are
+        # shared with the asynchronous sessions. Returns the records and the
+        # part of the filter that must be applied after the _post_* method.
+        pre = f'_pre_{record_type}'
         if hasattr(self, pre):
             records = getattr(self, pre)(records)
         for rec in records:
             rec['_record_type'] = record_type
         if not records:
             records = EmptyRecordList(record_type)
+        postfilt = None
         if records and filter:
             prefilt, postfilt = split_filter(filter, records[0])
             records = self._filter_records(prefilt, records)
-        post = f'_post_{record_type}'
-        if hasattr(self, post):
-            records = getattr(self, post)(records, **kwargs)
-        if records and filter:
+        return records, postfilt
+
+    def _post_records(self, records, postfilt, is_single):
+        if records and postfilt:
             records = self._filter_records(postfilt, records)
         if is_single:
             return records[0] if records else None
         return records
 
-    def _ident_record(self, record_type, ident, quiet=False, **kwargs):
-        if isinstance(ident, dict) and ident.get('_record_type', '') == record_type:
-            return ident
+    def _fix_records(self, record_type, records, filter=None, **kwargs):
+        records, is_single = self._unwrap_records(records)
+        records, postfilt = self._pre_records(record_type, records, filter)
+        post = f'_post_{record_type}'
+        if hasattr(self, post):
+            records = getattr(self, post)(records, **kwargs)
+        return self._post_records(records, postfilt, is_single)
+
+    @staticmethod
+    def _ident_filter(record_type, ident):
         itype = record_type + 's'
         if isinstance(ident, Identifier):
             filter = ident.project_filter(itype=itype, ignore_revision=True)
@@ -279,12 +745,53 @@ class AESessionBase(object):
         else:
             ident = Identifier.from_string(ident, itype)
             filter = ident.project_filter(itype=itype, ignore_revision=True)
-        matches = getattr(self, f'{record_type}_list')(filter=filter, **kwargs)
+        return filter
+
+    @staticmethod
+    def _filter_id(record_type, filter):
+        # Returns the complete ID pinned down by the filter, if any, so the
+        # record can be retrieved directly instead of through a full listing.
+        if record_type not in ID_ENDPOINTS:
+            return None
+        id = exact_matches(filter).get('id', '')
+        if re.fullmatch(RE_ID, id) and id[:2] == Identifier.id_prefix(record_type + 's'):
+            return id
+
+    def _ident_record(self, record_type, ident, quiet=False, **kwargs):
+        if isinstance(ident, dict) and ident.get('_record_type', '') == record_type:
+            return ident
+        filter = self._ident_filter(record_type, ident)
+        matches = self._id_record(record_type, filter, **kwargs)
+        if matches is None:
+            matches = getattr(self, f'{record_type}_list')(filter=filter, **kwargs)
+            if not matches and record_type in INDEXED_RECORDS:
+                self._invalidate_index()
+                matches = getattr(self, f'{record_type}_list')(filter=filter, **kwargs)
         return self._should_be_one(matches, filter, quiet)
 
-    def _format_table(self, response, columns):
-        is_series = isinstance(response, dict)
-        rlist = [response] if is_series else response
+    def _id_record(self, record_type, filter, **kwargs):
+        # Returns None if the record cannot be retrieved directly, so that
+        # the caller can fall back to a full listing.
+        id = self._filter_id(record_type, filter)
+        if id is None:
+            return None
+        try:
+            record = self._get(f'{record_type}s/{id}')
+        except AEUnexpectedResponseError:
+            return None
+        if not isinstance(record, dict):
+            return None
+        record = self._fix_records(record_type, record, filter, **kwargs)
+        return EmptyRecordList(record_type) if record is None else [record]
+
+    def _format_columns(self, response, columns):
+        '''Returns the records of a response in columnar form.
+
+        The result is a list of column names, and a dictionary mapping each
+        name to a list of values. Datetime and timestamp columns are converted
+        once per distinct value. The records themselves are not modified.
+        '''
+        rlist = [response] if isinstance(response, dict) else response
         csrc = list(rlist[0]) if rlist else getattr(response, '_columns', ())
         columns = [c.lstrip('?') for c in (columns or ())]
         cdst = [c for c in columns if c in csrc]
@@ -292,27 +799,31 @@ class AESessionBase(object):
         cdst.extend(c for c in csrc if c not in columns and c.startswith('_') and c != '_record_type')
         if '_record_type' in csrc:
             cdst.append('_record_type')
+        data = {}
         for col in cdst:
+            values = [rec.get(col) for rec in rlist]
             if col in _DTYPES:
-                dtype = _DTYPES[col]
-                if dtype == 'datetime':
-                    for rec in rlist:
-                        if rec.get(col):
-                            try:
-                                rec[col] = parser.isoparse(rec[col])
-                            except ValueError:
-                                pass
-                elif dtype.startswith('timestamp'):
-                    incr = dtype.rsplit('/', 1)[1]
-                    fact = 1000.0 if incr == 'ms' else 1.0
-                    for rec in rlist:
-                        if rec.get(col):
-                            rec[col] = datetime.fromtimestamp(rec[col] / fact)
-        result = [tuple(rec.get(k) for k in cdst) for rec in rlist]
-        if is_series:
-            result = list(zip(cdst, result[0]))
-            cdst = ['field', 'value']
-        return (result, cdst)
+                values = _convert_column(values, _DTYPES[col])
+            data[col] = values
+        return cdst, data
+
+    def _format_table(self, response, columns):
+        cdst, data = self._format_columns(response, columns)
+        if isinstance(response, dict):
+            return [(col, data[col][0]) for col in cdst], ['field', 'value']
+        return list(zip(*(data[col] for col in cdst))) if cdst else [() for _ in response], cdst
+
+    def _format_records(self, records, columns=None):
+        '''Yields records formatted one at a time, for streamed output.
+
+        Each record is formatted as it would be in a table: its columns are
+        ordered and its datetime and timestamp fields converted the same way.
+        The column order of a record is taken from its _record_type field.
+        '''
+        for rec in records:
+            rcols = COLUMNS.get(rec.get('_record_type'), ()) if columns is None else columns
+            cdst, data = self._format_columns(rec, rcols)
+            yield {col: data[col][0] for col in cdst}
 
     def _format_response(self, response, format, columns=None, record_type=None):
         if not isinstance(response, (list, dict)):
@@ -332,7 +843,6 @@ class AESessionBase(object):
                 record_type = getattr(response, '_record_type', None)
         if columns is None and record_type is not None:
             columns = COLUMNS.get(record_type, ())
-        records, columns = self._format_table(response, columns)
         if format in ('dataframe', '_dataframe'):
             try:
                 if format == '_dataframe':
@@ -340,12 +850,15 @@ class AESessionBase(object):
                 import pandas as pd
             except ImportError:
                 raise ImportError('Pandas must be installed in order to use format="dataframe"')
-            return pd.DataFrame(records, columns=columns)
-        return records, columns
-
-    def _api(self, method, endpoint, **kwargs):
-        format = kwargs.pop('format', None)
-        subdomain = kwargs.pop('subdomain', None)
+            if isinstance(response, dict):
+                records, columns = self._format_table(response, columns)
+                return pd.DataFrame(records, columns=columns)
+            columns, data = self._format_columns(response, columns)
+            return pd.DataFrame(data, columns=columns)
+        return self._format_table(response, columns)
+
+    def _base_url(self, endpoint, subdomain=None):
+        # Returns the scheme+host portion of the URL and the full URL
         isabs, endpoint = endpoint.startswith('/'), endpoint.lstrip('/')
         if subdomain:
             subdomain += '.'
@@ -354,23 +867,56 @@ class AESessionBase(object):
             subdomain = ''
         if not isabs:
             endpoint = f'{self.prefix}/{endpoint}'
-        url = f'https://{subdomain}{self.hostname}/{endpoint}'
+        base = f'https://{subdomain}{self.hostname}'
+        return base, f'{base}/{endpoint}'
+
+    def _retry_policy(self, retry):
+        # Per-call retry settings: None selects the session policy,
+        # False disables retries, and a RetryPolicy is used as given.
+        if retry is None:
+            return self.retry_policy
+        if retry is False:
+            return RetryPolicy(attempts=0)
+        return retry
+
+    def _mount_subdomain(self, base):
+        # Mounts the subdomain adapter on one subdomain of the cluster. The
+        # adapters are replaced as a whole, sorted by descending prefix
+        # length as Session.mount keeps them, so that threads looking up
+        # an adapter concurrently never see the dictionary being modified.
+        prefix = base.lower() + '/'
+        with self._mount_lock:
+            if prefix not in self.session.adapters:
+                adapters = list(self.session.adapters.items()) + [(prefix, self._adapters['subdomain'])]
+                adapters.sort(key=lambda item: -len(item[0]))
+                self.session.adapters = OrderedDict(adapters)
+
+    def _api(self, method, endpoint, **kwargs):
+        format = kwargs.pop('format', None)
+        subdomain = kwargs.pop('subdomain', None)
+        base, url = self._base_url(endpoint, subdomain)
+        if subdomain:
+            self._mount_subdomain(base)
+        policy = self._retry_policy(kwargs.pop('retry', None))
         do_save = False
         allow_retry = True
+        auth_count = self._auth_count
         if not self.connected:
-            self.authorize()
+            self._reauthorize(auth_count)
+            auth_count = self._auth_count
             if self.password is not None:
                 allow_retry = False
         retries = redirects = 0
+        waited = 0.0
         while True:
             try:
                 response = getattr(self.session, method)(url, allow_redirects=False, **kwargs)
-                retries = 0
             except requests.exceptions.ConnectionError:
-                if retries == 3:
+                delay = policy.retry_delay(method, retries)
+                if delay is None:
                     raise AEUnexpectedResponseError('Unable to connect', method, url, **kwargs)
                 retries += 1
-                time.sleep(2)
+                time.sleep(delay)
                 continue
             except requests.exceptions.Timeout:
                 raise AEUnexpectedResponseError('Connection timeout', method, url, **kwargs)
@@ -379,7 +925,7 @@ class AESessionBase(object):
                 # handle them ourselves to provide better behavior than requests.
                 url2 = response.headers['location'].rstrip()
                 if url2.startswith('/'):
-                    url2 = f'https://{subdomain}{self.hostname}{url2}'
+                    url2 = f'{base}{url2}'
                 if url2 == url:
                     # Self-redirects happen sometimes when the deployment is not
                     # fully ready. If the application code isn't ready, we usually
@@ -389,10 +935,12 @@ class AESessionBase(object):
                     # on the same endpoint. So we are blocking for up to a minute here
                     # to wait for the endpoint to be established. If we let requests
                     # handle the redirect it would quickly reach its redirect limit.
-                    if redirects == 30:
+                    delay = policy.redirect_delay(redirects, waited)
+                    if delay is None:
                         raise AEUnexpectedResponseError('Too many self-redirects', method, url, **kwargs)
                     redirects += 1
-                    time.sleep(2)
+                    waited += delay
+                    time.sleep(delay)
                 else:
                     # In this case we are likely being redirected to auth to retrieve
                     # a cookie for the endpoint session itself. We will want to save
@@ -403,13 +951,20 @@ class AESessionBase(object):
                 url = url2
                 method = 'get'
             elif allow_retry and (response.status_code == 401 or self._is_login(response)):
-                self.authorize()
+                self._reauthorize(auth_count)
+                auth_count = self._auth_count
                 if self.password is not None:
                     allow_retry = False
                 redirects = 0
             elif response.status_code >= 400:
-                raise AEUnexpectedResponseError(response, method, url, **kwargs)
+                delay = policy.retry_delay(method, retries, response.status_code,
+                                           response.headers.get('retry-after'))
+                if delay is None:
+                    raise AEUnexpectedResponseError(response, method, url, **kwargs)
+                retries += 1
+                time.sleep(delay)
             else:
+                policy.success()
                 if do_save and self.persist:
                     self._save()
                 break
@@ -450,13 +1005,52 @@ class AESessionBase(object):
 
 
 class AEUserSession(AESessionBase):
-    def __init__(self, hostname, username, password=None, persist=True, k8s_endpoint=None):
+    def __init__(self, hostname, username, password=None, persist=True, k8s_endpoint=None,
+                 index_ttl=None):
         self._filename = os.path.join(config._path, 'cookies', f'{username}@{hostname}')
+        self._index = {}
+        self._job_names = None
+        self.index_ttl = INDEX_TTL if index_ttl is None else index_ttl
+        self.filter_pushdown = FILTER_PUSHDOWN
+        self._pushdown_counts = {'calls': 0, 'pushed': 0, 'records': 0, 'fields': {}}
         super(AEUserSession, self).__init__(hostname, username, password=password,
                                             prefix='api/v2', persist=persist)
         self._k8s_endpoint = k8s_endpoint or os.environ.get('AE5_K8S_ENDPOINT') or 'k8s'
         self._k8s_client = None
 
+    def _record_index(self, endpoint, ids=()):
+        '''Returns a dictionary of records keyed by ID.
+
+        The index is shared by all of the joins that need it, so that a
+        composite listing downloads each record type once. It is refreshed
+        once it is older than index_ttl seconds, or if any of the given IDs
+        are missing from it. IDs still missing after a refresh (for instance,
+        the projects of orphaned runs) do not trigger further refreshes.
+        The records are shared with the cache: joins must store copies.
+        '''
+        index = self._index_lookup(endpoint, ids)
+        if index is None:
+            index = self._index_store(endpoint, self._get_records(endpoint), ids)
+        return index
+
+    def _index_lookup(self, endpoint, ids=()):
+        # Returns the index, or None if it must be refreshed
+        tstamp, index, missing = self._index.get(endpoint, (0, None, set()))
+        if (index is None or time.time() - tstamp >= self.index_ttl or
+                any(id not in index and id not in missing for id in ids)):
+            return None
+        return index
+
+    def _index_store(self, endpoint, records, ids=()):
+        index = {rec['id']: rec for rec in records}
+        missing = set(id for id in ids if id not in index)
+        self._index[endpoint] = (time.time(), index, missing)
+        return index
+
+    def _invalidate_index(self, *endpoints):
+        for endpoint in endpoints or list(self._index):
+            self._index.pop(endpoint, None)
+
     def _k8s(self, method, *args, **kwargs):
         quiet = kwargs.pop('quiet', False)
         if self._k8s_client is None and self._k8s_endpoint is not None:
@@ -527,12 +1121,53 @@ class AEUserSession(AESessionBase):
         self.session.cookies.save(self._filename, ignore_discard=True)
         os.chmod(self._filename, 0o600)
 
+    def _pushdown(self, method, endpoint, filter, api_kwargs):
+        '''Moves the exact matches of a filter into the query parameters of a list call.
+
+        Returns the new API arguments, and the names of the fields pushed down.
+        '''
+        if not (self.filter_pushdown and filter and method == 'get' and endpoint in PUSHDOWN_FIELDS):
+            return api_kwargs, ()
+        fields = PUSHDOWN_FIELDS[endpoint]
+        params = {k: v for k, v in exact_matches(filter).items() if k in fields}
+        if params:
+            params.update(api_kwargs.get('params') or ())
+            api_kwargs = dict(api_kwargs, params=params)
+        return api_kwargs, tuple(params)
+
+    def _count_pushdown(self, pushed, records):
+        counts = self._pushdown_counts
+        counts['calls'] += 1
+        if pushed:
+            counts['pushed'] += 1
+            if isinstance(records, dict) and 'data' in records:
+                records = records['data']
+            counts['records'] += len(records) if isinstance(records, list) else 1
+            for field in pushed:
+                counts['fields'][field] = counts['fields'].get(field, 0) + 1
+
+    def pushdown_stats(self):
+        '''Returns statistics on the filters pushed down to the server.
+
+        "calls" is the number of filtered list calls, and "pushed" the number
+        of those that carried query parameters; "records" is the number of
+        records returned by the latter, and "fields" counts the pushes of
+        each field. Comparing "records" with and without pushdown enabled
+        measures the reduction in the number of records transferred.
+        '''
+        counts = dict(self._pushdown_counts)
+        counts['fields'] = dict(counts['fields'])
+        return counts
+
     def _api_records(self, method, endpoint, filter=None, **kwargs):
         record_type = kwargs.pop('record_type', None)
         api_kwargs = kwargs.pop('api_kwargs', None) or {}
         if not record_type:
             record_type = endpoint.rsplit('/', 1)[-1].rstrip('s')
+        api_kwargs, pushed = self._pushdown(method, endpoint, filter, api_kwargs)
         records = self._api(method, endpoint, **api_kwargs)
+        if filter and endpoint in PUSHDOWN_FIELDS:
+            self._count_pushdown(pushed, records)
         return self._fix_records(record_type, records, filter, **kwargs)
 
     def _get_records(self, endpoint, filter=None, **kwargs):
@@ -560,12 +1195,14 @@ class AEUserSession(AESessionBase):
         if data:
             id = prec["id"]
             self._patch(f'projects/{id}', json=data)
+            self._invalidate_index('projects')
             prec = self._ident_record('project', id)
         return self._format_response(prec, format=format)
 
     def project_delete(self, ident, format=None):
         id = self._ident_record('project', ident)['id']
         self._delete(f'projects/{id}')
+        self._invalidate_index('projects')
 
     def project_collaborator_list(self, ident, filter=None, format=None):
         id = self._ident_record('project', ident)['id']
@@ -733,7 +1370,10 @@ class AEUserSession(AESessionBase):
             rec['_project'] = project
         return records
 
-    def _revisions(self, ident, filter=None, latest=False, single=False, quiet=False):
+    @staticmethod
+    def _revision_filter(ident, filter=None, latest=False):
+        # Separates the revision from a project identifier. Returns the project
+        # identifier, the revision filter, and the updated latest flag.
         if isinstance(ident, dict):
             revision = ident.get('_revision')
         elif isinstance(ident, tuple):
@@ -748,16 +1388,20 @@ class AEUserSession(AESessionBase):
             revision = None
         elif revision:
             latest = False
-        prec = self._ident_record('project', ident, quiet=quiet)
-        if prec is None:
-            return None
-        id = prec["id"]
         if not filter:
             filter = ()
         if latest:
             filter = (f'latest=True',) + filter
         elif revision and revision != '*':
             filter = (f'name={revision}',) + filter
+        return ident, filter, latest
+
+    def _revisions(self, ident, filter=None, latest=False, single=False, quiet=False):
+        ident, filter, latest = self._revision_filter(ident, filter, latest)
+        prec = self._ident_record('project', ident, quiet=quiet)
+        if prec is None:
+            return None
+        id = prec["id"]
         response = self._get_records(f'projects/{id}/revisions', filter=filter, project=prec)
         if latest == 'keep' and response:
             response[0]['name'] = 'latest'
@@ -781,16 +1425,90 @@ class AEUserSession(AESessionBase):
         rrec = self._revision(ident, quiet=quiet)
         return self._format_response(rrec['_commands'], format=format)
 
-    def project_download(self, ident, filename=None, format=None):
+    def _download(self, endpoint, filename, chunk_size=None, resume=False, progress=None):
+        '''Streams the content of an API endpoint to a file.
+
+        The content is written to a ".part" file alongside the target, which
+        is renamed into place only once the download is complete. If the
+        connection is interrupted, the download is resumed with a Range
+        request, subject to the session retry policy. If resume=True, an
+        existing ".part" file left over from a previous call is resumed, too.
+
+        Args:
+            endpoint: the API endpoint to download.
+            filename: the name of the file to write.
+            chunk_size: the number of bytes read and written at a time.
+            resume: if True, resume from an existing ".part" file.
+            progress: an optional callback, called after each chunk with
+                the number of bytes received so far, the total number of
+                bytes expected (or None if not known), and the transfer
+                rate of the current request in bytes per second.
+        '''
+        chunk_size = chunk_size or DOWNLOAD_CHUNK_SIZE
+        partname = filename + '.part'
+        if not resume and os.path.exists(partname):
+            os.remove(partname)
+        use_range = True
+        retries = 0
+        while True:
+            offset = os.path.getsize(partname) if use_range and os.path.exists(partname) else 0
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            try:
+                response = self._api('get', endpoint, format='response', stream=True, headers=headers)
+            except AEUnexpectedResponseError:
+                if not offset:
+                    raise
+                # Most likely a 416 response, because the partial file is stale
+                # or already complete. Either way, start from the beginning.
+                use_range = False
+                continue
+            with response:
+                if response.status_code != 206:
+                    offset = 0
+                elif response.headers.get('content-encoding'):
+                    # Byte ranges of an encoded response cannot be spliced onto
+                    # the decoded data already on disk.
+                    use_range = False
+                    continue
+                if response.status_code == 206:
+                    total = response.headers.get('content-range', '').rsplit('/', 1)[-1]
+                else:
+                    total = response.headers.get('content-length')
+                total = int(total) if total and total.isdigit() else None
+                nbytes, t0 = offset, time.time()
+                try:
+                    with open(partname, 'ab' if offset else 'wb') as fp:
+                        for chunk in response.iter_content(chunk_size):
+                            fp.write(chunk)
+                            nbytes += len(chunk)
+                            if progress is not None:
+                                progress(nbytes, total, (nbytes - offset) / max(time.time() - t0, 1e-6))
+                except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as exc:
+                    delay = self.retry_policy.retry_delay('get', retries)
+                    if delay is None:
+                        raise AEUnexpectedResponseError(f'Download interrupted: {exc}', 'get', endpoint)
+                    retries += 1
+                    use_range = True
+                    time.sleep(delay)
+                    continue
+            break
+        os.replace(partname, filename)
+
+    def project_download(self, ident, filename=None, format=None, chunk_size=None, resume=False, progress=None):
+        '''Download a project revision archive.
+
+        The archive is streamed to disk; see _download for a description of the
+        chunk_size, resume, and progress arguments. If no filename is given, one
+        is constructed from the project and revision names, and returned.
+        '''
         rrec = self._revision(ident, keep_latest=True)
         prec, rev = rrec['_project'], rrec['id']
         need_filename = not bool(filename)
         if need_filename:
             revdash = f'-{rrec["name"]}' if rrec['name'] != 'latest' else ''
             filename = f'{prec["name"]}{revdash}.tar.gz'
-        response = self._get(f'projects/{prec["id"]}/revisions/{rev}/archive', format='blob')
-        with open(filename, 'wb') as fp:
-            fp.write(response)
+        self._download(f'projects/{prec["id"]}/revisions/{rev}/archive', filename,
+                       chunk_size=chunk_size, resume=resume, progress=progress)
         if need_filename:
             return filename
 
@@ -836,19 +1554,63 @@ class AEUserSession(AESessionBase):
             print('Starting image build. This may take several minutes.')
             build_image(tempdir, tag=tag, debug=debug)
 
-    def _wait(self, response):
-        index = 0
-        id = response.get('project_id', response['id'])
-        status = response['action']
-        while not status['done'] and not status['error']:
-            time.sleep(1)
-            params = {'sort': '-updated', 'page[size]': index + 1}
-            activity = self._get(f'projects/{id}/activity', params=params)
-            try:
-                status = next(s for s in activity['data'] if s['id'] == status['id'])
-            except StopIteration:
-                index = index + 1
-        response['action'] = status
+    def _wait_many(self, responses, timeout=None):
+        '''Waits for the actions of several API responses to complete.
+
+        The actions are tracked by ID. A single polling loop serves all of
+        them: each check retrieves the activity of every project with an
+        unfinished action, concurrently, once per project. The delay between
+        checks grows exponentially from WAIT_BASE up to WAIT_CAP seconds.
+        The action status of each response is updated in place.
+
+        Args:
+            responses: a list of API responses with "action" fields, such as
+                those returned by project creation, upload, and session start.
+            timeout: the maximum number of seconds to wait, or None to wait
+                indefinitely. An AEException is raised when it expires.
+        '''
+        waiter = _ActionWaiter(responses)
+        backoff = _Backoff(timeout)
+        while waiter.pending:
+            delay = backoff.delay()
+            if delay is None:
+                raise waiter.timeout_error(timeout)
+            time.sleep(delay)
+            requests = waiter.requests()
+
+            def _activity(request):
+                return self._get(request[1], params=request[2])
+
+            for request, activity in zip(requests, self._concurrent_map(_activity, requests)):
+                waiter.update(request[0], activity)
+
+    def _wait(self, response, timeout=None):
+        self._wait_many([response], timeout=timeout)
+
+    def project_wait(self, idents, timeout=None, format=None):
+        '''Waits for the latest actions of one or more projects to complete.
+
+        Args:
+            idents: a project identifier or record, or a list of them.
+            timeout: the maximum number of seconds to wait, or None to wait
+                indefinitely.
+            format: the output format.
+        Returns:
+            the final activity record of each project, or of the single
+            project if only one identifier was given.
+        '''
+        single = not isinstance(idents, list)
+        precs = [self._ident_record('project', ident) for ident in ([idents] if single else idents)]
+        params = {'sort': '-updated', 'page[size]': 1}
+
+        def _latest(prec):
+            return self._get_records(f'projects/{prec["id"]}/activity', api_kwargs={'params': params})
+
+        latest = self._concurrent_map(_latest, precs)
+        responses = [{'id': prec['id'], 'action': records[0]} for prec, records in zip(precs, latest) if records]
+        self._wait_many(responses, timeout=timeout)
+        records = self._fix_records('activity', [response['action'] for response in responses])
+        return self._format_response(records[0] if single and records else records, format=format)
 
     def project_create(self, url, name=None, tag=None,
                        make_unique=None, wait=True, format=None):
@@ -861,6 +1623,7 @@ class AEUserSession(AESessionBase):
         if tag:
             params['tag'] = tag
         response = self._post_record('projects', api_kwargs={'json': params})
+        self._invalidate_index('projects')
         if response.get('error'):
             raise RuntimeError('Error creating project: {}'.format(response['error']['message']))
         if wait:
@@ -869,35 +1632,136 @@ class AEUserSession(AESessionBase):
             raise RuntimeError('Error processing creation: {}'.format(response['action']['message']))
         return self.project_info(response['id'], format=format)
 
-    def project_upload(self, project_archive, name, tag, wait=True, format=None):
+    def _cached_archive(self, project_directory, name, threads=None):
+        '''Returns the archive of a project directory, reusing a cached copy if possible.
+
+        The cache lives in the configuration directory, under uploads/, and is
+        keyed by user, host, and a hash of the project name; the project does
+        not have an id until it is uploaded, and hashing the name keeps names
+        such as "../x" from escaping the cache directory. It holds the archive from the
+        previous upload of the project, and a manifest of the files it contains.
+        The archive is rebuilt only if the contents or permissions of a file have
+        changed, or if files have been added or removed; and only files whose
+        size or modification time have changed are rehashed to determine this.
+
+        The manifest is not saved here, but by _save_upload_manifest, once the
+        archive has been uploaded; so a failed upload is not mistaken for the
+        previous upload by the next one.
+
+        Returns:
+            the archive filename, a dictionary of lists of the files that
+            have been added, modified, or removed since the previous upload,
+            and the manifest of the archive.
+        '''
+        cache_dir = self._upload_cache_dir(name)
+        mpath, apath = join(cache_dir, 'manifest.json'), join(cache_dir, 'project.tar.gz')
+        old = {}
+        if isfile(mpath) and isfile(apath):
+            try:
+                with open(mpath, 'r') as fp:
+                    old = json.load(fp)
+            except ValueError:
+                pass
+        new = project_manifest(project_directory, old)
+        changes = manifest_changes(old, new)
+        if not old or any(changes.values()):
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+            with open(apath + '.part', 'wb') as fp:
+                create_tar_archive(project_directory, 'project', fp, threads=threads)
+            os.replace(apath + '.part', apath)
+        return apath, changes, new
+
+    def _upload_cache_dir(self, name):
+        key = hashlib.sha256(name.encode('utf-8')).hexdigest()
+        return join(config._path, 'uploads', f'{self.username}@{self.hostname}', key)
+
+    def _save_upload_manifest(self, name, manifest):
+        mpath = join(self._upload_cache_dir(name), 'manifest.json')
+        with open(mpath + '.part', 'w') as fp:
+            json.dump(manifest, fp)
+        os.replace(mpath + '.part', mpath)
+
+    @staticmethod
+    def _report_changes(changes):
+        if not any(changes.values()):
+            print('No files have changed since the last upload; reusing its archive.', file=sys.stderr)
+            return
+        counts = ', '.join(f'{len(v)} {k}' for k, v in changes.items())
+        print(f'Files changed since the last upload: {counts}', file=sys.stderr)
+        for label, key in (('A', 'added'), ('M', 'modified'), ('D', 'removed')):
+            for path in changes[key]:
+                print(f'  {label} {path}', file=sys.stderr)
+
+    def project_upload(self, project_archive, name, tag, wait=True, format=None, stream=False, cache=False,
+                       threads=None):
+        '''Upload a project.
+
+        Args:
+            project_archive: a project archive filename, a project directory,
+                or the binary content of an archive.
+            name: the name of the new project. If not supplied, the basename of
+                the archive or directory is used.
+            tag: the commit tag of the initial revision, if any.
+            wait: if True, wait for the project creation to complete.
+            stream: if True, the archive is read or generated while it is being
+                uploaded, instead of being loaded into memory first. For a
+                directory, this also overlaps compression with the transfer.
+            cache: if True, and project_archive is a directory, its archive is
+                kept in a local cache, and reused by subsequent uploads of the
+                same project if no files have changed. The files that have
+                changed since the previous upload are reported on stderr.
+            threads: the number of threads used to compress a directory. If
+                greater than 1, blocks of the archive are compressed in
+                parallel. The default is given by AE5_ARCHIVE_THREADS, or 1.
+        '''
         if not name:
             if type(project_archive) == bytes:
                 raise RuntimeError('Project name must be supplied for binary input')
             name = basename(abspath(project_archive)).split('.', 1)[0]
+        data = {'name': name}
+        if tag:
+            data['tag'] = tag
         try:
             f = None
+            generator = None
+            manifest = None
             if type(project_archive) == bytes:
                 f = io.BytesIO(project_archive)
             elif not os.path.exists(project_archive):
                 raise RuntimeError(f'File/directory not found: {project_archive}')
             elif not isdir(project_archive):
-                f = open(project_archive, 'rb')
+                f = project_archive
             elif not isfile(join(project_archive, 'anaconda-project.yml')):
                 raise RuntimeError(f'Project directory must include anaconda-project.yml')
+            elif cache:
+                f, changes, manifest = self._cached_archive(project_archive, name, threads)
+                self._report_changes(changes)
+            elif stream:
+                generator = functools.partial(iter_tar_archive, project_archive, 'project', threads=threads)
             else:
                 f = io.BytesIO()
-                create_tar_archive(project_archive, 'project', f)
+                create_tar_archive(project_archive, 'project', f, threads=threads)
                 f.seek(0)
-            data = {'name': name}
-            if tag:
-                data['tag'] = tag
-            response = self._post_record('projects/upload', record_type='project',
-                                         api_kwargs={'files': {'project_file': f}, 'data': data})
+            if isinstance(f, str):
+                if stream:
+                    generator = functools.partial(_iter_file, f)
+                    f = None
+                else:
+                    f = open(f, 'rb')
+            if generator is not None:
+                body = _MultipartBody(data, 'project_file', 'project_file', generator)
+                api_kwargs = {'data': body, 'headers': {'Content-Type': body.content_type}}
+            else:
+                api_kwargs = {'files': {'project_file': f}, 'data': data}
+            response = self._post_record('projects/upload', record_type='project', api_kwargs=api_kwargs)
+            self._invalidate_index('projects')
         finally:
             if f is not None:
                 f.close()
         if response.get('error'):
             raise RuntimeError('Error uploading project: {}'.format(response['error']['message']))
+        if manifest is not None:
+            self._save_upload_manifest(name, manifest)
         if wait:
             self._wait(response)
         if response['action']['error']:
@@ -906,13 +1770,13 @@ class AEUserSession(AESessionBase):
 
     def _join_collaborators(self, what, response):
         if isinstance(response, dict):
-            what, id = response['_record_type'], response['id']
-            collabs = self._get_records(f'{what}s/{id}/collaborators')
-            response['collaborators'] = ', '.join(c['id'] for c in collabs)
-            response['_collaborators'] = collabs
+            self._join_collaborators(what, [response])
         elif response:
-            for rec in response:
-                self._join_collaborators(what, rec)
+            def _collaborators(rec):
+                return self._get_records(f'{rec["_record_type"]}s/{rec["id"]}/collaborators')
+            for rec, collabs in zip(response, self._concurrent_map(_collaborators, response)):
+                rec['collaborators'] = ', '.join(c['id'] for c in collabs)
+                rec['_collaborators'] = collabs
         elif hasattr(response, '_columns'):
             response._columns.extend(('collaborators', '_collaborators'))
 
@@ -957,14 +1821,14 @@ class AEUserSession(AESessionBase):
         # The "name" value in an internal AE5 session record is nothing
         # more than the "id" value with the "a1-" stub removed. Not very
         # helpful, even if understandable.
-        precs = {x['id']: x for x in self._get_records('projects')}
-        for rec in records:
-            pid = 'a0-' + rec['project_url'].rsplit('/', 1)[-1]
+        pids = ['a0-' + rec['project_url'].rsplit('/', 1)[-1] for rec in records]
+        precs = self._record_index('projects', pids)
+        for rec, pid in zip(records, pids):
             prec = precs.get(pid, {})
             rec['session_name'] = rec['name']
             rec['name'] = prec['name']
             rec['project_id'] = pid
-            rec['_project'] = prec
+            rec['_project'] = dict(prec)
         return records
 
     def _post_session(self, records, k8s=False):
@@ -1064,10 +1928,9 @@ class AEUserSession(AESessionBase):
         return self._format_response(record, format=format)
 
     def _pre_endpoint(self, records):
-        dlist = self.deployment_list()
-        plist = self.project_list()
-        dmap = {drec['endpoint']: drec for drec in dlist if drec['endpoint']}
-        pmap = {prec['id']: prec for prec in plist}
+        dmap = {drec['endpoint']: drec for drec in self._record_index('deployments').values()
+                if drec.get('endpoint')}
+        pmap = self._record_index('projects')
         newrecs = []
         for rec in records:
             drec = dmap.get(rec['id'])
@@ -1075,7 +1938,7 @@ class AEUserSession(AESessionBase):
                 rec['name'], rec['deployment_id'] = drec['name'], drec['id']
                 rec['project_url'] = drec['project_url']
                 rec['owner'] = drec['owner']
-                rec['_deployment'] = drec
+                rec['_deployment'] = dict(drec)
             else:
                 rec['name'], rec['deployment_id'] = '', ''
             rec['project_id'] = 'a0-' + rec['project_url'].rsplit('/', 1)[-1]
@@ -1083,7 +1946,7 @@ class AEUserSession(AESessionBase):
             if prec:
                 rec['project_name'] = prec['name']
                 rec.setdefault('owner', prec['owner'])
-                rec['_project'] = prec
+                rec['_project'] = dict(prec)
                 rec['_record_type'] = 'endpoint'
                 newrecs.append(rec)
         return newrecs
@@ -1140,17 +2003,12 @@ class AEUserSession(AESessionBase):
         collabs = [c for c in collabs if c['id'] not in userid]
         return self.deployment_collaborator_list_set(drec, collabs, format=format)
 
-    def deployment_start(self, ident, name=None, endpoint=None, command=None,
-                         resource_profile=None, public=False,
-                         collaborators=None, wait=True, open=False, frame=False,
-                         stop_on_error=False, format=None,
-                         _skip_endpoint_test=False):
-        rrec = self._revision(ident, keep_latest=True)
-        id, prec = rrec['project_id'], rrec['_project']
+    @staticmethod
+    def _deployment_data(rrec, name, endpoint, command, resource_profile, public):
         if command is None:
             command = rrec['commands'].split(',', 1)[0]
         if resource_profile is None:
-            resource_profile = prec['resource_profile']
+            resource_profile = rrec['_project']['resource_profile']
         data = {'source': rrec['url'],
                 'revision': rrec['name'],
                 'resource_profile': resource_profile,
@@ -1162,14 +2020,25 @@ class AEUserSession(AESessionBase):
         if endpoint:
             if not re.match(r'[A-Za-z0-9-]+', endpoint):
                 raise AEException(f'Invalid endpoint: {endpoint}')
-            if not _skip_endpoint_test:
-                try:
-                    self._head(f'/_errors/404.html', subdomain=endpoint)
-                    raise AEException('endpoint "{}" is already in use'.format(endpoint))
-                except AEUnexpectedResponseError:
-                    pass
             data['static_endpoint'] = endpoint
+        return data
+
+    def deployment_start(self, ident, name=None, endpoint=None, command=None,
+                         resource_profile=None, public=False,
+                         collaborators=None, wait=True, open=False, frame=False,
+                         stop_on_error=False, format=None,
+                         _skip_endpoint_test=False):
+        rrec = self._revision(ident, keep_latest=True)
+        id = rrec['project_id']
+        data = self._deployment_data(rrec, name, endpoint, command, resource_profile, public)
+        if endpoint and not _skip_endpoint_test:
+            try:
+                self._head(f'/_errors/404.html', subdomain=endpoint)
+                raise AEException('endpoint "{}" is already in use'.format(endpoint))
+            except AEUnexpectedResponseError:
+                pass
         response = self._post_record(f'projects/{id}/deployments', api_kwargs={'json': data})
+        self._invalidate_index('deployments')
         id = response['id']
         if response.get('error'):
             raise AEException('Error starting deployment: {}'.format(response['error']['message']))
@@ -1177,9 +2046,11 @@ class AEUserSession(AESessionBase):
             self.deployment_collaborator_list_set(id, collaborators)
         # The _wait method doesn't work here. The action isn't even updated, it seems
         if wait or stop_on_error:
-            while response['state'] in ('initial', 'starting'):
-                time.sleep(2)
-                response = self._get_records(f'deployments/{id}', record_type='deployment')
+            waiter, backoff = _DeploymentWaiter([response]), _Backoff()
+            while waiter.pending:
+                time.sleep(backoff.delay())
+                waiter.update([self._get_records(f'deployments/{id}', record_type='deployment')])
+            response = waiter.results[0]
             if response['state'] != 'started':
                 if stop_on_error:
                     self.deployment_stop(id)
@@ -1188,6 +2059,75 @@ class AEUserSession(AESessionBase):
             self.deployment_open(response, frame)
         return self._format_response(response, format=format)
 
+    @staticmethod
+    def _deployment_spec(spec):
+        # Converts a deployment_start_many spec to deployment_start arguments.
+        # The batch waits for the deployments itself, and does not open them.
+        kwargs = dict(spec) if isinstance(spec, dict) else {'ident': spec}
+        invalid = ', '.join(k for k in ('wait', 'stop_on_error', 'open', 'frame', 'format') if k in kwargs)
+        if invalid:
+            raise AEException(f'Invalid deployment_start_many spec arguments: {invalid}')
+        kwargs.update(wait=False, stop_on_error=False, format='json')
+        return kwargs
+
+    def deployment_start_many(self, specs, max_concurrency=None, wait=True, stop_on_error=False,
+                              timeout=None, return_exceptions=True):
+        '''Starts several deployments concurrently, and waits for them together.
+
+        The deployments are submitted through a bounded pool of threads.
+        A single polling loop then waits for all of them, retrieving the
+        deployment list once per check, on the same capped exponential
+        schedule as _wait_many.
+
+        Args:
+            specs: a list of deployments to start. Each is a project or
+                revision identifier, or a dictionary with an "ident" key and
+                any of the other arguments of deployment_start: name,
+                endpoint, command, resource_profile, public, collaborators.
+                An AEException is raised, before any deployment is started,
+                if a spec includes wait, stop_on_error, open, frame, or format.
+            max_concurrency: the maximum number of deployments submitted
+                at once. Defaults to the max_concurrency of the session.
+            wait: if True, wait for every deployment to finish starting.
+            stop_on_error: if True, deployments that fail to start, or that
+                are still starting when the timeout expires, are stopped.
+                Implies wait=True, as with deployment_start.
+            timeout: the maximum number of seconds to wait, or None to wait
+                indefinitely. Deployments still starting when it expires
+                are reported as errors.
+            return_exceptions: if True, errors are returned in place of the
+                records of the deployments that failed. If False, the first
+                error is raised, once every deployment has been handled.
+        Returns:
+            a list of deployment records, or errors, in the order of the specs.
+        '''
+        def _submit(kwargs):
+            try:
+                return self.deployment_start(**kwargs)
+            except Exception as exc:
+                return exc
+
+        specs = [self._deployment_spec(spec) for spec in specs]
+        results = self._concurrent_map(_submit, specs, max_concurrency)
+        if wait or stop_on_error:
+            waiter = _DeploymentWaiter(results)
+            backoff = _Backoff(timeout)
+            while waiter.pending:
+                delay = backoff.delay()
+                if delay is None:
+                    waiter.expire(timeout)
+                    break
+                time.sleep(delay)
+                waiter.update(self._get_records('deployments'))
+            failed = waiter.failures()
+            if stop_on_error and failed:
+                self._concurrent_map(self.deployment_stop, failed, max_concurrency)
+        if not return_exceptions:
+            error = next((rec for rec in results if isinstance(rec, Exception)), None)
+            if error is not None:
+                raise error
+        return results
+
     def deployment_restart(self, ident, wait=True, open=False, frame=True, stop_on_error=False, format=None):
         drec = self._ident_record('deployment', ident)
         collab = self.deployment_collaborator_list(drec)
@@ -1221,12 +2161,14 @@ class AEUserSession(AESessionBase):
         if data:
             id = drec['id']
             self._patch(f'deployments/{id}', json=data)
+            self._invalidate_index('deployments')
             drec = self._ident_record('deployment', id)
         return self._format_response(drec, format=format)
 
     def deployment_stop(self, ident, format=None):
         id = self._ident_record('deployment', ident)['id']
         self._delete(f'deployments/{id}')
+        self._invalidate_index('deployments')
 
     def deployment_logs(self, ident, which=None, format=None):
         id = self._ident_record('deployment', ident)['id']
@@ -1243,12 +2185,12 @@ class AEUserSession(AESessionBase):
         return self._format_response(response, format=format)
 
     def _pre_job(self, records):
-        precs = {x['id']: x for x in self._get_records('projects')}
-        for rec in records:
-            pid = 'a0-' + rec['project_url'].rsplit('/', 1)[-1]
+        pids = ['a0-' + rec['project_url'].rsplit('/', 1)[-1] for rec in records]
+        precs = self._record_index('projects', pids)
+        for rec, pid in zip(records, pids):
             prec = precs.get(pid, {})
             rec['project_id'] = pid
-            rec['_project'] = prec
+            rec['_project'] = dict(prec)
         return records
 
     def job_list(self, filter=None, format=None):
@@ -1278,10 +2220,127 @@ class AEUserSession(AESessionBase):
         response = self._post_record(f'jobs/{id}/unpause', record_type='job')
         return self._format_response(response, format=format)
 
+    def _job_name_index(self):
+        '''Returns the set of names in use by jobs and runs.
+
+        A name may not be reused while any job or run record carries it.
+        The index is built from a single pass over the job and run lists,
+        and kept for index_ttl seconds, so that creating a series of jobs
+        does not download the full run history each time. It is persisted
+        under the configuration directory, so that the same holds for a
+        series of "ae5 job create" commands.
+        '''
+        names = self._cached_job_names()
+        if names is None:
+            names = self._store_job_names(self._get('jobs'), self._get('runs'))
+        return names
+
+    def _job_names_path(self):
+        return join(config._path, 'jobnames', f'{self.username}@{self.hostname}.json')
+
+    def _cached_job_names(self):
+        # Returns the persisted index, which includes the names claimed by
+        # other sessions, or else the index of this session; or None if it
+        # is older than index_ttl. Reading the file is cheap next to the
+        # job and run listings it saves.
+        index = self._job_names
+        if self.persist:
+            try:
+                with open(self._job_names_path(), 'r') as fp:
+                    data = json.load(fp)
+                index = (float(data['time']), set(data['names']))
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        if index is None or not 0 <= time.time() - index[0] < self.index_ttl:
+            self._job_names = None
+            return None
+        self._job_names = index
+        return index[1]
+
+    def _store_job_names(self, jobs, runs):
+        names = {rec['name'] for rec in jobs}
+        names.update(rec['name'] for rec in runs)
+        self._job_names = (time.time(), names)
+        self._save_job_names()
+        return names
+
+    def _save_job_names(self):
+        if self.persist and self._job_names is not None:
+            when, names = self._job_names
+            _save_private_json(self._job_names_path(), {'time': when, 'names': sorted(names)})
+
+    def _invalidate_job_names(self):
+        self._job_names = None
+        if self.persist:
+            try:
+                os.remove(self._job_names_path())
+            except FileNotFoundError:
+                pass
+
+    def _unique_job_name(self, name):
+        return self._claim_job_name(name, self._job_name_index())
+
+    def _claim_job_name(self, name, names):
+        # Returns the name if it is free, or else the name followed by the
+        # smallest numeric suffix that is. The result is added to the index,
+        # so that it is not reused by a later call, or a later command,
+        # before the index is rebuilt.
+        if name in names:
+            bname = name
+            for counter in range(1, len(names) + 2):
+                name = f'{bname}-{counter}'
+                if name not in names:
+                    break
+        names.add(name)
+        self._save_job_names()
+        return name
+
+    def _job_name_taken(self, name):
+        # Whether the name is in use according to a freshly built index
+        self._invalidate_job_names()
+        return name in self._job_name_index()
+
+    def _submit_job(self, id, data):
+        # Returns the new job record, or the error if it was not created
+        try:
+            response = self._post_record(f'projects/{id}/jobs', api_kwargs={'json': data})
+        except AEUnexpectedResponseError as exc:
+            return exc
+        if response.get('error'):
+            return AEException('Error starting job: {}'.format(response['error']['message']))
+        return response
+
     def job_create(self, ident, schedule=None, name=None, command=None,
                    resource_profile=None, variables=None, run=None,
                    wait=None, cleanup=False, make_unique=None,
                    show_run=False, format=None):
+        run, wait = self._job_options(schedule, run, wait, cleanup)
+        rrec = self._revision(ident, keep_latest=True)
+        id = rrec['project_id']
+        base, make_unique = self._job_name(rrec, name, command, make_unique)
+        name = self._unique_job_name(base) if make_unique else base
+        data = self._job_data(rrec, schedule, name, command, resource_profile, variables, run)
+        response = self._submit_job(id, data)
+        if isinstance(response, Exception) and make_unique and self._job_name_taken(name):
+            # The name index is trusted for index_ttl seconds, so the name may
+            # have been taken since it was built; choose again from a fresh one
+            data['name'] = self._unique_job_name(base)
+            response = self._submit_job(id, data)
+        if isinstance(response, Exception):
+            raise response
+        if run:
+            jid = response['id']
+            run = self._get_records(f'jobs/{jid}/runs')[-1]
+            if wait:
+                run = self._wait_runs([run])[0]
+                if cleanup:
+                    self._delete(f'jobs/{jid}')
+            if show_run:
+                response = run
+        return self._format_response(response, format=format)
+
+    @staticmethod
+    def _job_options(schedule, run, wait, cleanup):
         if run is None:
             run = not schedule or cleanup
         if wait is None:
@@ -1290,30 +2349,29 @@ class AEUserSession(AESessionBase):
             raise ValueError('cannot use cleanup=True with a scheduled job')
         if cleanup and (not run or not wait):
             raise ValueError('must specify run=wait=True with cleanup=True')
-        rrec = self._revision(ident, keep_latest=True)
-        prec, id = rrec['_project'], rrec['project_id']
-        if not command:
-            command = rrec['commands'][0]['id']
-        if not resource_profile:
-            resource_profile = rrec['_project']['resource_profile']
+        return run, wait
+
+    @staticmethod
+    def _job_name(rrec, name, command, make_unique):
         # AE5's default name generator unfortunately uses colons
         # in the creation of its job names which causes confusion for
         # ae5-tools, which uses them to mark a revision identifier.
         # Furthermore, creating a job with the same name as an deleted
         # job that still has run listings causes an error.
         if not name:
-            name = f'{command}-{prec["name"]}'
+            if not command:
+                command = rrec['commands'][0]['id']
+            name = f'{command}-{rrec["_project"]["name"]}'
             if make_unique is None:
                 make_unique = True
-        if make_unique:
-            jnames = {j['name'] for j in self._get(f'jobs')}
-            jnames.update(j['name'] for j in self._get(f'runs'))
-            if name in jnames:
-                bname = name
-                for counter in range(1, len(jnames) + 1):
-                    name = f'{bname}-{counter}'
-                    if name not in jnames:
-                        break
+        return name, make_unique
+
+    @staticmethod
+    def _job_data(rrec, schedule, name, command, resource_profile, variables, run):
+        if not command:
+            command = rrec['commands'][0]['id']
+        if not resource_profile:
+            resource_profile = rrec['_project']['resource_profile']
         data = {'source': rrec['url'],
                 'resource_profile': resource_profile,
                 'command': command,
@@ -1324,22 +2382,7 @@ class AEUserSession(AESessionBase):
                 'name': name}
         if variables:
             data['variables'] = variables
-        response = self._post_record(f'projects/{id}/jobs', api_kwargs={'json': data})
-        if response.get('error'):
-            raise AEException('Error starting job: {}'.format(response['error']['message']))
-        if run:
-            jid = response['id']
-            run = self._get_records(f'jobs/{jid}/runs')[-1]
-            if wait:
-                rid = run['id']
-                while run['state'] not in ('completed', 'error'):
-                    time.sleep(5)
-                    run = self._get(f'runs/{rid}')
-                if cleanup:
-                    self._delete(f'jobs/{jid}')
-            if show_run:
-                response = run
-        return self._format_response(response, format=format)
+        return data
 
     def job_patch(self, ident, name=None, command=None, schedule=None,
                   resource_profile=None, variables=None, format=None):
@@ -1366,6 +2409,56 @@ class AEUserSession(AESessionBase):
     _pre_run = _pre_job
     _post_run = _post_session
 
+    def _wait_runs(self, records, timeout=None):
+        '''Waits for a set of runs to finish.
+
+        A single polling loop serves all of the runs. Each check retrieves
+        the raw run list, or just the pending runs if there are no more than
+        two. The delay between checks grows exponentially from RUN_WAIT_BASE
+        up to RUN_WAIT_CAP seconds. The final records are processed once.
+
+        Args:
+            records: the run records to wait for.
+            timeout: the maximum number of seconds to wait, or None to wait
+                indefinitely. An AEException is raised when it expires.
+        Returns:
+            the final run records, in the same order.
+        '''
+        waiter = _RunWaiter(records)
+        if not waiter.pending:
+            return waiter.records
+        backoff = waiter.backoff(timeout)
+        while waiter.pending:
+            delay = backoff.delay()
+            if delay is None:
+                raise waiter.timeout_error(timeout)
+            time.sleep(delay)
+            waiter.update(self._concurrent_map(self._get, waiter.requests()))
+        return self._fix_records('run', waiter.records)
+
+    def run_wait(self, ids=None, filter=None, timeout=None, format=None):
+        '''Waits for one or more runs to finish.
+
+        Args:
+            ids: a run identifier or record, or a list of them. If omitted,
+                waits for all of the runs that match the filter.
+            filter: an optional filter selecting the runs to wait for.
+            timeout: the maximum number of seconds to wait, or None to wait
+                indefinitely.
+            format: the output format.
+        Returns:
+            the final run records, or the single record if one identifier
+            was given.
+        '''
+        single = ids is not None and not isinstance(ids, list)
+        if ids is None:
+            records = self._get_records('runs', filter=filter)
+        else:
+            records = [self._ident_record('run', ident) for ident in ([ids] if single else ids)]
+        if records:
+            records = self._wait_runs(records, timeout=timeout)
+        return self._format_response(records[0] if single else records, format=format)
+
     def run_list(self, k8s=False, filter=None, format=None):
         response = self._get_records('runs', k8s=k8s, filter=filter)
         return self._format_response(response, format=format)
@@ -1497,41 +2590,151 @@ class AEAdminSession(AESessionBase):
         with open(self._filename, 'w') as fp:
             json.dump(self._sdata, fp)
 
+    def _iter_paginated(self, path, total=None, **kwargs):
+        '''Yields the pages of a Keycloak listing as they arrive.
+
+        The pages are requested in a pool of threads, following the plan
+        described in _PageScan, and yielded in order.
+
+        Args:
+            path: the Keycloak API path.
+            first: the index of the first record to retrieve.
+            limit: the maximum number of records to retrieve.
+            total: the total number of records in the listing, if known.
+            Additional keyword arguments are passed as query parameters.
+        '''
+        scan = _PageScan(kwargs.pop('first', 0), kwargs.pop('limit', sys.maxsize),
+                         total, self.max_concurrency)
+
+        def _fetch(request):
+            return self._get(path, params=scan.params(request, kwargs))
+
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=scan.workers) as executor:
+
+            def _submit():
+                while len(pending) < scan.depth():
+                    request = scan.next_request()
+                    if request is None:
+                        break
+                    pending.append((request, executor.submit(_fetch, request)))
+
+            try:
+                _submit()
+                while pending:
+                    request, future = pending.popleft()
+                    page = scan.receive(request, future.result())
+                    # The next pages are requested before this one is consumed
+                    _submit()
+                    yield page
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    def _user_count(self):
+        # Returns None if the count is not available, so the users are
+        # retrieved one page at a time.
+        try:
+            return int(self._get('users/count'))
+        except (AEUnexpectedResponseError, TypeError, ValueError):
+            return None
+
     def _get_paginated(self, path, **kwargs):
-        records = []
-        limit = kwargs.pop('limit', sys.maxsize)
-        kwargs.setdefault('first', 0)
-        while True:
-            kwargs['max'] = min(KEYCLOAK_PAGE_MAX, limit)
-            t_records = self._get(path, params=kwargs)
-            records.extend(t_records)
-            n_records = len(t_records)
-            if n_records < kwargs['max'] or n_records == limit:
-                return records
-            kwargs['first'] += n_records
-            limit -= n_records
+        return [rec for page in self._iter_paginated(path, **kwargs) for rec in page]
+
+    def iter_user_events(self, **kwargs):
+        '''Yields Keycloak events one at a time, without retaining them.
+
+        The pages are retrieved lazily, with the next page prefetched while
+        the current one is consumed. The keyword arguments are the same as
+        those of user_events, minus the format.
+        '''
+        for page in self._iter_paginated('events', **kwargs):
+            yield from page
 
     def user_events(self, format=None, **kwargs):
-        first = kwargs.pop('first', 0)
-        limit = kwargs.pop('limit', sys.maxsize)
-        records = self._get_paginated('events', limit=limit, first=first, **kwargs)
+        records = list(self.iter_user_events(**kwargs))
         return self._format_response(records, format=format, columns=[])
 
-    def _post_user(self, users):
-        users = {u['id']: u for u in users}
-        events = self._get_paginated('events', client='anaconda-platform', type='LOGIN')
+    @staticmethod
+    def _merge_logins(last_logins, events, watermark=0):
+        # Records the most recent interactive login time of each user in
+        # last_logins, and returns the time of the newest event seen.
         for e in events:
-            if 'response_mode' not in e['details']:
-                urec = users.get(e['userId'])
-                if urec and 'lastLogin' not in urec:
-                    urec['lastLogin'] = e['time']
-        users = list(users.values())
+            if 'response_mode' not in e['details'] and e['time'] > last_logins.get(e['userId'], 0):
+                last_logins[e['userId']] = e['time']
+            watermark = max(watermark, e['time'])
+        return watermark
+
+    def _login_params(self, watermark):
+        params = {'client': 'anaconda-platform', 'type': 'LOGIN'}
+        if watermark:
+            # dateFrom is a date, interpreted in the server's time zone, so
+            # the search is widened by a day; the overlap merges harmlessly.
+            date = datetime.fromtimestamp(watermark / 1000, timezone.utc) - timedelta(days=1)
+            params['dateFrom'] = date.strftime('%Y-%m-%d')
+        return params
+
+    def _login_index_path(self):
+        # Keyed by account as well as host, since the index is only as
+        # complete as the events visible to the account that built it
+        return join(config._path, 'logins', f'{self.username}@{self.hostname}.json')
+
+    def _load_login_index(self):
+        # Returns the persisted watermark and lastLogin index, or an empty
+        # index if none has been saved or it cannot be read.
+        if self.persist:
+            try:
+                with open(self._login_index_path(), 'r') as fp:
+                    index = json.load(fp)
+                return int(index['watermark']), {k: int(v) for k, v in index['last_logins'].items()}
+            except (OSError, ValueError, KeyError, TypeError, AttributeError):
+                pass
+        return 0, {}
+
+    def _save_login_index(self, watermark, last_logins):
+        if self.persist:
+            _save_private_json(self._login_index_path(), {'watermark': watermark, 'last_logins': last_logins})
+
+    def _last_logins(self):
+        '''Returns a dictionary of the last interactive login time of each user.
+
+        The index is persisted under the configuration directory, along with
+        the time of the newest login event seen. Later calls retrieve only
+        the events since that watermark, so the cost of a user listing does
+        not grow with the login history of the cluster. The index is not
+        persisted for sessions created with persist=False.
+        '''
+        watermark, last_logins = self._load_login_index()
+        events = self.iter_user_events(**self._login_params(watermark))
+        new_watermark = self._merge_logins(last_logins, events, watermark)
+        if new_watermark != watermark:
+            self._save_login_index(new_watermark, last_logins)
+        return last_logins
+
+    def _post_user(self, users, last_logins=None):
+        if last_logins is None:
+            last_logins = self._last_logins()
+        users = list({u['id']: u for u in users}.values())
         for urec in users:
-            urec.setdefault('lastLogin', 0)
+            urec.setdefault('lastLogin', last_logins.get(urec['id'], 0))
         return users
 
+    def iter_users(self, filter=None):
+        '''Yields user records one page at a time, as they arrive.
+
+        The records are identical to those of user_list. The login events
+        needed for the lastLogin field are scanned once, up front.
+
+        Args:
+            filter: an optional filter to apply to the records.
+        '''
+        last_logins = self._last_logins()
+        for page in self._iter_paginated('users', total=self._user_count()):
+            yield from self._fix_records('user', page, filter, last_logins=last_logins)
+
     def user_list(self, filter=None, format=None):
-        users = self._get_paginated('users')
+        users = self._get_paginated('users', total=self._user_count())
         users = self._fix_records('user', users, filter)
         return self._format_response(users, format=format)
 
@@ -1,8 +1,24 @@
 import os
 import re
+import time
+import gzip
+import zlib
+import struct
+import hashlib
 import tarfile
 import subprocess
 import fnmatch
+import queue
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Default number of threads used to compress project archives. If greater
+# than 1, the ParallelGzipWriter is used in place of the standard
+# single-threaded gzip compressor of the tarfile module.
+ARCHIVE_THREADS = int(os.environ.get('AE5_ARCHIVE_THREADS', 1))
 
 
 def _list_project(project_directory):
@@ -60,7 +76,242 @@ def _list_project(project_directory):
                 yield (abspath, relpath)
 
 
-def create_tar_archive(project_directory, arcname, fp):
-    with tarfile.open(fileobj=fp, mode='w|gz') as tf:
-        for abspath, relpath in _list_project(project_directory):
-            tf.add(abspath, os.path.join(arcname, relpath))
+class ParallelGzipWriter(object):
+    '''A write-only file object that gzip-compresses its data using multiple threads.
+
+    As with pigz, the data is split into blocks that are deflated independently,
+    in a thread pool---zlib releases the GIL while compressing. Each block is
+    primed with the last 32KB of its predecessor as a preset dictionary, so the
+    compression ratio is close to that of a single-threaded compressor, and ends
+    with a sync flush, so the compressed blocks can be concatenated. The result
+    is a single ordinary gzip stream, readable by any gzip decoder.
+
+    Closing the writer completes the gzip stream, but does not close fp.
+    If the writer is used as a context manager and an exception is raised,
+    it is aborted instead, leaving the stream incomplete.
+    '''
+    def __init__(self, fp, compresslevel=9, threads=None, block_size=1024 * 1024):
+        self.fp = fp
+        self.compresslevel = compresslevel
+        self.block_size = block_size
+        self.threads = threads or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=self.threads)
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.dictionary = b''
+        self.crc = 0
+        self.size = 0
+        self.closed = False
+        self.fp.write(b'\x1f\x8b\x08\x00' + struct.pack('<I', int(time.time())) +
+                      (b'\x02' if compresslevel == 9 else b'\x00') + b'\xff')
+
+    def _compress(self, block, dictionary):
+        if dictionary:
+            compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+        else:
+            compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def _submit(self, block):
+        self.crc = zlib.crc32(block, self.crc)
+        self.size += len(block)
+        self.pending.append(self.executor.submit(self._compress, block, self.dictionary))
+        self.dictionary = block[-32768:]
+        # Bound the number of blocks in memory, and write out results in order
+        while self.pending and (len(self.pending) > 2 * self.threads or self.pending[0].done()):
+            self.fp.write(self.pending.popleft().result())
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('write to closed file')
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.block_size:
+            self._submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+            self.buffer.clear()
+        while self.pending:
+            self.fp.write(self.pending.popleft().result())
+        self.executor.shutdown()
+        # An empty final block terminates the deflate stream
+        self.fp.write(zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS).flush())
+        self.fp.write(struct.pack('<II', self.crc, self.size & 0xffffffff))
+        self.closed = True
+
+    def abort(self):
+        # Stops the compression threads without completing the gzip stream
+        if self.closed:
+            return
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.buffer.clear()
+        self.executor.shutdown()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def create_tar_archive(project_directory, arcname, fp, compresslevel=None, threads=None):
+    '''Writes a tar.gz archive of a project directory to a file object.
+
+    Args:
+        project_directory: the directory to archive. Files excluded by
+            .projectignore, or ignored by git, are omitted.
+        arcname: the top-level directory name within the archive.
+        fp: the output file object.
+        compresslevel: the gzip compression level. The default is 9.
+        threads: the number of compression threads. If greater than 1, the
+            archive is compressed with a ParallelGzipWriter. The default is
+            given by the AE5_ARCHIVE_THREADS environment variable, if set,
+            or 1.
+    '''
+    if compresslevel is None:
+        compresslevel = 9
+    if threads is None:
+        threads = ARCHIVE_THREADS
+    if threads > 1:
+        gz = ParallelGzipWriter(fp, compresslevel=compresslevel, threads=threads)
+    elif compresslevel != 9:
+        # The stream modes of tarfile.open do not accept a compression level
+        gz = gzip.GzipFile(fileobj=fp, mode='wb', compresslevel=compresslevel)
+    else:
+        gz = None
+    if gz is None:
+        with tarfile.open(fileobj=fp, mode='w|gz') as tf:
+            _add_project(tf, project_directory, arcname)
+    else:
+        with gz, tarfile.open(fileobj=gz, mode='w|') as tf:
+            _add_project(tf, project_directory, arcname)
+
+
+def _add_project(tf, project_directory, arcname):
+    for abspath, relpath in _list_project(project_directory):
+        tf.add(abspath, os.path.join(arcname, relpath))
+
+
+def _file_digest(path, chunk_size=1024 * 1024):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def project_manifest(project_directory, previous=None):
+    '''Returns a manifest of the files that would be archived from a project directory.
+
+    The manifest maps each relative path to a list [size, mtime_ns, mode, sha256].
+    If a previous manifest is supplied, the hashes of files whose size and
+    modification time are unchanged are reused rather than recomputed.
+    '''
+    previous = previous or {}
+    manifest = {}
+    for abspath, relpath in _list_project(project_directory):
+        st = os.stat(abspath)
+        old = previous.get(relpath)
+        if old and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+            digest = old[3]
+        else:
+            digest = _file_digest(abspath)
+        manifest[relpath] = [st.st_size, st.st_mtime_ns, st.st_mode, digest]
+    return manifest
+
+
+def manifest_changes(old, new):
+    '''Compares two project manifests.
+
+    Returns a dictionary with sorted lists of the "added", "modified", and
+    "removed" files. Changes to modification times alone are ignored.
+    '''
+    return {'added': sorted(set(new) - set(old)),
+            'modified': sorted(k for k in set(new) & set(old) if new[k][2:] != old[k][2:]),
+            'removed': sorted(set(old) - set(new))}
+
+
+class _QueueWriter(object):
+    '''A write-only file object that passes its data to a bounded queue.'''
+    def __init__(self, queue, chunk_size):
+        self.queue = queue
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.cancelled = threading.Event()
+
+    def _put(self, data):
+        while True:
+            if self.cancelled.is_set():
+                raise IOError('Archive consumer has stopped')
+            try:
+                self.queue.put(data, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def write(self, data):
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.chunk_size:
+            self._put(bytes(self.buffer[:self.chunk_size]))
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.buffer:
+            self._put(bytes(self.buffer))
+            self.buffer.clear()
+
+
+def iter_tar_archive(project_directory, arcname, chunk_size=1024 * 1024, queue_size=8,
+                     compresslevel=None, threads=None):
+    '''Generates a tar.gz archive of a project directory, in chunks.
+
+    The archive is built in a background thread, so that compression
+    overlaps with the consumption of the data, e.g. by a network upload.
+    No more than queue_size chunks are buffered at a time, so the memory
+    used is bounded regardless of the size of the project.
+    '''
+    chunks = queue.Queue(maxsize=queue_size)
+    writer = _QueueWriter(chunks, chunk_size)
+    done = object()
+
+    def _produce():
+        try:
+            create_tar_archive(project_directory, arcname, writer, compresslevel, threads)
+            writer.close()
+            result = done
+        except BaseException as exc:
+            result = exc
+        if not writer.cancelled.is_set():
+            writer._put(result)
+
+    thread = threading.Thread(target=_produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                break
+            if isinstance(chunk, BaseException):
+                raise chunk
+            yield chunk
+    finally:
+        writer.cancelled.set()
+        thread.join()
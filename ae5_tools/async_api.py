@@ -0,0 +1,748 @@
+import os
+import sys
+import json
+import asyncio
+import aiohttp
+import requests
+import functools
+
+from collections import deque
+
+from .api import AEUserSession, AEAdminSession, AEException, AEUnexpectedResponseError
+from .api import EmptyRecordList, PUSHDOWN_FIELDS, POOL_IDLE_TIMEOUT, INDEXED_RECORDS
+from .api import _PageScan, _Backoff, _ActionWaiter, _DeploymentWaiter, _RunWaiter
+
+
+# Maximum number of connections an asynchronous session keeps open to the
+# cluster. This bounds the number of requests in flight on the event loop,
+# and is independent of the thread pool limits of the synchronous sessions.
+ASYNC_MAX_CONNECTIONS = int(os.environ.get('AE5_ASYNC_MAX_CONNECTIONS', 100))
+
+
+class AsyncResponse(object):
+    '''A requests-style view of a completed aiohttp response.
+
+    This allows the login detection and error reporting logic of the
+    synchronous sessions to be applied to aiohttp responses unchanged.
+    '''
+    def __init__(self, response, content):
+        self.status_code = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.url = str(response.url)
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncAESessionBase(object):
+    '''Base class for asynchronous AE5 API interactions.
+
+    An asynchronous session wraps a synchronous session of the corresponding
+    type. The synchronous session handles authentication and the persistence
+    of cookies and tokens, and provides the record processing pipeline; the
+    API calls themselves are made with aiohttp, so that many of them can be
+    multiplexed on a single event loop.
+    '''
+    _sync_class = None
+
+    def __init__(self, *args, **kwargs):
+        self.max_connections = kwargs.pop('max_connections', None) or ASYNC_MAX_CONNECTIONS
+        self._sync = self._sync_class(*args, **kwargs)
+        self._client = None
+
+    def __getattr__(self, name):
+        # Fall back to the public data attributes of the synchronous session
+        # (hostname, username, connected, and so forth). Its private state is
+        # reached explicitly through _sync, and the public API methods must be
+        # implemented here.
+        if name.startswith('_'):
+            raise AttributeError(name)
+        value = getattr(self._sync, name)
+        if callable(value):
+            raise AttributeError(f'{type(self).__name__} does not implement {name}')
+        return value
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def _run_sync(self, func, *args, **kwargs):
+        # get_running_loop would be preferable, but requires Python 3.7
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    def _aiohttp_session(self):
+        if self._client is None:
+            connector = aiohttp.TCPConnector(ssl=False, limit=self.max_connections,
+                                             limit_per_host=self.max_connections,
+                                             keepalive_timeout=POOL_IDLE_TIMEOUT)
+            self._client = aiohttp.ClientSession(connector=connector)
+        return self._client
+
+    def _save_cookies(self, response, base):
+        jar = self._sync.session.cookies
+        domain = base.split('://', 1)[-1]
+        for morsel in response.cookies.values():
+            jar.set_cookie(requests.cookies.create_cookie(
+                morsel.key, morsel.value, domain=morsel['domain'] or domain,
+                path=morsel['path'] or '/'))
+
+    async def _request(self, method, url, **kwargs):
+        sync = self._sync
+        headers = dict(sync.session.headers)
+        headers.update(kwargs.pop('headers', None) or {})
+        cookie = requests.cookies.get_cookie_header(sync.session.cookies, requests.Request(method, url))
+        if cookie:
+            headers['Cookie'] = cookie
+        if kwargs.get('params'):
+            kwargs['params'] = {k: str(v) for k, v in kwargs['params'].items()}
+        client = self._aiohttp_session()
+        async with client.request(method, url, headers=headers, allow_redirects=False, **kwargs) as resp:
+            content = await resp.read()
+            self._save_cookies(resp, url.split('/', 3)[2])
+            return AsyncResponse(resp, content)
+
+    async def _api(self, method, endpoint, **kwargs):
+        sync = self._sync
+        format = kwargs.pop('format', None)
+        base, url = sync._base_url(endpoint, kwargs.pop('subdomain', None))
+        policy = sync._retry_policy(kwargs.pop('retry', None))
+        do_save = False
+        allow_retry = True
+        auth_count = sync._auth_count
+        if not sync.connected:
+            await self._run_sync(sync._reauthorize, auth_count)
+            auth_count = sync._auth_count
+            if sync.password is not None:
+                allow_retry = False
+        retries = redirects = 0
+        waited = 0.0
+        while True:
+            try:
+                response = await self._request(method, url, **kwargs)
+            except aiohttp.ClientConnectionError:
+                delay = policy.retry_delay(method, retries)
+                if delay is None:
+                    raise AEUnexpectedResponseError('Unable to connect', method, url, **kwargs)
+                retries += 1
+                await asyncio.sleep(delay)
+                continue
+            except asyncio.TimeoutError:
+                raise AEUnexpectedResponseError('Connection timeout', method, url, **kwargs)
+            if 300 <= response.status_code < 400:
+                # See AESessionBase._api for a discussion of these redirects
+                url2 = response.headers['location'].rstrip()
+                if url2.startswith('/'):
+                    url2 = f'{base}{url2}'
+                if url2 == url:
+                    delay = policy.redirect_delay(redirects, waited)
+                    if delay is None:
+                        raise AEUnexpectedResponseError('Too many self-redirects', method, url, **kwargs)
+                    redirects += 1
+                    waited += delay
+                    await asyncio.sleep(delay)
+                else:
+                    do_save = True
+                    redirects = 0
+                url = url2
+                method = 'get'
+            elif allow_retry and (response.status_code == 401 or sync._is_login(response)):
+                await self._run_sync(sync._reauthorize, auth_count)
+                auth_count = sync._auth_count
+                if sync.password is not None:
+                    allow_retry = False
+                redirects = 0
+            elif response.status_code >= 400:
+                delay = policy.retry_delay(method, retries, response.status_code,
+                                           response.headers.get('retry-after'))
+                if delay is None:
+                    raise AEUnexpectedResponseError(response, method, url, **kwargs)
+                retries += 1
+                await asyncio.sleep(delay)
+            else:
+                policy.success()
+                if do_save and sync.persist:
+                    sync._save()
+                break
+        if format == 'response':
+            return response
+        if len(response.content) == 0:
+            return None
+        if format == 'blob':
+            return response.content
+        if format == 'text':
+            return response.text
+        if 'json' in response.headers.get('content-type', ''):
+            return response.json()
+        return response.text
+
+    async def api(self, method, endpoint, **kwargs):
+        format = kwargs.pop('format', None)
+        response = await self._api(method, endpoint, **kwargs)
+        return self._sync._format_response(response, format=format)
+
+    async def _get(self, endpoint, **kwargs):
+        return await self._api('get', endpoint, **kwargs)
+
+    async def _delete(self, endpoint, **kwargs):
+        return await self._api('delete', endpoint, **kwargs)
+
+    async def _post(self, endpoint, **kwargs):
+        return await self._api('post', endpoint, **kwargs)
+
+    async def _head(self, endpoint, **kwargs):
+        return await self._api('head', endpoint, **kwargs)
+
+    async def _put(self, endpoint, **kwargs):
+        return await self._api('put', endpoint, **kwargs)
+
+    async def _patch(self, endpoint, **kwargs):
+        return await self._api('patch', endpoint, **kwargs)
+
+    async def _prepare_records(self, record_type, records):
+        # Hook for retrieving, without blocking, any data that
+        # the synchronous _pre_* methods will need
+        pass
+
+    async def _fix_records(self, record_type, records, filter=None, **kwargs):
+        # The stages of AESessionBase._fix_records are shared; the _post_*
+        # methods may be overridden here with coroutines when they require
+        # additional API calls.
+        sync = self._sync
+        records, is_single = sync._unwrap_records(records)
+        if hasattr(sync, f'_pre_{record_type}'):
+            await self._prepare_records(record_type, records)
+        records, postfilt = sync._pre_records(record_type, records, filter)
+        post = f'_post_{record_type}'
+        if hasattr(type(self), post):
+            records = await getattr(self, post)(records, **kwargs)
+        elif hasattr(sync, post):
+            records = getattr(sync, post)(records, **kwargs)
+        return sync._post_records(records, postfilt, is_single)
+
+    async def _ident_record(self, record_type, ident, quiet=False, **kwargs):
+        if isinstance(ident, dict) and ident.get('_record_type', '') == record_type:
+            return ident
+        filter = self._sync._ident_filter(record_type, ident)
+        matches = None
+        id = self._sync._filter_id(record_type, filter)
+        if id is not None:
+            try:
+                record = await self._get(f'{record_type}s/{id}')
+            except AEUnexpectedResponseError:
+                record = None
+            if isinstance(record, dict):
+                record = await self._fix_records(record_type, record, filter, **kwargs)
+                matches = EmptyRecordList(record_type) if record is None else [record]
+        if matches is None:
+            matches = await getattr(self, f'{record_type}_list')(filter=filter, **kwargs)
+            if not matches and record_type in INDEXED_RECORDS:
+                self._sync._invalidate_index()
+                matches = await getattr(self, f'{record_type}_list')(filter=filter, **kwargs)
+        return self._sync._should_be_one(matches, filter, quiet)
+
+
+class AsyncAEUserSession(AsyncAESessionBase):
+    '''An asyncio version of AEUserSession.
+
+    The constructor accepts the same arguments as AEUserSession. The core
+    record operations on projects, sessions, deployments, jobs, and runs are
+    provided as coroutines; for instance,
+
+        async with AsyncAEUserSession(hostname, username) as s:
+            projects, deployments = await asyncio.gather(s.project_list(), s.deployment_list())
+    '''
+    _sync_class = AEUserSession
+
+    async def _api_records(self, method, endpoint, filter=None, **kwargs):
+        record_type = kwargs.pop('record_type', None)
+        api_kwargs = kwargs.pop('api_kwargs', None) or {}
+        if not record_type:
+            record_type = endpoint.rsplit('/', 1)[-1].rstrip('s')
+        api_kwargs, pushed = self._sync._pushdown(method, endpoint, filter, api_kwargs)
+        records = await self._api(method, endpoint, **api_kwargs)
+        if filter and endpoint in PUSHDOWN_FIELDS:
+            self._sync._count_pushdown(pushed, records)
+        return await self._fix_records(record_type, records, filter, **kwargs)
+
+    def pushdown_stats(self):
+        return self._sync.pushdown_stats()
+
+    async def _get_records(self, endpoint, filter=None, **kwargs):
+        return await self._api_records('get', endpoint, filter=filter, **kwargs)
+
+    async def _post_record(self, endpoint, filter=None, **kwargs):
+        return await self._api_records('post', endpoint, filter=filter, **kwargs)
+
+    async def _record_index(self, endpoint, ids=()):
+        # The index is shared with the synchronous session
+        index = self._sync._index_lookup(endpoint, ids)
+        if index is None:
+            index = self._sync._index_store(endpoint, await self._get_records(endpoint), ids)
+        return index
+
+    async def _prepare_records(self, record_type, records):
+        if record_type in ('session', 'job', 'run'):
+            pids = ['a0-' + rec['project_url'].rsplit('/', 1)[-1] for rec in records]
+            await self._record_index('projects', pids)
+        elif record_type == 'endpoint':
+            await asyncio.gather(self._record_index('deployments'), self._record_index('projects'))
+
+    async def _join_collaborators(self, what, response):
+        if isinstance(response, dict):
+            await self._join_collaborators(what, [response])
+        elif response:
+            limiter = asyncio.Semaphore(max(1, self._sync.max_concurrency))
+
+            async def _collaborators(rec):
+                async with limiter:
+                    return await self._get_records(f'{rec["_record_type"]}s/{rec["id"]}/collaborators')
+            collabs = await asyncio.gather(*map(_collaborators, response))
+            for rec, collab in zip(response, collabs):
+                rec['collaborators'] = ', '.join(c['id'] for c in collab)
+                rec['_collaborators'] = collab
+        elif hasattr(response, '_columns'):
+            response._columns.extend(('collaborators', '_collaborators'))
+
+    async def _post_project(self, records, collaborators=False):
+        if collaborators:
+            await self._join_collaborators('projects', records)
+        return records
+
+    async def _post_session(self, records, k8s=False):
+        if k8s:
+            return await self._run_sync(self._sync._join_k8s, records, changes=True)
+        return records
+
+    _post_run = _post_session
+
+    async def _post_deployment(self, records, collaborators=False, k8s=False):
+        if collaborators:
+            await self._join_collaborators('deployments', records)
+        if k8s:
+            return await self._run_sync(self._sync._join_k8s, records, changes=False)
+        return records
+
+    async def _revision(self, ident, keep_latest=False, quiet=False):
+        latest = 'keep' if keep_latest else True
+        ident, filter, latest = self._sync._revision_filter(ident, None, latest)
+        prec = await self._ident_record('project', ident, quiet=quiet)
+        if prec is None:
+            return None
+        response = await self._get_records(f'projects/{prec["id"]}/revisions', filter=filter, project=prec)
+        if latest == 'keep' and response:
+            response[0]['name'] = 'latest'
+        return self._sync._should_be_one(response, filter, quiet)
+
+    async def _wait_many(self, responses, timeout=None):
+        waiter = _ActionWaiter(responses)
+        backoff = _Backoff(timeout)
+        while waiter.pending:
+            delay = backoff.delay()
+            if delay is None:
+                raise waiter.timeout_error(timeout)
+            await asyncio.sleep(delay)
+            requests = waiter.requests()
+            activities = await asyncio.gather(*(self._get(endpoint, params=params)
+                                                for _, endpoint, params in requests))
+            for request, activity in zip(requests, activities):
+                waiter.update(request[0], activity)
+
+    async def _wait(self, response, timeout=None):
+        await self._wait_many([response], timeout=timeout)
+
+    async def project_wait(self, idents, timeout=None, format=None):
+        single = not isinstance(idents, list)
+        precs = [await self._ident_record('project', ident) for ident in ([idents] if single else idents)]
+        params = {'sort': '-updated', 'page[size]': 1}
+        latest = await asyncio.gather(*(self._get_records(f'projects/{prec["id"]}/activity',
+                                                          api_kwargs={'params': params}) for prec in precs))
+        responses = [{'id': prec['id'], 'action': records[0]} for prec, records in zip(precs, latest) if records]
+        await self._wait_many(responses, timeout=timeout)
+        records = await self._fix_records('activity', [response['action'] for response in responses])
+        return self._sync._format_response(records[0] if single and records else records, format=format)
+
+    async def _list(self, record_type, filter=None, format=None, **kwargs):
+        records = await self._get_records(record_type + 's', filter, **kwargs)
+        return self._sync._format_response(records, format=format, record_type=record_type)
+
+    async def _info(self, record_type, ident, format=None, quiet=False, **kwargs):
+        record = await self._ident_record(record_type, ident, quiet=quiet, **kwargs)
+        return self._sync._format_response(record, format=format)
+
+    async def project_list(self, filter=None, collaborators=False, format=None):
+        return await self._list('project', filter, format, collaborators=collaborators)
+
+    async def project_info(self, ident, collaborators=False, format=None, quiet=False):
+        return await self._info('project', ident, format, quiet, collaborators=collaborators)
+
+    async def project_patch(self, ident, format=None, **kwargs):
+        prec = await self._ident_record('project', ident)
+        data = {k: v for k, v in kwargs.items() if v is not None}
+        if data:
+            id = prec["id"]
+            await self._patch(f'projects/{id}', json=data)
+            self._sync._invalidate_index('projects')
+            prec = await self._ident_record('project', id)
+        return self._sync._format_response(prec, format=format)
+
+    async def project_delete(self, ident, format=None):
+        id = (await self._ident_record('project', ident))['id']
+        await self._delete(f'projects/{id}')
+        self._sync._invalidate_index('projects')
+
+    async def project_collaborator_list(self, ident, filter=None, format=None):
+        id = (await self._ident_record('project', ident))['id']
+        response = await self._get_records(f'projects/{id}/collaborators', filter)
+        return self._sync._format_response(response, format=format)
+
+    async def project_create(self, url, name=None, tag=None, make_unique=None, wait=True, format=None):
+        if not name:
+            parts = requests.packages.urllib3.util.parse_url(url)
+            name = parts.path.rsplit('/', 1)[-1].split('.', 1)[0]
+            if make_unique is None:
+                make_unique = True
+        params = {'name': name, 'source': url, 'make_unique': bool(make_unique)}
+        if tag:
+            params['tag'] = tag
+        response = await self._post_record('projects', api_kwargs={'json': params})
+        self._sync._invalidate_index('projects')
+        if response.get('error'):
+            raise RuntimeError('Error creating project: {}'.format(response['error']['message']))
+        if wait:
+            await self._wait(response)
+        if response['action']['error']:
+            raise RuntimeError('Error processing creation: {}'.format(response['action']['message']))
+        return await self.project_info(response['id'], format=format)
+
+    async def session_list(self, filter=None, k8s=False, format=None):
+        return await self._list('session', filter, format, k8s=k8s)
+
+    async def session_info(self, ident, k8s=False, format=None, quiet=False):
+        return await self._info('session', ident, format, quiet, k8s=k8s)
+
+    async def session_start(self, ident, editor=None, resource_profile=None, wait=True, open=False, frame=True, format=None):
+        prec = await self._ident_record('project', ident)
+        id = prec['id']
+        patches = {}
+        if editor and prec['editor'] != editor:
+            patches['editor'] = editor
+        if resource_profile and prec['resource_profile'] != resource_profile:
+            patches['resource_profile'] = resource_profile
+        if patches:
+            await self._patch(f'projects/{id}', json=patches)
+        response = await self._post_record(f'projects/{id}/sessions')
+        if response.get('error'):
+            raise RuntimeError('Error starting project: {}'.format(response['error']['message']))
+        if wait or open:
+            await self._wait(response)
+        if response['action'].get('error'):
+            raise RuntimeError('Error completing session start: {}'.format(response['action']['message']))
+        if open:
+            await self.session_open(response, frame)
+        return self._sync._format_response(response, format=format)
+
+    async def session_open(self, ident, frame=True, format=None):
+        srec = await self._ident_record('session', ident)
+        await self._run_sync(self._sync.session_open, srec, frame)
+
+    async def session_stop(self, ident, format=None):
+        id = (await self._ident_record('session', ident))['id']
+        await self._delete(f'sessions/{id}')
+
+    async def deployment_list(self, filter=None, collaborators=False, k8s=False, format=None):
+        return await self._list('deployment', filter, format, collaborators=collaborators, k8s=k8s)
+
+    async def deployment_info(self, ident, collaborators=False, k8s=False, format=None, quiet=False):
+        return await self._info('deployment', ident, format, quiet, collaborators=collaborators, k8s=k8s)
+
+    async def deployment_collaborator_list_set(self, ident, collabs, format=None):
+        id = (await self._ident_record('deployment', ident))['id']
+        result = await self._put(f'deployments/{id}/collaborators', json=collabs)
+        if result['action']['error'] or 'collaborators' not in result:
+            raise AEException(f'Unexpected error adding collaborator: {result}')
+        result = await self._fix_records('collaborator', result['collaborators'])
+        return self._sync._format_response(result, format=format)
+
+    async def deployment_start(self, ident, name=None, endpoint=None, command=None,
+                               resource_profile=None, public=False,
+                               collaborators=None, wait=True, open=False, frame=False,
+                               stop_on_error=False, format=None):
+        rrec = await self._revision(ident, keep_latest=True)
+        id = rrec['project_id']
+        data = self._sync._deployment_data(rrec, name, endpoint, command, resource_profile, public)
+        if endpoint:
+            try:
+                await self._head('/_errors/404.html', subdomain=endpoint)
+                raise AEException('endpoint "{}" is already in use'.format(endpoint))
+            except AEUnexpectedResponseError:
+                pass
+        response = await self._post_record(f'projects/{id}/deployments', api_kwargs={'json': data})
+        self._sync._invalidate_index('deployments')
+        id = response['id']
+        if response.get('error'):
+            raise AEException('Error starting deployment: {}'.format(response['error']['message']))
+        if collaborators:
+            await self.deployment_collaborator_list_set(id, collaborators)
+        if wait or stop_on_error:
+            waiter, backoff = _DeploymentWaiter([response]), _Backoff()
+            while waiter.pending:
+                await asyncio.sleep(backoff.delay())
+                waiter.update([await self._get_records(f'deployments/{id}', record_type='deployment')])
+            response = waiter.results[0]
+            if response['state'] != 'started':
+                if stop_on_error:
+                    await self.deployment_stop(id)
+                raise AEException(f'Error completing deployment start: {response["status_text"]}')
+        if open:
+            await self.deployment_open(response, frame)
+        return self._sync._format_response(response, format=format)
+
+    async def deployment_open(self, ident, frame=False, format=None):
+        drec = await self._ident_record('deployment', ident)
+        await self._run_sync(self._sync.deployment_open, drec, frame)
+
+    async def deployment_start_many(self, specs, max_concurrency=None, wait=True, stop_on_error=False,
+                                    timeout=None, return_exceptions=True):
+        sync = self._sync
+        semaphore = asyncio.Semaphore(max_concurrency or sync.max_concurrency)
+
+        async def _submit(kwargs):
+            async with semaphore:
+                try:
+                    return await self.deployment_start(**kwargs)
+                except Exception as exc:
+                    return exc
+
+        specs = [sync._deployment_spec(spec) for spec in specs]
+        results = list(await asyncio.gather(*(_submit(spec) for spec in specs)))
+        if wait or stop_on_error:
+            waiter = _DeploymentWaiter(results)
+            backoff = _Backoff(timeout)
+            while waiter.pending:
+                delay = backoff.delay()
+                if delay is None:
+                    waiter.expire(timeout)
+                    break
+                await asyncio.sleep(delay)
+                waiter.update(await self._get_records('deployments'))
+            failed = waiter.failures()
+            if stop_on_error and failed:
+                async def _stop(id):
+                    async with semaphore:
+                        await self.deployment_stop(id)
+                await asyncio.gather(*(_stop(id) for id in failed))
+        if not return_exceptions:
+            error = next((rec for rec in results if isinstance(rec, Exception)), None)
+            if error is not None:
+                raise error
+        return results
+
+    async def deployment_stop(self, ident, format=None):
+        id = (await self._ident_record('deployment', ident))['id']
+        await self._delete(f'deployments/{id}')
+        self._sync._invalidate_index('deployments')
+
+    async def job_list(self, filter=None, format=None):
+        return await self._list('job', filter, format)
+
+    async def job_info(self, ident, format=None, quiet=False):
+        return await self._info('job', ident, format, quiet)
+
+    async def job_runs(self, ident, format=None):
+        id = (await self._ident_record('job', ident))['id']
+        response = await self._get_records(f'jobs/{id}/runs')
+        return self._sync._format_response(response, format=format)
+
+    async def _job_name_index(self):
+        # The index is shared with the synchronous session
+        names = self._sync._cached_job_names()
+        if names is None:
+            names = self._sync._store_job_names(*await asyncio.gather(self._get('jobs'), self._get('runs')))
+        return names
+
+    async def _unique_job_name(self, name):
+        return self._sync._claim_job_name(name, await self._job_name_index())
+
+    async def _job_name_taken(self, name):
+        self._sync._invalidate_job_names()
+        return name in await self._job_name_index()
+
+    async def _submit_job(self, id, data):
+        try:
+            response = await self._post_record(f'projects/{id}/jobs', api_kwargs={'json': data})
+        except AEUnexpectedResponseError as exc:
+            return exc
+        if response.get('error'):
+            return AEException('Error starting job: {}'.format(response['error']['message']))
+        return response
+
+    async def job_create(self, ident, schedule=None, name=None, command=None,
+                         resource_profile=None, variables=None, run=None,
+                         wait=None, cleanup=False, make_unique=None,
+                         show_run=False, format=None):
+        sync = self._sync
+        run, wait = sync._job_options(schedule, run, wait, cleanup)
+        rrec = await self._revision(ident, keep_latest=True)
+        id = rrec['project_id']
+        base, make_unique = sync._job_name(rrec, name, command, make_unique)
+        name = await self._unique_job_name(base) if make_unique else base
+        data = sync._job_data(rrec, schedule, name, command, resource_profile, variables, run)
+        response = await self._submit_job(id, data)
+        if isinstance(response, Exception) and make_unique and await self._job_name_taken(name):
+            data['name'] = await self._unique_job_name(base)
+            response = await self._submit_job(id, data)
+        if isinstance(response, Exception):
+            raise response
+        if run:
+            jid = response['id']
+            run = (await self._get_records(f'jobs/{jid}/runs'))[-1]
+            if wait:
+                run = (await self._wait_runs([run]))[0]
+                if cleanup:
+                    await self._delete(f'jobs/{jid}')
+            if show_run:
+                response = run
+        return sync._format_response(response, format=format)
+
+    async def job_delete(self, ident, format=None):
+        id = (await self._ident_record('job', ident))['id']
+        await self._delete(f'jobs/{id}')
+
+    async def run_list(self, k8s=False, filter=None, format=None):
+        return await self._list('run', filter, format, k8s=k8s)
+
+    async def run_info(self, ident, k8s=False, format=None, quiet=False):
+        return await self._info('run', ident, format, quiet, k8s=k8s)
+
+    async def _wait_runs(self, records, timeout=None):
+        waiter = _RunWaiter(records)
+        if not waiter.pending:
+            return waiter.records
+        backoff = waiter.backoff(timeout)
+        while waiter.pending:
+            delay = backoff.delay()
+            if delay is None:
+                raise waiter.timeout_error(timeout)
+            await asyncio.sleep(delay)
+            waiter.update(await asyncio.gather(*(self._get(e) for e in waiter.requests())))
+        return await self._fix_records('run', waiter.records)
+
+    async def run_wait(self, ids=None, filter=None, timeout=None, format=None):
+        single = ids is not None and not isinstance(ids, list)
+        if ids is None:
+            records = await self._get_records('runs', filter=filter)
+        else:
+            records = [await self._ident_record('run', ident) for ident in ([ids] if single else ids)]
+        if records:
+            records = await self._wait_runs(records, timeout=timeout)
+        return self._sync._format_response(records[0] if single else records, format=format)
+
+    async def run_log(self, ident, format=None):
+        id = (await self._ident_record('run', ident))['id']
+        return (await self._get(f'runs/{id}/logs'))['job']
+
+    async def run_stop(self, ident, format=None):
+        id = (await self._ident_record('run', ident))['id']
+        response = await self._post(f'runs/{id}/stop')
+        return self._sync._format_response(response, format=format)
+
+    async def run_delete(self, ident, format=None):
+        id = (await self._ident_record('run', ident))['id']
+        await self._delete(f'runs/{id}')
+
+
+class AsyncAEAdminSession(AsyncAESessionBase):
+    '''An asyncio version of AEAdminSession.
+
+    The constructor accepts the same arguments as AEAdminSession.
+    '''
+    _sync_class = AEAdminSession
+
+    async def _iter_paginated(self, path, total=None, **kwargs):
+        # Follows the same _PageScan plan as AEAdminSession._iter_paginated,
+        # with tasks in place of the worker threads.
+        scan = _PageScan(kwargs.pop('first', 0), kwargs.pop('limit', sys.maxsize),
+                         total, self._sync.max_concurrency)
+        pending = deque()
+
+        def _submit():
+            while len(pending) < scan.depth():
+                request = scan.next_request()
+                if request is None:
+                    break
+                task = asyncio.ensure_future(self._get(path, params=scan.params(request, kwargs)))
+                pending.append((request, task))
+
+        try:
+            _submit()
+            while pending:
+                request, task = pending.popleft()
+                page = scan.receive(request, await task)
+                _submit()
+                yield page
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    async def _user_count(self):
+        try:
+            return int(await self._get('users/count'))
+        except (AEUnexpectedResponseError, TypeError, ValueError):
+            return None
+
+    async def _get_paginated(self, path, **kwargs):
+        return [rec async for page in self._iter_paginated(path, **kwargs) for rec in page]
+
+    async def iter_user_events(self, **kwargs):
+        async for page in self._iter_paginated('events', **kwargs):
+            for rec in page:
+                yield rec
+
+    async def user_events(self, format=None, **kwargs):
+        records = [rec async for rec in self.iter_user_events(**kwargs)]
+        return self._sync._format_response(records, format=format, columns=[])
+
+    async def _last_logins(self):
+        # Uses the same persisted index as AEAdminSession._last_logins
+        sync = self._sync
+        watermark, last_logins = sync._load_login_index()
+        new_watermark = watermark
+        async for page in self._iter_paginated('events', **sync._login_params(watermark)):
+            new_watermark = sync._merge_logins(last_logins, page, new_watermark)
+        if new_watermark != watermark:
+            sync._save_login_index(new_watermark, last_logins)
+        return last_logins
+
+    async def _post_user(self, users, last_logins=None):
+        if last_logins is None:
+            last_logins = await self._last_logins()
+        return self._sync._post_user(users, last_logins=last_logins)
+
+    async def iter_users(self, filter=None):
+        last_logins = await self._last_logins()
+        async for page in self._iter_paginated('users', total=await self._user_count()):
+            for rec in await self._fix_records('user', page, filter, last_logins=last_logins):
+                yield rec
+
+    async def user_list(self, filter=None, format=None):
+        users = await self._get_paginated('users', total=await self._user_count())
+        users = await self._fix_records('user', users, filter)
+        return self._sync._format_response(users, format=format)
+
+    async def user_info(self, ident, format=None, quiet=False):
+        response = await self._ident_record('user', ident, quiet=quiet)
+        return self._sync._format_response(response, format)
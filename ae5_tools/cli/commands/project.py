@@ -8,7 +8,7 @@ from .deployment import start as deployment_start
 from .job import _create
 
 
-@click.group(short_help='activity, collaborator, delete, deploy, deployments, download, image, info, jobs, list, patch, revision, run, runs, schedule, sessions, status, upload',
+@click.group(short_help='activity, collaborator, delete, deploy, deployments, download, image, info, jobs, list, patch, revision, run, runs, schedule, sessions, status, upload, wait',
              epilog='Type "ae5 project <command> --help" for help on a specific command.')
 @global_options
 def project():
@@ -142,6 +142,21 @@ def status():
     cluster_call('project_activity', latest=True)
 
 
+@project.command()
+@ident_filter('project', required=True)
+@click.option('--timeout', type=float, default=None, help='The maximum number of seconds to wait. By default, waits indefinitely.')
+@global_options
+def wait(**kwargs):
+    '''Wait for the project's latest action to complete.
+
+       The PROJECT identifier need not be fully specified, and may even include
+       wildcards. But it must match exactly one project.
+
+       Returns the final activity entry of the action.
+    '''
+    cluster_call('project_wait', **kwargs)
+
+
 @project.command()
 @ident_filter('project', required=True, handle_revision=True)
 @click.option('--filename', default='', help='Filename to save to. If not supplied, the filename is constructed from the name of the project.')
@@ -187,15 +202,19 @@ def image(**kwargs):
 @click.option('--name', default='', help='Name of the project.')
 @click.option('--tag', default='', help='Commit tag to use for initial revision of project.')
 @click.option('--no-wait', is_flag=True, help='Do not wait for the creation seesion to complete before exiting.')
+@click.option('--stream', is_flag=True, help='Read or build the archive while uploading it, rather than loading it into memory beforehand. Recommended for large projects.')
+@click.option('--cache', is_flag=True, help='When uploading a directory, keep its archive in a local cache, and reuse it on later uploads of the same project if no files have changed. The files changed since the last upload are listed.')
+@click.option('--threads', type=int, default=None, help='When uploading a directory, the number of threads used to compress its archive. The default is 1, or the value of the AE5_ARCHIVE_THREADS environment variable.')
 @global_options
-def upload(filename, name, tag, no_wait):
+def upload(filename, name, tag, no_wait, stream, cache, threads):
     '''Upload a project.
 
        By default, the name of the project is taken from the basename of
        the file. This can be overridden by using the --name option. The
        name must not be the same as an existing project.
     '''
-    cluster_call('project_upload', filename, name=name, tag=tag, wait=not no_wait)
+    cluster_call('project_upload', filename, name=name, tag=tag, wait=not no_wait, stream=stream, cache=cache,
+                 threads=threads)
 
 
 @project.command()
@@ -4,7 +4,7 @@ from ..login import cluster_call
 from ..utils import global_options, ident_filter, yes_option
 
 
-@click.group(short_help='delete, info, list, log, stop',
+@click.group(short_help='delete, info, list, log, stop, wait',
              epilog='Type "ae5 run <command> --help" for help on a specific command.')
 @global_options
 def run():
@@ -84,3 +84,18 @@ def delete(**kwargs):
                  confirm='Delete run {ident}',
                  prefix='Deleting run {ident}...',
                  postfix='deleted.')
+
+
+@run.command()
+@ident_filter('run')
+@click.option('--timeout', type=float, default=None, help='The maximum number of seconds to wait. By default, waits indefinitely.')
+@global_options
+def wait(**kwargs):
+    '''Wait for one or more runs to finish.
+
+       Waits for all of the runs matching the optional RUN argument and any
+       --filter options, and then lists their final records. A single
+       polling loop serves all of the runs, so waiting on many runs at once
+       costs no more API calls than waiting on one.
+    '''
+    cluster_call('run_wait', **kwargs)
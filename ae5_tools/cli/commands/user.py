@@ -2,7 +2,7 @@ import sys
 import click
 
 from ..login import cluster_call
-from ..utils import global_options, ident_filter
+from ..utils import global_options, ident_filter, get_options
 
 
 @click.group(short_help='info, list',
@@ -42,8 +42,10 @@ def info():
 def events(param, limit, first):
     '''Retrieve KeyCloak events.
 
-    Each PARAM argument must be of the form <key>=<value>.
+    Each PARAM argument must be of the form <key>=<value>. With --format ndjson,
+    the events are written as they are retrieved, one page at a time.
     '''
     param = [z.split('=', 1) for z in param]
     param = dict((x.rstrip(), y.lstrip()) for x, y in param)
-    cluster_call('user_events', limit=limit, first=first, **param, admin=True)
+    method = 'iter_user_events' if get_options().get('format') == 'ndjson' else 'user_events'
+    cluster_call(method, limit=limit, first=first, **param, admin=True)
@@ -1,14 +1,13 @@
 import os
-import re
 import csv
 import sys
 import json
 import click
 
-from fnmatch import fnmatch
 from datetime import datetime
 
 from .utils import param_callback, click_text, get_options, GLOBAL_OPTIONS
+from ..filter import compile_filter, _str
 from ..k8s.transformer import _to_float
 
 
@@ -78,7 +77,7 @@ is interpreted as <filter1> AND (<filter2> OR <filter3>).
 
 
 _format_help = {
-    'format': 'Output format: "text" (default), "csv", and "json".',
+    'format': 'Output format: "text" (default), "csv", "json", and "ndjson". The "ndjson" format writes one compact JSON record per line, as the records are produced, for streaming into tools like jq.',
     'filter': 'Filter the rows with a comma-separated list of <field>=<value> pairs. Use the --help-filter option for more information on how to construct filter operations.',
     'columns': 'Limit the output to a comma-separated list of columns.',
     'sort': 'Sort the rows by a comma-separated list of fields.',
@@ -92,7 +91,7 @@ _format_options = [
     click.option('--filter', type=str, default=None, expose_value=False, callback=param_callback, hidden=True, multiple=True),
     click.option('--columns', type=str, default=None, expose_value=False, callback=param_callback, hidden=True),
     click.option('--sort', type=str, default=None, expose_value=False, callback=param_callback, hidden=True),
-    click.option('--format', type=click.Choice(['text', 'csv', 'json']), default=None, expose_value=False, callback=param_callback, hidden=True),
+    click.option('--format', type=click.Choice(['text', 'csv', 'json', 'ndjson']), default=None, expose_value=False, callback=param_callback, hidden=True),
     click.option('--width', type=int, default=None, expose_value=False, callback=param_callback, hidden=True),
     click.option('--wide', is_flag=True, default=None, expose_value=False, callback=param_callback, hidden=True),
     click.option('--header/--no-header', default=None, expose_value=False, callback=param_callback, hidden=True),
@@ -114,45 +113,21 @@ def format_options():
     return apply
 
 
-OPS = {'<': lambda x, y: x < y,
-       '>': lambda x, y: x > y,
-       '=': lambda x, y: fnmatch(x, y),
-       '<=': lambda x, y: x <= y,
-       '>=': lambda x, y: x >= y,
-       '==': lambda x, y: x == y,
-       '!=': lambda x, y: not fnmatch(x, y)}
-
-
 def filter_df(records, _columns, filter, columns, drop_under):
     if columns:
         columns = columns.split(',')
         missing = '\n  - '.join(set(columns) - set(_columns))
         if missing:
             raise click.UsageError(f'One or more of the requested columns were not found:\n  - {missing}')
-    mask0 = None
-    for filt1 in filter or ():
-        mask1 = None
-        for filt2 in filt1.split(','):
-            mask2 = None
-            for filt3 in filt2.split('|'):
-                mask3 = None
-                for filt4 in filt3.split('&'):
-                    parts = re.split(r'(==?|!=|>=?|<=?)', filt4.strip())
-                    if len(parts) != 3:
-                        raise click.UsageError(f'Invalid filter string: {filt4}\n   Required format: <fieldname><op><value>')
-                    field, op, value = list(map(str.strip, parts))
-                    try:
-                        ndx = _columns.index(field)
-                    except ValueError:
-                        raise click.UsageError(f'Invalid filter field: {field}')
-                    op = OPS[op]
-                    mask4 = [op(_str(rec[ndx]), value) for rec in records]
-                    mask3 = mask4 if mask3 is None else [m1 and m2 for m1, m2 in zip(mask3, mask4)]
-                mask2 = mask3 if mask2 is None else [m1 or m2 for m1, m2 in zip(mask2, mask3)]
-            mask1 = mask2 if mask1 is None else [m1 and m2 for m1, m2 in zip(mask1, mask2)]
-        mask0 = mask1 if mask0 is None else [m1 and m2 for m1, m2 in zip(mask0, mask1)]
-    if mask0:
-        records = [rec for rec, flag in zip(records, mask0) if flag]
+    if filter:
+        try:
+            compiled = compile_filter(filter)
+        except ValueError as exc:
+            raise click.UsageError(str(exc))
+        for field in compiled.fields:
+            if field not in _columns:
+                raise click.UsageError(f'Invalid filter field: {field}')
+        records = compiled(records, _columns)
     if not columns and drop_under:
         columns = [c for c in _columns if not c.startswith('_')]
     if columns:
@@ -163,6 +138,33 @@ def filter_df(records, _columns, filter, columns, drop_under):
     return records, _columns
 
 
+def filter_records(records, filter, columns):
+    '''Filters a stream of dictionary records, and selects their columns.
+
+    The records are consumed lazily. Since they need not share the same
+    keys, the filter fields and the requested columns are validated against
+    the first record only.
+    '''
+    match, fields = None, []
+    if filter:
+        try:
+            compiled = compile_filter(filter)
+        except ValueError as exc:
+            raise click.UsageError(str(exc))
+        match, fields = compiled.matcher(), compiled.fields
+    columns = columns.split(',') if columns else None
+    for ndx, rec in enumerate(records):
+        if ndx == 0:
+            missing = '\n  - '.join(f for f in (columns or []) + fields if f not in rec)
+            if missing:
+                raise click.UsageError(f'One or more of the requested fields were not found:\n  - {missing}')
+        if match is not None and not match(rec):
+            continue
+        if columns:
+            rec = {col: rec[col] for col in columns if col in rec}
+        yield rec
+
+
 def _strsort(x):
     if isinstance(x, str):
         return x.lower()
@@ -170,6 +172,13 @@ def _strsort(x):
         return x
 
 
+def _sort_func(col):
+    # A bit of a hack here to allow these fields to be sorted semantically
+    if col in ('cpu', 'gpu', 'mem') or col.endswith(('/cpu', '/gpu', '/mem')):
+        return _to_float
+    return _strsort
+
+
 def sort_df(records, columns, s_columns):
     if not records or not columns:
         return records
@@ -183,26 +192,25 @@ def sort_df(records, columns, s_columns):
             ndxc = columns.index(col)
         except ValueError:
             raise click.UsageError(f'Invalid sort field: {col}')
-        # A bit of a hack here to allow these fields to be sorted semantically
-        if col in ('cpu', 'gpu', 'mem') or col.endswith(('/cpu', '/gpu', '/mem')):
-            sfunc = _to_float
-        else:
-            sfunc = _strsort
+        sfunc = _sort_func(col)
         vals = [sfunc(records[x][ndxc]) for x in ndxs]
         ndx2 = sorted(ndx0, key=lambda x: vals[x], reverse=desc)
         ndxs = [ndxs[x] for x in ndx2]
     return [records[x] for x in ndxs]
 
 
-def _str(x, isodate=False):
-    if x is None:
-        return ''
-    elif isinstance(x, datetime):
-        if isodate:
-            return x.isoformat()
-        return x.strftime("%m-%d-%Y %H:%M:%S")
-    else:
-        return str(x)
+def sort_records(records, s_columns):
+    if not records:
+        return records
+    for col in s_columns.split(',')[::-1]:
+        desc = col.startswith('-')
+        if desc:
+            col = col[1:]
+        if col not in records[0]:
+            raise click.UsageError(f'Invalid sort field: {col}')
+        sfunc = _sort_func(col)
+        records = sorted(records, key=lambda rec: sfunc(rec.get(col)), reverse=desc)
+    return records
 
 
 def json_datetime(o):
@@ -218,6 +226,16 @@ def print_json(records, columns):
     print(json.dumps(result, indent=2, default=json_datetime))
 
 
+def print_ndjson(records):
+    # Each record is written and flushed as soon as it is available, so
+    # that a downstream consumer does not wait for the full result.
+    write, flush = sys.stdout.write, sys.stdout.flush
+    dumps = json.JSONEncoder(separators=(',', ':'), default=json_datetime).encode
+    for rec in records:
+        write(dumps({k: v for k, v in rec.items() if v is not None}) + '\n')
+        flush()
+
+
 def print_csv(records, columns, header):
     cw = csv.writer(sys.stdout)
     if header:
@@ -337,13 +355,23 @@ def print_output(result):
         if result:
             print(result)
         return
+    opts = get_options()
+    fmt = opts.get('format')
+    if fmt == 'ndjson' and not isinstance(result, tuple):
+        # The records arrive as a single dictionary, or a list or an iterator
+        # of dictionaries, already formatted one at a time by cluster_call.
+        # Only sorting requires the full list; otherwise they are streamed.
+        if isinstance(result, dict):
+            result = [result]
+        if opts.get('sort'):
+            result = sort_records(list(result), opts.get('sort'))
+        print_ndjson(filter_records(result, opts.get('filter'), opts.get('columns')))
+        return
     elif not isinstance(result, tuple):
         raise NotImplementedError(f'Not prepared to print an object of type {type(result)}')
     result, columns = result
-    opts = get_options()
     if opts.get('sort'):
         result = sort_df(result, columns, opts.get('sort'))
-    fmt = opts.get('format')
     drop_under = fmt not in ('json', 'csv')
     result, columns = filter_df(result, columns, opts.get('filter'), opts.get('columns'), drop_under)
     if fmt == 'json':
@@ -221,7 +221,10 @@ def cluster_call(method, *args, **kwargs):
         format = 'tableif'
     elif format in ('json', 'csv'):
         format = 'table'
-    kwargs.setdefault('format', format)
+    if format != 'ndjson':
+        # For ndjson, the records are passed to print_output as returned,
+        # so that an iterator of records is streamed, not tabulated.
+        kwargs.setdefault('format', format)
 
     # Retrieve the proper cluster session object and make the call
     try:
@@ -231,7 +234,23 @@ def cluster_call(method, *args, **kwargs):
             click.echo('', nl=True, err=True)
         raise click.ClickException(str(e))
 
-    # Finish out the standardized CLI output
+    # Finish out the standardized CLI output. Streamed records are
+    # formatted one at a time, and may raise errors while they are printed,
+    # so the postfix follows them.
+    if format != 'ndjson':
+        if postfix or prefix:
+            click.echo(postfix, nl=True, err=True)
+        print_output(result)
+        return
+    if isinstance(result, dict):
+        result = [result]
+    if result is not None and not isinstance(result, str):
+        result = c._format_records(result)
+    try:
+        print_output(result)
+    except AEException as e:
+        if postfix or prefix:
+            click.echo('', nl=True, err=True)
+        raise click.ClickException(str(e))
     if postfix or prefix:
         click.echo(postfix, nl=True, err=True)
-    print_output(result)
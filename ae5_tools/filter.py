@@ -1,7 +1,14 @@
 import re
+import os
+import operator
 
-from fnmatch import fnmatch
+from fnmatch import translate
 from datetime import datetime
+from functools import lru_cache
+from dateutil import tz
+
+from .isodate import parse_isodate, parse_timestamp
+from .k8s.transformer import _to_float
 
 
 def _str(x, isodate=False):
@@ -15,13 +22,227 @@ def _str(x, isodate=False):
         return str(x)
 
 
-OPS = {'<': lambda x, y: x < y,
-       '>': lambda x, y: x > y,
-       '=': lambda x, y: fnmatch(x, y),
-       '<=': lambda x, y: x <= y,
-       '>=': lambda x, y: x >= y,
-       '==': lambda x, y: x == y,
-       '!=': lambda x, y: not fnmatch(x, y)}
+_SPLIT_OP = re.compile(r'(==?|!=|>=?|<=?)')
+_WILDCARDS = re.compile(r'[*?[]')
+
+# fnmatch.fnmatch normalizes case on case-insensitive platforms
+_normcase = os.path.normcase
+_CASE_SENSITIVE = _normcase('Aa') == 'Aa'
+
+
+@lru_cache(maxsize=256)
+def _pattern(value):
+    # Compiled fnmatch pattern, or None if the value contains no wildcards
+    # and can be compared for equality instead
+    value = _normcase(value)
+    if _CASE_SENSITIVE and not _WILDCARDS.search(value):
+        return None
+    return re.compile(translate(value)).match
+
+
+@lru_cache(maxsize=4096)
+def _quantity(x):
+    # Resource quantities tend to repeat across records, so conversions are cached
+    return _to_float(x)
+
+
+_ORDER_OPS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+_BOOLS = {'true': True, 't': True, 'yes': True, 'y': True, '1': True,
+          'false': False, 'f': False, 'no': False, 'n': False, '0': False}
+
+
+def _string_test(op, value):
+    # Returns a predicate on the string representation of a field value
+    if op in ('=', '!='):
+        match = _pattern(value)
+        if match is None:
+            test = value.__eq__
+        else:
+            def test(x):
+                return match(x if _CASE_SENSITIVE else _normcase(x)) is not None
+        if op == '!=':
+            return lambda x: not test(x)
+        return test
+    elif op == '==':
+        return value.__eq__
+    cmp = _ORDER_OPS[op]
+    return lambda x: cmp(x, value)
+
+
+def _datetime_literals(value):
+    # Returns an ISO 8601 literal as an aware and as a naive datetime, or None.
+    # As with datetime.astimezone, naive datetimes are taken to be local times.
+    try:
+        dt = parse_isodate(value)
+    except (ValueError, OverflowError):
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=tz.tzlocal()), dt
+    return dt, dt.astimezone(tz.tzlocal()).replace(tzinfo=None)
+
+
+def _term_test(op, value):
+    '''Returns a predicate on the value of a field, for a single filter term.
+
+    The literal is converted once, here, to the types it is compared against.
+    Booleans are compared with boolean literals, such as "true" or "no", by
+    every operator. The ordering operators also compare numbers, and strings
+    that represent numbers or resource quantities such as "1.5Gi", numerically;
+    and datetimes, and strings that are complete ISO 8601 timestamps, with ISO
+    8601 literals chronologically. If the literal of an ordering comparison is
+    a number, a date, or a boolean word, field values that cannot be converted
+    to its type, such as "n/a" or None, do not match. Any other comparison is
+    made between the string representation of the field value and the literal.
+    Single-letter boolean literals, such as "y", remain usable as string bounds.
+    '''
+    str_test = _string_test(op, value)
+    boolean = _BOOLS.get(value.lower())
+    if op in _ORDER_OPS:
+        cmp = _ORDER_OPS[op]
+    elif boolean is None:
+        return lambda x: str_test(x if type(x) is str else _str(x))
+    else:
+        cmp = operator.ne if op == '!=' else operator.eq
+        return lambda x: (str_test(x if type(x) is str else _str(x))
+                          if type(x) is not bool else cmp(x, boolean))
+    number = _to_float(value)
+    number = number if type(number) is float else None
+    dates = _datetime_literals(value)
+    if number is None and dates is None and (boolean is None or len(value) == 1):
+        return lambda x: str_test(x if type(x) is str else _str(x))
+
+    def _ordered_test(x):
+        xtype = type(x)
+        if xtype is str:
+            if number is not None:
+                xnum = _quantity(x)
+                if type(xnum) is float:
+                    return cmp(xnum, number)
+            if dates is not None:
+                x = parse_timestamp(x)
+                if x is not None:
+                    return cmp(x, dates[0] if x.tzinfo is not None else dates[1])
+        elif xtype is bool:
+            if boolean is not None:
+                return cmp(x, boolean)
+        elif xtype in (int, float):
+            if number is not None:
+                return cmp(x, number)
+        elif isinstance(x, datetime):
+            if dates is not None:
+                return cmp(x, dates[0] if x.tzinfo is not None else dates[1])
+        return False
+    return _ordered_test
+
+
+def _all(funcs):
+    if len(funcs) == 1:
+        return funcs[0]
+    elif len(funcs) == 2:
+        f1, f2 = funcs
+        return lambda rec: f1(rec) and f2(rec)
+
+    def _all_n(rec):
+        for func in funcs:
+            if not func(rec):
+                return False
+        return True
+    return _all_n
+
+
+def _any(funcs):
+    if len(funcs) == 1:
+        return funcs[0]
+    elif len(funcs) == 2:
+        f1, f2 = funcs
+        return lambda rec: f1(rec) or f2(rec)
+
+    def _any_n(rec):
+        for func in funcs:
+            if func(rec):
+                return True
+        return False
+    return _any_n
+
+
+class CompiledFilter(object):
+    '''A parsed filter, which can be evaluated against many records.
+
+    The filter is held as a tree of terms: an AND of comma-separated
+    clauses, each an OR of pipe-separated groups, each an AND of
+    ampersand-separated (field, op, value) terms. Predicates short-circuit,
+    so later terms are only evaluated for records that need them.
+    '''
+    def __init__(self, tree):
+        self.tree = tree
+        self.fields = []
+        self.tests = {}
+        for clause in tree:
+            for group in clause:
+                for field, op, value in group:
+                    if field not in self.fields:
+                        self.fields.append(field)
+                    if (op, value) not in self.tests:
+                        self.tests[op, value] = _term_test(op, value)
+
+    def matcher(self, columns=None):
+        '''Returns a function that evaluates the filter on a single record.
+
+        By default the records are dictionaries, and terms whose fields are
+        missing from a record evaluate to False. If a list of columns is
+        supplied, the records are sequences of values in that column order;
+        a ValueError is raised if a field is not one of the columns.
+        '''
+        def _term(field, op, value):
+            test = self.tests[op, value]
+            if columns is not None:
+                ndx = columns.index(field)
+                return lambda rec: test(rec[ndx])
+
+            def _dict_term(rec):
+                try:
+                    value = rec[field]
+                except KeyError:
+                    return False
+                return test(value)
+            return _dict_term
+
+        return _all([_any([_all([_term(*term) for term in group])
+                           for group in clause])
+                     for clause in self.tree])
+
+    def __call__(self, records, columns=None):
+        match = self.matcher(columns)
+        return [rec for rec in records if match(rec)]
+
+
+@lru_cache(maxsize=256)
+def _compile(filter):
+    tree = []
+    for filt1 in filter:
+        for filt2 in filt1.split(','):
+            clause = []
+            for filt3 in filt2.split('|'):
+                group = []
+                for filt4 in filt3.split('&'):
+                    parts = _SPLIT_OP.split(filt4.strip())
+                    if len(parts) != 3:
+                        raise ValueError(f'Invalid filter string: {filt4}\n   Required format: <fieldname><op><value>')
+                    group.append(tuple(map(str.strip, parts)))
+                clause.append(tuple(group))
+            tree.append(tuple(clause))
+    return CompiledFilter(tuple(tree))
+
+
+def compile_filter(filter):
+    '''Parses a filter string, or a tuple of filter strings, into a CompiledFilter.
+
+    Parsed filters are cached, so repeated calls with the same filter are cheap.
+    Raises ValueError if the filter is malformed.
+    '''
+    if isinstance(filter, str):
+        filter = filter,
+    return _compile(tuple(filter))
 
 
 def filter_vars(filter):
@@ -38,6 +259,30 @@ def filter_vars(filter):
     return vars
 
 
+def exact_matches(filter):
+    '''Returns the top-level equality terms of a filter.
+
+    Only terms that must hold for every matching record are returned: that is,
+    terms that are not part of an OR group, and whose values contain no wildcards.
+    The result is a dictionary mapping each field name to its required value.
+    '''
+    result = {}
+    if isinstance(filter, str):
+        filter = filter,
+    for filt1 in filter or ():
+        for filt2 in filt1.split(','):
+            if '|' in filt2:
+                continue
+            for filt3 in filt2.split('&'):
+                parts = re.split(r'(==?|!=|>=?|<=?)', filt3.strip())
+                if len(parts) != 3:
+                    continue
+                field, op, value = list(map(str.strip, parts))
+                if op in ('=', '==') and not any(c in value for c in '*?['):
+                    result.setdefault(field, value)
+    return result
+
+
 def split_filter(filter, columns, negative=False):
     pre_filt = []
     post_filt = []
@@ -61,29 +306,9 @@ def split_filter(filter, columns, negative=False):
 def filter_list_of_dicts(records, filter):
     if not filter or not records:
         return records
-    mask0 = None
+    compiled = compile_filter(filter)
     rec0 = records[0]
-    if isinstance(filter, str):
-        filter = filter,
-    for filt1 in filter or ():
-        mask1 = None
-        for filt2 in filt1.split(','):
-            mask2 = None
-            for filt3 in filt2.split('|'):
-                mask3 = None
-                for filt4 in filt3.split('&'):
-                    parts = re.split(r'(==?|!=|>=?|<=?)', filt4.strip())
-                    if len(parts) != 3:
-                        raise ValueError(f'Invalid filter string: {filt4}\n   Required format: <fieldname><op><value>')
-                    field, op, value = list(map(str.strip, parts))
-                    if field not in rec0:
-                        raise ValueError(f'Invalid filter string: unknown field "{field}"')
-                    mask4 = [OPS[op](_str(rec[field]), value) if field in rec else False
-                             for rec in records]
-                    mask3 = mask4 if mask3 is None else [m1 and m2 for m1, m2 in zip(mask3, mask4)]
-                mask2 = mask3 if mask2 is None else [m1 or m2 for m1, m2 in zip(mask2, mask3)]
-            mask1 = mask2 if mask1 is None else [m1 and m2 for m1, m2 in zip(mask1, mask2)]
-        mask0 = mask1 if mask0 is None else [m1 and m2 for m1, m2 in zip(mask0, mask1)]
-    if mask0:
-        records = [rec for rec, flag in zip(records, mask0) if flag]
-    return records
+    for field in compiled.fields:
+        if field not in rec0:
+            raise ValueError(f'Invalid filter string: unknown field "{field}"')
+    return compiled(records)
@@ -0,0 +1,67 @@
+import os
+import re
+
+from datetime import datetime
+from functools import lru_cache
+from dateutil import parser, tz
+
+
+# The number of distinct timestamp strings whose parsed values are retained
+ISODATE_CACHE_SIZE = int(os.environ.get('AE5_ISODATE_CACHE_SIZE', 4096))
+
+# A complete ISO 8601 timestamp, as emitted by AE5 and Kubernetes
+_ISO_DATETIME = re.compile(r'^(-?(?:[1-9][0-9]*)?[0-9]{4})-(1[0-2]|0[1-9])-(3[01]|0[1-9]|[12][0-9])'
+                           r'T(2[0-3]|[01][0-9]):([0-5][0-9]):([0-5][0-9])(\.[0-9]+)?'
+                           r'(Z|[+-](?:2[0-3_]|[01][0-9]):[0-5][0-9])?$')
+
+# datetime.fromisoformat is not available before Python 3.7
+_fromisoformat = getattr(datetime, 'fromisoformat', None)
+
+
+@lru_cache(maxsize=ISODATE_CACHE_SIZE)
+def parse_timestamp(value):
+    '''Parses a complete ISO 8601 timestamp string.
+
+    The fixed formats used by AE5 and Kubernetes are parsed directly with
+    datetime.fromisoformat, after normalizing the fractional seconds to
+    microseconds; dateutil is used only for unusual years and offsets.
+    The results are cached, because record lists tend to repeat the same
+    timestamps across records and calls.
+
+    Args:
+        value: the string to parse.
+    Returns:
+        the datetime, or None if the string is not a complete timestamp.
+        A "Z" suffix yields a dateutil UTC timezone, to match dateutil.
+    '''
+    match = _ISO_DATETIME.match(value)
+    if match is None:
+        return None
+    year, fraction, offset = match.group(1, 7, 8)
+    if _fromisoformat is not None and len(year) == 4:
+        end = match.end(6)
+        text = value[:end]
+        if fraction:
+            text += fraction[:7].ljust(7, '0')
+        if offset and offset != 'Z':
+            text += offset
+        try:
+            result = _fromisoformat(text)
+        except ValueError:
+            pass
+        else:
+            return result.replace(tzinfo=tz.UTC) if offset == 'Z' else result
+    return parser.parse(value)
+
+
+def parse_isodate(value):
+    '''Parses an ISO 8601 date or timestamp string.
+
+    Complete timestamps are parsed with the cached fast path of
+    parse_timestamp; anything else is passed to dateutil's isoparse.
+    Raises ValueError if the string is not an ISO 8601 date.
+    '''
+    result = parse_timestamp(value)
+    if result is None:
+        result = parser.isoparse(value)
+    return result
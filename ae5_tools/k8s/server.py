@@ -44,6 +44,9 @@ class AE5K8SHandler(object):
     async def hello(self, request):
         return web.Response(text="Alive and kicking")
 
+    async def stats(self, request):
+        return _json(self.xfrm.stats())
+
     async def nodeinfo(self, request):
         result = await self.xfrm.node_info()
         return _json(result)
@@ -116,6 +119,7 @@ def main(url=None, token=None, port=None):
     handler = AE5K8SHandler(url, token)
     app.add_routes([web.get('/', handler.hello),
                     web.get('/__status__', handler.hello),
+                    web.get('/__stats__', handler.stats),
                     web.get('/nodes', handler.nodeinfo),
                     web.get('/pods', handler.podinfo_get_query),
                     web.post('/pods', handler.podinfo_post),
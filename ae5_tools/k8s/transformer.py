@@ -4,10 +4,21 @@ import re
 import sys
 import ast
 import json
+import time
 import aiohttp
 import asyncio
 from urllib.parse import urlencode
-import dateutil.parser
+
+from ..isodate import parse_timestamp
+
+
+# Maximum number of label values in a single set-based selector
+SELECTOR_CHUNK = int(os.environ.get('AE5_K8S_SELECTOR_CHUNK', 100))
+
+# Maximum number of k8s API requests and exec sessions in flight at once,
+# and the number of seconds each may take before it is abandoned
+K8S_MAX_CONCURRENCY = int(os.environ.get('AE5_K8S_MAX_CONCURRENCY', 16))
+K8S_TIMEOUT = float(os.environ.get('AE5_K8S_TIMEOUT', 30))
 
 
 def _or_raise(exc, return_exceptions):
@@ -19,13 +30,26 @@ def _or_raise(exc, return_exceptions):
 def _to_datetime(rec):
     for key, value in (rec.items() if isinstance(rec, dict) else enumerate(rec)):
         if isinstance(value, str):
-            if re.match(r'^(-?(?:[1-9][0-9]*)?[0-9]{4})-(1[0-2]|0[1-9])-(3[01]|0[1-9]|[12][0-9])T(2[0-3]|[01][0-9]):([0-5][0-9]):([0-5][0-9])(\.[0-9]+)?(Z|[+-](?:2[0-3_]|[01][0-9]):[0-5][0-9])?$', value):
-                rec[key] = dateutil.parser.parse(value)
+            value = parse_timestamp(value)
+            if value is not None:
+                rec[key] = value
         elif isinstance(value, (list, dict)):
             _to_datetime(value)
     return rec
 
 
+def _pod_labels(id):
+    # Returns the pod labels that identify the pod of a session (a1) or a
+    # deployment or run (a2), in order of preference, or None if the ID is
+    # not valid.
+    if not re.match(r'[a-f0-9]{2}-[a-f0-9]{32}', id) or not id.startswith(('a1', 'a2')):
+        return None
+    prefix, slug = id.split('-', 1)
+    if prefix == 'a1':
+        return [('anaconda-session-id', slug)]
+    return [('anaconda-app-id', slug), ('job-name', f'anaconda-job-{slug}')]
+
+
 def _to_float(text):
     if isinstance(text, dict):
         return {k: _to_float(v) for k, v in text.items()}
@@ -175,13 +199,55 @@ class FileStream(object):
 
 
 class AE5K8STransformer(object):
-    def __init__(self, url=None, token=None):
+    def __init__(self, url=None, token=None, max_concurrency=None, timeout=None):
         headers = {'accept': 'application/json'}
         if token:
             headers['authorization'] = f'Bearer {token}'
         self._headers = headers
         self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=False))
         self._url = url.rstrip('/') + '/api/v1/'
+        self.max_concurrency = max_concurrency or K8S_MAX_CONCURRENCY
+        self.timeout = K8S_TIMEOUT if timeout is None else timeout
+        self._semaphore = None
+        self._stats = {'calls': 0, 'queued': 0, 'queue_time': 0.0, 'max_queue_time': 0.0,
+                       'in_flight': 0, 'max_in_flight': 0, 'timeouts': 0}
+
+    async def _limit(self, coro):
+        '''Runs a k8s API call, bounding the number of calls in flight.
+
+        The fan-out paths gather many calls at once; the semaphore keeps
+        them from opening more than max_concurrency connections and exec
+        sessions. Each call is also abandoned, with asyncio.TimeoutError,
+        after timeout seconds; a timeout of zero disables this. The time
+        spent waiting for the semaphore is recorded in the stats.
+        '''
+        if self._semaphore is None:
+            # Created here so that it belongs to the running event loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        stats = self._stats
+        t0 = time.monotonic()
+        async with self._semaphore:
+            delay = time.monotonic() - t0
+            stats['calls'] += 1
+            stats['queue_time'] += delay
+            if delay > 0.001:
+                stats['queued'] += 1
+                stats['max_queue_time'] = max(stats['max_queue_time'], delay)
+            stats['in_flight'] += 1
+            stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+            try:
+                if self.timeout:
+                    return await asyncio.wait_for(coro, self.timeout)
+                return await coro
+            except asyncio.TimeoutError:
+                stats['timeouts'] += 1
+                raise
+            finally:
+                stats['in_flight'] -= 1
+
+    def stats(self):
+        '''Returns a copy of the concurrency and queueing metrics.'''
+        return dict(self._stats)
 
     async def close(self):
         if self._session is not None:
@@ -194,6 +260,9 @@ class AE5K8STransformer(object):
             return loop.run_until_complete(self.close())
 
     async def get(self, path, type='json', ok404=False):
+        return await self._limit(self._get(path, type, ok404))
+
+    async def _get(self, path, type, ok404):
         url = self._url + path
         resp = await self._session.get(url, headers=self._headers)
         if resp.status == 404 and ok404:
@@ -207,24 +276,70 @@ class AE5K8STransformer(object):
             return resp
 
     async def _pod_info(self, id, return_exceptions=False):
-        if not re.match(r'[a-f0-9]{2}-[a-f0-9]{32}', id) or not id.startswith(('a1', 'a2')):
+        labels = _pod_labels(id)
+        if labels is None:
             return _or_raise(ValueError(f'Invalid ID: {id}'), return_exceptions)
-        prefix, slug = id.split('-', 1)
-        if prefix == 'a1':
-            queries = f'anaconda-session-id={slug}',
-        else:
-            queries = (f'anaconda-app-id={slug}',
-                       f'job-name=anaconda-job-{slug}')
-        for query in queries:
-            query = urlencode({'labelSelector': query, 'limit': 1})
+        for label, value in labels:
+            query = urlencode({'labelSelector': f'{label}={value}', 'limit': 1})
             path = f'namespaces/default/pods?{query}'
             resp1 = await self.get(path)
             if isinstance(resp1, dict) and resp1.get('items'):
                 return _k8s_pod_to_record(resp1['items'][0])
         else:
             return _or_raise(KeyError(f'Pod not found: {id}'), return_exceptions)
-    
+
+    async def _pod_index(self, label, values):
+        # Retrieves the pods carrying any of the given values of a label,
+        # using set-based selectors, and indexes them by that value.
+        values = sorted(values)
+        chunks = [values[k:k + SELECTOR_CHUNK] for k in range(0, len(values), SELECTOR_CHUNK)]
+        queries = (urlencode({'labelSelector': f'{label} in ({",".join(chunk)})'}) for chunk in chunks)
+        resps = await asyncio.gather(*(self.get(f'namespaces/default/pods?{query}') for query in queries))
+        index = {}
+        for resp in resps:
+            for item in resp.get('items') or ():
+                value = (item['metadata'].get('labels') or {}).get(label)
+                if value is not None:
+                    index.setdefault(value, item)
+        return index
+
+    async def _pod_infos(self, ids, return_exceptions=False):
+        # Looks up the pods of many IDs at once. Rather than issuing one
+        # query per ID, the IDs are grouped by label, and each group is
+        # answered by a set-based selector query. Deployments whose pods
+        # are not found by app ID are retried, together, by job name.
+        results = [None] * len(ids)
+        wanted = {}
+        for ndx, id in enumerate(ids):
+            labels = _pod_labels(id)
+            if labels is None:
+                results[ndx] = _or_raise(ValueError(f'Invalid ID: {id}'), return_exceptions)
+            else:
+                wanted[ndx] = labels
+        while wanted:
+            groups = {}
+            for labels in wanted.values():
+                label, value = labels[0]
+                groups.setdefault(label, set()).add(value)
+            indices = await asyncio.gather(*(self._pod_index(label, values) for label, values in groups.items()))
+            indices = dict(zip(groups, indices))
+            for ndx, labels in list(wanted.items()):
+                label, value = labels[0]
+                item = indices[label].get(value)
+                if item is not None:
+                    results[ndx] = _k8s_pod_to_record(item)
+                elif len(labels) > 1:
+                    wanted[ndx] = labels[1:]
+                    continue
+                else:
+                    results[ndx] = _or_raise(KeyError(f'Pod not found: {ids[ndx]}'), return_exceptions)
+                del wanted[ndx]
+        return results
+
     async def _exec_pod(self, pod, namespace, container, command):
+        return await self._limit(self._exec_pod_ws(pod, namespace, container, command))
+
+    async def _exec_pod_ws(self, pod, namespace, container, command):
         path = f'namespaces/{namespace}/pods/{pod}/exec'
         params = {'command': command, 'container': container,
                   'stdout': True, 'stderr': True,
@@ -263,7 +378,7 @@ class AE5K8STransformer(object):
         result = {'modified': [], 'deleted': [], 'added': [], 'mtime': None}
         try:
             output = await self._exec_pod(data['name'], 'default', data['containers']['sync']['name'], cmd)
-        except RuntimeError as exc:
+        except (RuntimeError, asyncio.TimeoutError) as exc:
             return result
         found = False
         gitkeys = {' D': 'deleted', '??': 'added'}
@@ -279,23 +394,55 @@ class AE5K8STransformer(object):
                 result['mtime'] = max(result.get('mtime') or '', line.split()[0])
         return result
     
-    async def pod_info(self, id, return_exceptions=False):
-        if isinstance(id, list):
-            return await asyncio.gather(*(self.pod_info(t) for t in id), return_exceptions=return_exceptions)
-        nrec = await self._pod_info(id, return_exceptions=return_exceptions)
-        if isinstance(nrec, Exception):
-            return nrec
-        name = nrec['name']
-        metrics_url = f'namespaces/monitoring/services/heapster/proxy/apis/metrics/v1alpha1/namespaces/default/pods/{name}'
+    async def _get_metrics(self, path):
+        # Metrics are optional: if they time out, the usage is reported as
+        # missing, rather than failing the pod, or a whole batch of them.
+        try:
+            return await self.get(f'namespaces/monitoring/services/heapster/proxy/apis/metrics/v1alpha1/{path}', ok404=True)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _pod_metrics(self, name, metrics=None):
+        # Returns the metrics of a pod in the default namespace, from the
+        # cluster-wide listing if it includes the pod, or else directly.
+        if metrics is not None and ('default', name) in metrics:
+            return metrics['default', name]
+        return await self._get_metrics(f'namespaces/default/pods/{name}')
+
+    async def _pod_details(self, id, nrec, metrics=None):
+        # Adds the resource usage of a pod, and for sessions, the changes
+        # to the project. The metrics, if given, are those of the cluster,
+        # indexed by namespace and pod name.
         if id.startswith('a2-'):
-            resp2, resp3 = await self.get(metrics_url, ok404=True), None
+            resp2, resp3 = await self._pod_metrics(nrec['name'], metrics), None
         else:
-            resp2, resp3 = await asyncio.gather(self.get(metrics_url, ok404=True), self._pod_changes(nrec))
+            resp2, resp3 = await asyncio.gather(self._pod_metrics(nrec['name'], metrics), self._pod_changes(nrec))
         _pod_merge_metrics(nrec, resp2)
         if resp3 is not None:
             nrec['changes'] = resp3
         return nrec
 
+    async def pod_info(self, id, return_exceptions=False):
+        if isinstance(id, list):
+            # The pods are retrieved in bulk, as are their metrics, unless
+            # there is only one of them. Pods missing from the metrics list,
+            # or all of them if it is unavailable, are queried one by one.
+            nrecs = self._pod_infos(id, return_exceptions=return_exceptions)
+            if len(id) > 1:
+                nrecs, metrics = await asyncio.gather(nrecs, self._get_metrics('pods'))
+                metrics = {(m['metadata'].get('namespace'), m['metadata']['name']): m
+                           for m in (metrics or {}).get('items') or ()}
+            else:
+                nrecs, metrics = await nrecs, None
+            found = [(t, nrec) for t, nrec in zip(id, nrecs) if not isinstance(nrec, Exception)]
+            details = iter(await asyncio.gather(*(self._pod_details(t, nrec, metrics) for t, nrec in found),
+                                                return_exceptions=return_exceptions))
+            return [nrec if isinstance(nrec, Exception) else next(details) for nrec in nrecs]
+        nrec = await self._pod_info(id, return_exceptions=return_exceptions)
+        if isinstance(nrec, Exception):
+            return nrec
+        return await self._pod_details(id, nrec)
+
     async def pod_log(self, id, container=None, follow=False, stream=None):
         data = await self._pod_info(id)
         if not container:
@@ -0,0 +1,146 @@
+import os
+import time
+import random
+import threading
+
+from email.utils import parsedate_to_datetime
+
+
+# Default parameters of the session retry policy
+RETRY_ATTEMPTS = int(os.environ.get('AE5_RETRY_ATTEMPTS', 3))
+RETRY_BASE = float(os.environ.get('AE5_RETRY_BASE', 0.5))
+RETRY_CAP = float(os.environ.get('AE5_RETRY_CAP', 30))
+RETRY_BUDGET = float(os.environ.get('AE5_RETRY_BUDGET', 10))
+RETRY_BUDGET_RATIO = float(os.environ.get('AE5_RETRY_BUDGET_RATIO', 0.1))
+
+IDEMPOTENT_METHODS = ('get', 'head', 'put', 'delete', 'options')
+
+
+def parse_retry_after(value):
+    '''Converts a Retry-After header value to a number of seconds, or None.'''
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy(object):
+    '''Decides whether, and after what delay, a failed API call is retried.
+
+    Delays grow exponentially with the attempt number, and are drawn
+    uniformly between zero and that bound ("full jitter"), so that many
+    clients failing at once do not retry in lockstep. Retries are also
+    limited by a budget shared by all of the calls that use the policy:
+    each retry spends one token, and each successful call earns back
+    budget_ratio tokens, up to a maximum of budget. When a server is down,
+    then, a session quickly stops multiplying its load by the number of
+    attempts.
+
+    The policy methods compute delays but do not sleep, so the same policy
+    serves both the synchronous and the asyncio sessions.
+
+    Args:
+        attempts: the maximum number of retries of a single call.
+        base: the delay bound, in seconds, for the first retry.
+        cap: the maximum delay bound, in seconds. A Retry-After header
+            sent by the server is honored up to this limit.
+        statuses: the HTTP status codes that are retried. These are only
+            retried for idempotent methods; connection errors are retried
+            for all methods.
+        budget: the maximum number of retry tokens.
+        budget_ratio: the number of tokens earned by each successful call.
+        redirect_timeout: the total number of seconds to wait out a
+            self-redirect from a deployment that is still starting.
+    '''
+    def __init__(self, attempts=RETRY_ATTEMPTS, base=RETRY_BASE, cap=RETRY_CAP,
+                 statuses=(502, 503, 504), budget=RETRY_BUDGET,
+                 budget_ratio=RETRY_BUDGET_RATIO, redirect_timeout=60):
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.statuses = tuple(statuses)
+        self.budget = budget
+        self.budget_ratio = budget_ratio
+        self.redirect_timeout = redirect_timeout
+        self._tokens = budget
+        self._lock = threading.Lock()
+        self.counters = {'successes': 0, 'retries': 0, 'connection_retries': 0,
+                         'status_retries': 0, 'budget_exhausted': 0,
+                         'redirect_waits': 0, 'sleep_time': 0.0}
+
+    def backoff(self, attempt):
+        '''Returns a full-jitter delay for the given (zero-based) retry attempt.'''
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    def retry_delay(self, method, attempt, status=None, retry_after=None):
+        '''Returns the delay before the next retry of a failed call, or None.
+
+        Args:
+            method: the HTTP method of the call.
+            attempt: the number of retries of this call so far.
+            status: the HTTP status of the failed response, or None if
+                the call failed with a connection error.
+            retry_after: the value of the Retry-After header, if any.
+        Returns:
+            the number of seconds to wait before retrying, or None if
+            the failure should not be retried.
+        '''
+        if attempt >= self.attempts:
+            return None
+        if status is not None and (status not in self.statuses or method.lower() not in IDEMPOTENT_METHODS):
+            return None
+        delay = self.backoff(attempt)
+        retry_after = parse_retry_after(retry_after)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.cap))
+        with self._lock:
+            if self._tokens < 1:
+                self.counters['budget_exhausted'] += 1
+                return None
+            self._tokens -= 1
+            self.counters['retries'] += 1
+            self.counters['connection_retries' if status is None else 'status_retries'] += 1
+            self.counters['sleep_time'] += delay
+        return delay
+
+    def redirect_delay(self, attempt, waited):
+        '''Returns the delay before following a self-redirect, or None.
+
+        Self-redirects are expected while a deployment endpoint is coming
+        up, so they do not spend the retry budget. The delays grow
+        exponentially from base to 8 seconds, with half of each delay
+        randomized, until a total of redirect_timeout seconds have been
+        spent waiting.
+
+        Args:
+            attempt: the number of self-redirects followed so far.
+            waited: the number of seconds spent waiting so far.
+        '''
+        remaining = self.redirect_timeout - waited
+        if remaining <= 0:
+            return None
+        delay = min(8.0, self.base * 2 ** attempt)
+        delay = min(remaining, delay / 2 + random.uniform(0, delay / 2))
+        with self._lock:
+            self.counters['redirect_waits'] += 1
+            self.counters['sleep_time'] += delay
+        return delay
+
+    def success(self):
+        '''Records a successful call, earning back part of a retry token.'''
+        with self._lock:
+            self.counters['successes'] += 1
+            self._tokens = min(self.budget, self._tokens + self.budget_ratio)
+
+    def stats(self):
+        '''Returns a copy of the counters, along with the remaining budget.'''
+        with self._lock:
+            result = dict(self.counters)
+            result['budget'] = self._tokens
+        return result
@@ -4,14 +4,18 @@ import time
 import pytest
 import os
 import io
+import gzip
+import json
 import tarfile
 import glob
 import uuid
+import urllib3
 
-from datetime import datetime
+from datetime import datetime, timezone
 
-from ae5_tools.api import AEUserSession, AEUnexpectedResponseError, AEException
-from .utils import _get_vars
+from ae5_tools.api import AEUserSession, AEAdminSession, AEUnexpectedResponseError, AEException, EmptyRecordList
+from ae5_tools.retry import RetryPolicy
+from .utils import _get_vars, _run_async
 
 
 class AttrDict(dict):
@@ -43,6 +47,749 @@ def test_unexpected_response(user_session):
     assert 'json: json' in exc
 
 
+class StubAdapter(requests.adapters.BaseAdapter):
+    """A stand-in for the AE5 server that answers every request after a delay."""
+    def __init__(self, handler, delay=0):
+        super(StubAdapter, self).__init__()
+        self.handler = handler
+        self.delay = delay
+
+    def send(self, request, **kwargs):
+        time.sleep(self.delay)
+        response = requests.models.Response()
+        response.status_code = 200
+        response.headers['content-type'] = 'application/json'
+        response._content = json.dumps(self.handler(request)).encode()
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def _stub_session(handler, delay=0):
+    s = AEUserSession('stub.test', 'stubuser', persist=False)
+    s.session.mount('https://stub.test/', StubAdapter(handler, delay))
+    s.connected = True
+    return s
+
+
+def test_ident_record_by_id():
+    ids = [f'a0-{n:032x}' for n in (1, 2)]
+    projects = [{'id': id, 'name': f'proj{n}', 'owner': 'stubuser'} for n, id in enumerate(ids)]
+    calls = []
+
+    class ProjectAdapter(StubAdapter):
+        def send(self, request, **kwargs):
+            response = super(ProjectAdapter, self).send(request, **kwargs)
+            if response.json() is None:
+                response.status_code = 404
+            return response
+
+    def handler(request):
+        path = urllib3.util.parse_url(request.url).path.rsplit('/api/v2/', 1)[-1]
+        calls.append(path)
+        if path == 'projects':
+            return projects
+        # The second project can only be found through the listing
+        return projects[0] if path == f'projects/{ids[0]}' else None
+
+    s = AEUserSession('stub.test', 'stubuser', persist=False)
+    s.session.mount('https://stub.test/', ProjectAdapter(handler))
+    s.connected = True
+    # A complete ID is retrieved directly, without a listing
+    assert s._ident_record('project', ids[0])['name'] == 'proj0'
+    assert calls == [f'projects/{ids[0]}']
+    # If the direct retrieval fails, the listing is scanned instead
+    del calls[:]
+    assert s._ident_record('project', ids[1])['name'] == 'proj1'
+    assert calls == [f'projects/{ids[1]}', 'projects']
+    # An ID prefix, or a filter that does not pin down one ID, uses the listing
+    for ident in (ids[0][:10], (f'id={ids[0]}|id={ids[1]}',)):
+        del calls[:]
+        s._ident_record('project', ident, quiet=True)
+        assert calls == ['projects']
+    s.connected = False
+
+
+def test_record_index_refresh():
+    pid = 'a0-' + '1' * 32
+    projects = [{'id': pid, 'name': 'old', 'owner': 'stubuser'}]
+    sessions = [{'id': 'a1-' + '1' * 32, 'name': '1' * 32, 'owner': 'stubuser',
+                 'project_url': 'https://stub.test/projects/' + '1' * 32}]
+    calls = []
+
+    def handler(request):
+        path = urllib3.util.parse_url(request.url).path.rsplit('/', 1)[-1]
+        calls.append(path)
+        return [dict(rec) for rec in (projects if path == 'projects' else sessions)]
+
+    s = _stub_session(handler)
+    record = s._ident_record('session', 'old')
+    # The joined project is a copy, so changing it leaves the index intact
+    record['_project']['name'] = 'changed'
+    assert s._record_index('projects')[pid]['name'] == 'old'
+    # Another client renames the project; a miss refreshes the index once
+    projects[0]['name'] = 'new'
+    del calls[:]
+    assert s._ident_record('session', 'new')['name'] == 'new'
+    assert calls == ['sessions', 'sessions', 'projects']
+    del calls[:]
+    assert s._ident_record('session', 'none', quiet=True) is None
+    assert calls == ['sessions', 'sessions', 'projects']
+    s.connected = False
+
+
+def test_join_collaborators_concurrent():
+    def handler(request):
+        return [{'id': 'user-' + request.url.split('/')[-2], 'permission': 'rw', 'type': 'user'}]
+    s = _stub_session(handler, delay=0.1)
+    timings = {}
+    for nthreads in (1, 8):
+        s.max_concurrency = nthreads
+        records = [{'_record_type': 'project', 'id': f'a0-{n:032x}'} for n in range(16)]
+        t0 = time.time()
+        s._join_collaborators('projects', records)
+        timings[nthreads] = time.time() - t0
+        assert all(r['collaborators'] == 'user-' + r['id'] for r in records)
+    assert timings[8] < timings[1] / 3
+    s.connected = False
+
+
+def test_api_retry():
+    statuses = [503, 502, 200]
+
+    class FlakyAdapter(StubAdapter):
+        def send(self, request, **kwargs):
+            response = super(FlakyAdapter, self).send(request, **kwargs)
+            response.status_code = statuses.pop(0)
+            return response
+
+    s = AEUserSession('stub.test', 'stubuser', persist=False)
+    s.session.mount('https://stub.test/', FlakyAdapter(lambda r: {'ok': True}))
+    s.connected = True
+    s.retry_policy = RetryPolicy(base=0.01)
+    assert s._get('projects') == {'ok': True}
+    stats = s.retry_policy.stats()
+    assert stats['status_retries'] == 2 and stats['successes'] == 1
+    statuses[:] = [503]
+    with pytest.raises(AEUnexpectedResponseError):
+        s._get('projects', retry=False)
+    statuses[:] = [503]
+    with pytest.raises(AEUnexpectedResponseError):
+        s._post('projects')
+    s.connected = False
+
+
+def test_download_resume(tmpdir):
+    data = os.urandom(100000)
+    requests_seen = []
+
+    class BrokenReader(io.BytesIO):
+        def stream(self, chunk_size, decode_content=True):
+            while self.tell() < 40000:
+                yield self.read(chunk_size)
+            raise urllib3.exceptions.ProtocolError('connection reset')
+
+    class RangeAdapter(StubAdapter):
+        def send(self, request, **kwargs):
+            response = super(RangeAdapter, self).send(request, **kwargs)
+            offset = int(request.headers.get('Range', 'bytes=0-')[6:-1])
+            requests_seen.append(offset)
+            response.headers['content-type'] = 'application/x-gzip'
+            response._content = False
+            response._content_consumed = False
+            if offset:
+                response.status_code = 206
+                response.headers['content-range'] = f'bytes {offset}-{len(data) - 1}/{len(data)}'
+                response.raw = io.BytesIO(data[offset:])
+            else:
+                response.headers['content-length'] = str(len(data))
+                response.raw = BrokenReader(data)
+            return response
+
+    s = AEUserSession('stub.test', 'stubuser', persist=False)
+    s.session.mount('https://stub.test/', RangeAdapter(lambda r: None))
+    s.connected = True
+    s.retry_policy = RetryPolicy(base=0.01)
+    reports = []
+    fname = str(tmpdir.join('archive.tar.gz'))
+    s._download('projects/x/archive', fname, chunk_size=8192,
+                progress=lambda n, total, rate: reports.append((n, total)))
+    s.connected = False
+    with open(fname, 'rb') as fp:
+        assert fp.read() == data
+    assert not os.path.exists(fname + '.part')
+    assert requests_seen[0] == 0 and requests_seen[1] >= 40000
+    assert reports[-1] == (len(data), len(data))
+
+
+def test_upload_streamed_body(tmpdir):
+    import email
+    pdir = tmpdir.mkdir('proj')
+    pdir.join('anaconda-project.yml').write('name: proj\n')
+    pdir.join('data.bin').write_binary(os.urandom(300000))
+    received = {}
+
+    def handler(request):
+        body = b''.join(request.body)
+        ctype = request.headers['Content-Type']
+        received['msg'] = email.message_from_bytes(b'Content-Type: ' + ctype.encode() + b'\r\n\r\n' + body)
+        return {'error': {'message': 'stub'}}
+
+    s = _stub_session(handler)
+    with pytest.raises(RuntimeError):
+        s.project_upload(str(pdir), 'proj', '1.0', stream=True)
+    s.connected = False
+    parts = {p.get_param('name', header='content-disposition'): p for p in received['msg'].get_payload()}
+    assert parts['name'].get_payload() == 'proj'
+    assert parts['tag'].get_payload() == '1.0'
+    archive = parts['project_file'].get_payload(decode=True)
+    with tarfile.open(fileobj=io.BytesIO(archive), mode='r:gz') as tf:
+        names = tf.getnames()
+        assert tf.extractfile('project/data.bin').read() == pdir.join('data.bin').read_binary()
+    assert sorted(names) == ['project/anaconda-project.yml', 'project/data.bin']
+
+
+def test_upload_cache(tmpdir, monkeypatch, capsys):
+    from ae5_tools.config import config
+    monkeypatch.setattr(config, '_path', str(tmpdir.mkdir('config')))
+    pdir = tmpdir.mkdir('proj')
+    pdir.join('anaconda-project.yml').write('name: proj\n')
+    pdir.join('notebook.ipynb').write('{}')
+    bodies = []
+    # Two rejected uploads, then uploads that are accepted but fail to process
+    responses = [{'error': {'message': 'stub'}}] * 2
+
+    def handler(request):
+        bodies.append(request.body if isinstance(request.body, bytes) else b''.join(request.body))
+        if responses:
+            return responses.pop()
+        return {'id': 'a0-' + '0' * 32, 'action': {'id': 'x', 'done': True, 'error': True, 'message': 'stub'}}
+
+    s = _stub_session(handler)
+    for stream in (False, True):
+        with pytest.raises(RuntimeError):
+            s.project_upload(str(pdir), 'proj', None, cache=True, stream=stream)
+        assert '  A notebook.ipynb' in capsys.readouterr().err
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            s.project_upload(str(pdir), 'proj', None, cache=True)
+    assert 'No files have changed' in capsys.readouterr().err
+    pdir.join('notebook.ipynb').write('{"cells": []}')
+    with pytest.raises(RuntimeError):
+        s.project_upload(str(pdir), 'proj', None, cache=True)
+    assert '  M notebook.ipynb' in capsys.readouterr().err
+    # Names are hashed, so they cannot place the cache outside the uploads directory
+    uploads = tmpdir.join('config', 'uploads', f'{s.username}@{s.hostname}')
+    with pytest.raises(RuntimeError):
+        s.project_upload(str(pdir), '../escaped', None, cache=True)
+    assert not tmpdir.join('config', 'uploads', 'escaped').exists()
+    assert len(uploads.listdir()) == 2
+    s.connected = False
+    archives = [gzip.decompress(body.split(b'\r\n\r\n', 2)[-1].rsplit(b'\r\n--', 1)[0]) for body in bodies]
+    assert archives[0] == archives[1] == archives[2] == archives[3] != archives[4]
+
+
+def test_filter_pushdown():
+    queries = []
+    projects = [{'id': f'a0-{n:032x}', 'name': f'proj{n}', 'owner': 'alice' if n % 2 else 'bob'}
+                for n in range(4)]
+
+    def handler(request):
+        query = dict(q.split('=', 1) for q in request.url.partition('?')[2].split('&') if q)
+        queries.append(query)
+        # A server that ignores the name parameter, so local filtering must still apply
+        return [p for p in projects if p['owner'] == query.get('owner', p['owner'])]
+
+    s = _stub_session(handler)
+    s.filter_pushdown = True
+    records = s.project_list(filter='owner=alice,name=proj1|name=proj3')
+    assert [r['name'] for r in records] == ['proj1', 'proj3']
+    records = s.project_list(filter='owner=bob&name=proj0')
+    assert [r['name'] for r in records] == ['proj0']
+    s.project_list(filter='owner=b*')
+    s.connected = False
+    assert queries == [{'owner': 'alice'}, {'owner': 'bob', 'name': 'proj0'}, {}]
+    assert s.pushdown_stats() == {'calls': 3, 'pushed': 2, 'records': 4,
+                                  'fields': {'owner': 2, 'name': 1}}
+
+
+def test_format_table():
+    s = AEUserSession('stub.test', 'stubuser', persist=False)
+    records = [{'name': f'p{n}', 'owner': 'me', 'created': '2020-01-02T03:04:05Z',
+                'lastLogin': 1577934245000 if n else 0, '_project': {}, '_record_type': 'project'}
+               for n in range(3)]
+    original = [dict(r) for r in records]
+    rows, columns = s._format_table(records, ['owner', 'name'])
+    assert records == original
+    assert columns == ['owner', 'name', 'created', 'lastLogin', '_project', '_record_type']
+    assert rows[0][:2] == ('me', 'p0') and rows[0][3] == 0
+    assert rows[1][2] == datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    assert rows[1][3] == datetime.fromtimestamp(1577934245)
+    assert rows[1][2] is rows[2][2]
+    rows, columns = s._format_table(records[1], None)
+    assert columns == ['field', 'value'] and rows[0] == ('name', 'p1')
+    assert s._format_table(EmptyRecordList('project'), None)[0] == []
+
+
+def test_pool_adapters():
+    s = AEUserSession('pool.test', 'stubuser', persist=False)
+    assert s.session.get_adapter('https://pool.test/api/v2/projects') is s._adapters['host']
+    s._mount_subdomain(s._base_url('', 'k8s')[0])
+    assert s.session.get_adapter('https://k8s.pool.test/api/v1') is s._adapters['subdomain']
+    # Other hosts keep the default adapter
+    assert s.session.get_adapter('https://other.test/') not in s._adapters.values()
+    assert s.session.get_adapter('https://pool.test.other.test/') not in s._adapters.values()
+    stats = s.pool_stats()
+    assert set(stats) == {'host', 'subdomain'}
+    assert stats['host']['requests'] == stats['host']['reused'] == 0
+
+
+def test_async_join_collaborators():
+    import asyncio
+    from ae5_tools.async_api import AsyncAEUserSession, AsyncResponse
+
+    async def _request(method, url, **kwargs):
+        await asyncio.sleep(0.1)
+        data = [{'id': 'user-' + url.split('/')[-2], 'permission': 'rw', 'type': 'user'}]
+        return AsyncResponse(AttrDict(status=200, reason='OK', url=url,
+                                      headers={'content-type': 'application/json'}),
+                             json.dumps(data).encode())
+
+    async def _run():
+        s = AsyncAEUserSession('stub.test', 'stubuser', persist=False)
+        s._sync.connected = True
+        s._request = _request
+        records = [{'_record_type': 'project', 'id': f'a0-{n:032x}'} for n in range(16)]
+        t0 = time.time()
+        await s._join_collaborators('projects', records)
+        await s.close()
+        s._sync.connected = False
+        return records, time.time() - t0
+
+    records, elapsed = _run_async(_run())
+    assert all(r['collaborators'] == 'user-' + r['id'] for r in records)
+    assert elapsed < 0.1 * len(records) / 3
+
+
+def test_async_shared_helpers(monkeypatch):
+    import asyncio
+    from ae5_tools.async_api import AsyncAEAdminSession, AsyncAEUserSession, AsyncResponse
+    monkeypatch.setattr('ae5_tools.api.KEYCLOAK_PAGE_MAX', 10)
+    users = [{'id': f'u{n:03}'} for n in range(25)]
+    jobs = [{'name': 'job'}, {'name': 'job-4'}]
+    calls = []
+
+    async def _request(method, url, params=None, **kwargs):
+        path = urllib3.util.parse_url(url).path
+        calls.append((path.rsplit('/', 1)[-1], params))
+        if path.endswith('/users'):
+            data = users[int(params['first']):int(params['first']) + int(params['max'])]
+        else:
+            data = jobs if path.endswith('/jobs') else []
+        return AsyncResponse(AttrDict(status=200, reason='OK', url=url,
+                                      headers={'content-type': 'application/json'}),
+                             json.dumps(data).encode())
+
+    async def _run():
+        a = AsyncAEAdminSession('stub.test', 'stubadmin', persist=False)
+        u = AsyncAEUserSession('stub.test', 'stubuser', persist=False, max_connections=5)
+        for s in (a, u):
+            s._sync.connected = True
+            s._request = _request
+        records = await a._get_paginated('users', total=25)
+        names = [await u._unique_job_name('job') for _ in range(2)]
+        assert u._aiohttp_session().connector.limit == 5
+        # Only the public data of the synchronous session is forwarded
+        assert u.hostname == 'stub.test'
+        for name in ('_job_names', 'project_upload'):
+            with pytest.raises(AttributeError):
+                getattr(u, name)
+        await a.close()
+        await u.close()
+        a._sync.connected = u._sync.connected = False
+        return records, names
+
+    records, names = _run_async(_run())
+    assert records == users
+    # The window of three pages, then a check for records added during the scan
+    assert sorted(c[1]['first'] for c in calls if c[0] == 'users') == [0, 9, 18, 24]
+    assert names == ['job-1', 'job-2']
+    # The job name index is shared with the synchronous session
+    assert [c[0] for c in calls if c[0] != 'users'] == ['jobs', 'runs']
+
+
+def _stub_admin_session(events, users, delay=0):
+    calls = []
+
+    def handler(request):
+        url = urllib3.util.parse_url(request.url)
+        if url.path.endswith('/users/count'):
+            calls.append(('count',))
+            return len(users)
+        params = dict(p.split('=', 1) for p in url.query.split('&'))
+        calls.append((url.path.rsplit('/', 1)[-1], int(params['first']), int(params['max'])))
+        records = users if url.path.endswith('/users') else events
+        if params.get('type') == 'LOGIN':
+            records = [e for e in records if e['type'] == 'LOGIN']
+        if 'dateFrom' in params:
+            since = datetime.strptime(params['dateFrom'], '%Y-%m-%d').replace(tzinfo=timezone.utc)
+            records = [e for e in records if e['time'] >= since.timestamp() * 1000]
+        return records[int(params['first']):int(params['first']) + int(params['max'])]
+
+    s = AEAdminSession('stub.test', 'stubadmin', persist=False)
+    s.session.mount('https://stub.test/', StubAdapter(handler, delay))
+    s.connected = True
+    return s, calls
+
+
+def test_iter_paginated(monkeypatch):
+    monkeypatch.setattr('ae5_tools.api.KEYCLOAK_PAGE_MAX', 10)
+    events = [{'id': n, 'type': 'LOGIN', 'userId': 'u', 'time': n, 'details': {}} for n in range(25)]
+    s, calls = _stub_admin_session(events, [], delay=0.1)
+    assert list(s.iter_user_events()) == events
+    # Each page after the first also includes the last record of the previous one
+    assert calls == [('events', 0, 10), ('events', 9, 10), ('events', 18, 10)]
+    del calls[:]
+    assert s.user_events(first=5, limit=15, format='json') == events[5:20]
+    assert sorted(calls) == [('events', 5, 10), ('events', 14, 6)]
+    # Identical consecutive events are all kept
+    events[:] = [{'type': 'LOGIN', 'userId': 'u', 'time': 0, 'details': {}}] * 25
+    assert list(s.iter_user_events()) == events
+    # The next page is retrieved while the current one is consumed
+    t0 = time.time()
+    for page in s._iter_paginated('events'):
+        time.sleep(0.1)
+    assert time.time() - t0 < 0.5
+    s.connected = False
+
+
+def test_iter_users(monkeypatch):
+    monkeypatch.setattr('ae5_tools.api.KEYCLOAK_PAGE_MAX', 2)
+    users = [{'id': f'u{n}', 'username': f'user{n}'} for n in range(5)]
+    events = [{'type': 'LOGIN', 'userId': 'u1', 'time': 30, 'details': {}},
+              {'type': 'LOGIN', 'userId': 'u2', 'time': 20, 'details': {'response_mode': 'x'}},
+              {'type': 'LOGIN', 'userId': 'u1', 'time': 10, 'details': {}},
+              {'type': 'LOGIN', 'userId': 'u2', 'time': 5, 'details': {}}]
+    s, calls = _stub_admin_session(events, users)
+    records = list(s.iter_users())
+    assert [r['lastLogin'] for r in records] == [0, 30, 5, 0, 0]
+    assert [r['_record_type'] for r in records] == ['user'] * 5
+    assert list(s.iter_users(filter='username=user2')) == [records[2]]
+    assert s.user_list(format='json') == records
+    s.connected = False
+
+
+def test_wait_many(monkeypatch):
+    monkeypatch.setattr('ae5_tools.api.WAIT_BASE', 0.01)
+    monkeypatch.setattr('ae5_tools.api.WAIT_CAP', 0.02)
+    polls, sizes = {}, {}
+    # Action "a<p>-<n>" of project "p<p>" completes on the n-th poll of its project
+    finish = {'p0': [1, 3], 'p1': [2], 'p2': [4]}
+
+    def handler(request):
+        url = urllib3.util.parse_url(request.url)
+        pid = url.path.split('/')[-2]
+        size = int(url.query.split('page%5Bsize%5D=')[1].split('&')[0])
+        polls[pid] = polls.get(pid, 0) + 1
+        sizes.setdefault(pid, []).append(size)
+        data = [{'id': f'a{pid[1:]}-{n}', 'done': polls[pid] >= n, 'error': False} for n in finish.get(pid, [1000])]
+        # Project p2 has unrelated activity ahead of the pending action
+        if pid == 'p2':
+            data = [{'id': f'x{n}', 'done': True, 'error': False} for n in range(15)] + data
+        return {'data': data[:size]}
+
+    s = _stub_session(handler)
+    responses = [{'id': pid, 'action': {'id': f'a{pid[1:]}-{n}', 'done': False, 'error': False}}
+                 for pid, ns in finish.items() for n in ns]
+    s._wait_many(responses)
+    assert all(r['action']['done'] for r in responses)
+    assert polls == {'p0': 3, 'p1': 2, 'p2': 4}
+    assert sizes['p2'] == [10, 20, 20, 20]
+    responses = [{'id': 'p3', 'action': {'id': 'a3-1000', 'done': False, 'error': False}}]
+    with pytest.raises(AEException) as excinfo:
+        s._wait_many(responses, timeout=0.1)
+    assert 'Timed out' in str(excinfo.value) and 'a3-1000' in str(excinfo.value)
+    s.connected = False
+
+
+def test_wait_missing_action(monkeypatch):
+    monkeypatch.setattr('ae5_tools.api.WAIT_BASE', 0.01)
+    monkeypatch.setattr('ae5_tools.api.WAIT_CAP', 0.02)
+    monkeypatch.setattr('ae5_tools.api.WAIT_PAGE_MAX', 15)
+    sizes = []
+
+    def handler(request):
+        size = int(request.url.split('page%5Bsize%5D=')[1].split('&')[0])
+        sizes.append(size)
+        # The action of project p0 is listed from the fourth poll on, ahead
+        # of 30 unrelated records; the action of project p1 never is
+        data = [{'id': f'x{n}', 'done': True, 'error': False} for n in range(30)]
+        if '/p0/' in request.url and len(sizes) >= 4:
+            data.insert(0, {'id': 'a0', 'done': True, 'error': False})
+        return {'data': data[:size]}
+
+    s = _stub_session(handler)
+    # The page stops growing at WAIT_PAGE_MAX, but the missing action is still polled
+    responses = [{'id': 'p0', 'action': {'id': 'a0', 'done': False, 'error': False}}]
+    s._wait_many(responses)
+    assert responses[0]['action']['done']
+    assert sizes == [10, 15, 15, 15]
+    responses = [{'id': 'p1', 'action': {'id': 'a1', 'done': False, 'error': False}}]
+    with pytest.raises(AEException, match='Timed out .* a1'):
+        s._wait_many(responses, timeout=0.1)
+    assert sizes[4:7] == [10, 15, 15]
+    s.connected = False
+
+
+def test_deployment_start_many(monkeypatch):
+    monkeypatch.setattr('ae5_tools.api.WAIT_BASE', 0.01)
+    monkeypatch.setattr('ae5_tools.api.WAIT_CAP', 0.02)
+    polls = []
+    # Deployment "d<n>" finishes starting on the n-th poll; d3 fails
+    records = {f'd{n}': {'id': f'd{n}', 'state': 'initial', 'status_text': 'Failed',
+                         'project_url': f'https://stub.test/projects/{n:032x}'} for n in range(1, 5)}
+
+    def handler(request):
+        polls.append(request.url)
+        for rec in records.values():
+            if len(polls) >= int(rec['id'][1:]):
+                rec['state'] = 'failed' if rec['id'] == 'd3' else 'started'
+        return [dict(rec) for rec in records.values()]
+
+    def deployment_start(ident, wait, stop_on_error, format, name=None):
+        starts.append(ident)
+        time.sleep(0.1)
+        if ident == 'bad':
+            raise AEException('No projects found matching id=bad')
+        return dict(records[ident], name=name)
+
+    s = _stub_session(handler)
+    stopped, starts = [], []
+    monkeypatch.setattr(s, 'deployment_start', deployment_start)
+    monkeypatch.setattr(s, 'deployment_stop', stopped.append)
+    t0 = time.time()
+    results = s.deployment_start_many(['d1', {'ident': 'd2', 'name': 'two'}, 'bad', 'd3', 'd4'], stop_on_error=True)
+    assert time.time() - t0 < 0.4
+    assert [r['id'] for r in (results[0], results[1], results[4])] == ['d1', 'd2', 'd4']
+    assert all(isinstance(results[n], AEException) for n in (2, 3))
+    assert 'Error completing deployment start' in str(results[3])
+    assert len(polls) == 4 and stopped == ['d3']
+    with pytest.raises(AEException):
+        s.deployment_start_many(['d1', 'bad'], return_exceptions=False)
+    # Deployments still starting at the timeout are stopped as well
+    del polls[:], stopped[:]
+    records['d5'] = {'id': 'd5', 'state': 'initial', 'status_text': '', 'project_url': ''}
+    results = s.deployment_start_many(['d5', 'd3'], stop_on_error=True, timeout=0.05)
+    assert 'Timed out' in str(results[0]) and sorted(stopped) == ['d3', 'd5']
+    # Specs cannot ask to open the deployments, and nothing is started if one does
+    del starts[:]
+    with pytest.raises(AEException) as excinfo:
+        s.deployment_start_many(['d1', {'ident': 'd2', 'open': True, 'frame': False}])
+    assert 'open, frame' in str(excinfo.value) and starts == []
+    s.connected = False
+
+
+def test_run_wait(monkeypatch):
+    from ae5_tools.api import _RunWaiter
+    # By default, the first check of a run comes after 5 to 10 seconds
+    assert 5 <= _RunWaiter.backoff(None).delay() <= 10
+    monkeypatch.setattr('ae5_tools.api.RUN_WAIT_BASE', 0.01)
+    monkeypatch.setattr('ae5_tools.api.RUN_WAIT_CAP', 0.02)
+    polls = []
+    # Run r<n> finishes once more than finish[r<n>] requests have been made
+    finish = {'r1': 1, 'r2': 2, 'r3': 2}
+    runs = {f'r{n}': {'id': f'r{n}', 'name': f'run{n}', 'owner': 'stubuser', 'state': 'running',
+                      'project_url': f'https://stub.test/projects/{n:032x}'} for n in range(1, 4)}
+
+    def handler(request):
+        path = urllib3.util.parse_url(request.url).path
+        if path.endswith('/projects'):
+            return []
+        polls.append(path.rsplit('/api/v2/', 1)[-1])
+        for rec in runs.values():
+            if len(polls) > finish.get(rec['id'], 1000):
+                rec['state'] = 'error' if rec['id'] == 'r2' else 'completed'
+        if path.endswith('/runs'):
+            return [dict(rec) for rec in runs.values()]
+        return dict(runs[path.rsplit('/', 1)[-1]])
+
+    s = _stub_session(handler)
+    records = s.run_wait(filter='name=run*', format='json')
+    assert [(r['id'], r['state']) for r in records] == [('r1', 'completed'), ('r2', 'error'), ('r3', 'completed')]
+    assert all(r['_record_type'] == 'run' and r['project_id'] for r in records)
+    # One listing to resolve the filter, one for three pending runs, then one request per run
+    assert sorted(polls) == ['runs', 'runs', 'runs/r2', 'runs/r3']
+    assert s.run_wait(records[0])['id'] == 'r1'
+    runs['r99'] = {'id': 'r99', 'name': 'run99', 'owner': 'stubuser', 'state': 'running',
+                   'project_url': 'https://stub.test/projects/' + '0' * 32}
+    with pytest.raises(AEException) as excinfo:
+        s._wait_runs([runs['r99']], timeout=0.1)
+    assert 'Timed out' in str(excinfo.value) and 'r99' in str(excinfo.value)
+    assert polls[-1] == 'runs/r99'
+    s.connected = False
+
+
+def test_unique_job_name(monkeypatch, tmp_path):
+    monkeypatch.setattr('ae5_tools.api.config._path', str(tmp_path))
+    calls = []
+    jobs = [{'name': 'job'}, {'name': 'job-1'}, {'name': 'job-a'}, {'name': 'other-2'}]
+    runs = [{'name': 'job-7'}, {'name': 'job-1'}, {'name': 'nightly-3-1'}]
+
+    def handler(request):
+        calls.append(request.url)
+        return jobs if request.url.endswith('/jobs') else runs
+
+    s = _stub_session(handler)
+    assert s._unique_job_name('new') == 'new'
+    assert s._unique_job_name('new') == 'new-1'
+    assert s._unique_job_name('job') == 'job-2'
+    assert s._unique_job_name('job') == 'job-3'
+    assert s._unique_job_name('job-a') == 'job-a-1'
+    assert s._unique_job_name('other') == 'other'
+    assert s._unique_job_name('nightly-3') == 'nightly-3'
+    assert s._unique_job_name('nightly-3') == 'nightly-3-2'
+    assert s._unique_job_name('nightly-3-1') == 'nightly-3-1-1'
+    assert len(calls) == 2
+    s.index_ttl = 0
+    assert s._unique_job_name('job') == 'job-2'
+    assert len(calls) == 4
+    # A persisted index is shared by later sessions, including the names
+    # they have claimed, until it expires or is invalidated
+    s.persist, s.index_ttl = True, 30
+    s._invalidate_job_names()
+    assert s._unique_job_name('job') == 'job-2'
+    index = tmp_path.joinpath('jobnames', 'stubuser@stub.test.json')
+    assert index.exists() and index.stat().st_mode & 0o777 == 0o600
+    s2 = _stub_session(handler)
+    s2.persist = True
+    assert s2._unique_job_name('job') == 'job-3'
+    assert s._unique_job_name('job') == 'job-4' and len(calls) == 6
+    s2._invalidate_job_names()
+    assert not index.exists()
+    s2.index_ttl = 0
+    assert s2._unique_job_name('job') == 'job-2' and len(calls) == 8
+    s.connected = s2.connected = False
+
+
+def test_job_create_name_taken(monkeypatch):
+    jobs, posts = [{'name': 'job'}], []
+    project_url = 'https://stub.test/projects/' + '0' * 32
+
+    class JobAdapter(StubAdapter):
+        def send(self, request, **kwargs):
+            response = super(JobAdapter, self).send(request, **kwargs)
+            if request.method == 'POST':
+                name = json.loads(request.body)['name']
+                posts.append(name)
+                if name.startswith('bad') or any(rec['name'] == name for rec in jobs):
+                    response.status_code = 409
+                else:
+                    jobs.append({'name': name})
+            return response
+
+    def handler(request):
+        if request.method == 'POST':
+            return {'id': 'j1', 'name': json.loads(request.body)['name'], 'project_url': project_url}
+        return jobs if request.url.endswith('/jobs') else []
+
+    s = AEUserSession('stub.test', 'stubuser', persist=False)
+    s.session.mount('https://stub.test/', JobAdapter(handler))
+    s.connected = True
+    rrec = {'project_id': 'a0-' + '0' * 32, 'url': project_url, 'name': 'latest',
+            'commands': [{'id': 'default'}], '_project': {'name': 'proj', 'resource_profile': 'default'}}
+    monkeypatch.setattr(s, '_revision', lambda ident, keep_latest: rrec)
+    assert s._unique_job_name('other') == 'other'
+    # Another client takes "job-1" while the name index is still fresh
+    jobs.append({'name': 'job-1'})
+    record = s.job_create('proj', schedule='0 0 * * *', name='job', make_unique=True, format='json')
+    assert record['name'] == 'job-2' and posts == ['job-1', 'job-2']
+    # Other errors, and names that were not made unique, are not retried
+    del posts[:]
+    for name, make_unique in (('bad', True), ('job', None)):
+        with pytest.raises(AEUnexpectedResponseError):
+            s.job_create('proj', schedule='0 0 * * *', name=name, make_unique=make_unique)
+    assert posts == ['bad', 'job']
+    s.connected = False
+
+
+def test_login_index(monkeypatch, tmp_path):
+    monkeypatch.setattr('ae5_tools.api.config._path', str(tmp_path))
+    day = 86400000
+    users = [{'id': f'u{n}', 'username': f'user{n}'} for n in range(3)]
+    events = [{'type': 'LOGIN', 'userId': 'u1', 'time': 100 * day, 'details': {}},
+              {'type': 'LOGIN', 'userId': 'u0', 'time': 10 * day, 'details': {}}]
+    s, calls = _stub_admin_session(events, users)
+    s.persist = True
+    assert [r['lastLogin'] for r in s.user_list(format='json')] == [10 * day, 100 * day, 0]
+    index = tmp_path.joinpath('logins', 'stubadmin@stub.test.json')
+    assert index.exists() and index.stat().st_mode & 0o777 == 0o600
+    # Only the events since the day before the watermark are retrieved
+    events.insert(0, {'type': 'LOGIN', 'userId': 'u2', 'time': 200 * day, 'details': {}})
+    events.insert(0, {'type': 'LOGIN', 'userId': 'u0', 'time': 300 * day, 'details': {'response_mode': 'x'}})
+    seen = []
+    iter_user_events = s.iter_user_events
+    monkeypatch.setattr(s, 'iter_user_events', lambda **kw: (seen.append(e) or e for e in iter_user_events(**kw)))
+    assert [r['lastLogin'] for r in s.user_list(format='json')] == [10 * day, 100 * day, 200 * day]
+    assert [e['time'] for e in seen] == [300 * day, 200 * day, 100 * day]
+    assert s._login_params(300 * day)['dateFrom'] == '1970-10-27'
+    s.persist = False
+    s.connected = False
+
+
+def test_parallel_pages(monkeypatch):
+    monkeypatch.setattr('ae5_tools.api.KEYCLOAK_PAGE_MAX', 10)
+    users = [{'id': f'u{n:03}'} for n in range(95)]
+    s, calls = _stub_admin_session([], users, delay=0.1)
+    t0 = time.time()
+    records = list(s._get_paginated('users', total=s._user_count()))
+    assert time.time() - t0 < 0.5
+    assert records == users
+    assert sorted(c[1] for c in calls[1:]) == [0] + list(range(9, 91, 9)) + [94]
+    # Records added during the scan are picked up after the expected total
+    del calls[:]
+    assert s._get_paginated('users', total=75) == users
+    assert calls[-1] == ('users', 92, 10)
+    # A short page ends the scan early
+    assert s._get_paginated('users', first=80, limit=40) == users[80:]
+    s.connected = False
+
+
+def test_drop_overlap():
+    from ae5_tools.api import _drop_overlap
+    page1 = [{'id': n} for n in range(5)]
+    # Nothing shifted: the page starts with the last record of the previous one
+    assert _drop_overlap(page1, page1[4:] + [{'id': 5}]) == [{'id': 5}]
+    # Two records were inserted ahead of the scan
+    page2 = [{'id': n} for n in range(2, 8)]
+    assert _drop_overlap(page1, page2) == page2[3:]
+    # Identical consecutive records are not mistaken for the overlap
+    same = [{'type': 'LOGIN', 'userId': 'u'}] * 2
+    assert _drop_overlap(page1[:3] + same, same + [{'id': 9}]) == same[1:] + [{'id': 9}]
+    # Records were removed ahead of the scan, so the whole page is new
+    assert _drop_overlap(page1, page2[4:]) == page2[4:]
+    assert _drop_overlap([], page2) is page2
+
+
+def test_page_scan_shift(monkeypatch):
+    from ae5_tools.api import _PageScan
+    monkeypatch.setattr('ae5_tools.api.KEYCLOAK_PAGE_MAX', 4)
+    events = [{'id': n} for n in range(10)]
+    scan, records = _PageScan(), []
+    while True:
+        request = scan.next_request()
+        if request is None:
+            break
+        first, count, _ = request
+        records.extend(scan.receive(request, events[first:first + count]))
+        # New events are inserted ahead of the scan after the first page
+        if len(records) == 4:
+            events[:0] = [{'id': -1}, {'id': -2}]
+    assert records == [{'id': n} for n in range(10)]
+
+
 def test_user_session(monkeypatch, capsys):
     with pytest.raises(ValueError) as excinfo:
         AEUserSession('', '')
@@ -243,6 +990,17 @@ def test_project_upload_as_directory(user_session, downloaded_project):
     assert os.path.exists(fname2)
 
 
+def test_project_upload_as_directory_streamed(user_session, downloaded_project):
+    fname, dname = downloaded_project
+    user_session.project_upload(dname, 'test_upload3', '1.4.5', wait=True, stream=True)
+    rrec = user_session.revision_list('test_upload3')
+    assert len(rrec) == 1
+    assert rrec[0]['name'] == '1.4.5'
+    fname2 = user_session.project_download('test_upload3:1.4.5')
+    assert fname2 == 'test_upload3-1.4.5.tar.gz'
+    assert os.path.exists(fname2)
+
+
 def _soft_equal(d1, d2):
     if isinstance(d1, dict) and isinstance(d2, dict):
         for k in (set(d1) | set(d2)):
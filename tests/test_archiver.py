@@ -0,0 +1,103 @@
+import io
+import os
+import gzip
+import zlib
+import tarfile
+
+import pytest
+
+from ae5_tools.archiver import ParallelGzipWriter, create_tar_archive, iter_tar_archive
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+@pytest.mark.parametrize('size', [0, 1000, 3 * 65536 + 17])
+def test_parallel_gzip_roundtrip(threads, size):
+    data = (os.urandom(size // 2) + b'ae5-tools ' * (size // 20))[:size]
+    fp = io.BytesIO()
+    with ParallelGzipWriter(fp, threads=threads, block_size=65536) as gz:
+        for k in range(0, len(data), 10000):
+            gz.write(data[k:k + 10000])
+    assert gzip.decompress(fp.getvalue()) == data
+    # The output is a single gzip member, not a concatenation of members
+    dobj = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    assert dobj.decompress(fp.getvalue()) == data
+    assert dobj.eof and not dobj.unused_data
+
+
+def test_parallel_gzip_ratio():
+    data = b''.join(b'line %d of a fairly repetitive file\n' % (k % 5000) for k in range(200000))
+    fp = io.BytesIO()
+    with ParallelGzipWriter(fp, threads=4, block_size=65536) as gz:
+        gz.write(data)
+    # Priming each block with its predecessor keeps the ratio close to serial gzip
+    assert len(fp.getvalue()) < 1.05 * len(gzip.compress(data))
+
+
+def test_parallel_gzip_abort():
+    fp = io.BytesIO()
+    with pytest.raises(ValueError):
+        with ParallelGzipWriter(fp, threads=2, block_size=65536) as gz:
+            gz.write(os.urandom(200000))
+            raise ValueError('stop')
+    assert gz.closed and not gz.pending and gz.executor._shutdown
+    # No trailer is written, so the stream is incomplete
+    with pytest.raises(EOFError):
+        gzip.decompress(fp.getvalue())
+
+
+@pytest.fixture
+def project_dir(tmpdir):
+    pdir = tmpdir.mkdir('proj')
+    pdir.join('anaconda-project.yml').write('name: proj\n')
+    pdir.join('.projectignore').write('*.log\n')
+    pdir.join('skip.log').write('ignored')
+    pdir.mkdir('sub').join('data.bin').write_binary(os.urandom(200000))
+    return pdir
+
+
+@pytest.mark.parametrize('threads', [1, 3])
+def test_create_tar_archive(project_dir, threads):
+    fp = io.BytesIO()
+    create_tar_archive(str(project_dir), 'project', fp, threads=threads)
+    fp.seek(0)
+    with tarfile.open(fileobj=fp, mode='r:gz') as tf:
+        assert sorted(tf.getnames()) == ['project/.projectignore', 'project/anaconda-project.yml',
+                                         'project/sub/data.bin']
+        assert tf.extractfile('project/sub/data.bin').read() == project_dir.join('sub', 'data.bin').read_binary()
+
+
+def test_create_tar_archive_error(project_dir, monkeypatch):
+    import ae5_tools.archiver as archiver
+    writers = []
+    abort = ParallelGzipWriter.abort
+    monkeypatch.setattr(ParallelGzipWriter, 'abort', lambda self: writers.append(self) or abort(self))
+    monkeypatch.setattr(archiver, '_list_project', lambda pdir: iter([(pdir + '/missing', 'missing')]))
+    with pytest.raises(OSError):
+        create_tar_archive(str(project_dir), 'project', io.BytesIO(), threads=2)
+    assert len(writers) == 1 and writers[0].executor._shutdown
+
+
+def test_iter_tar_archive(project_dir):
+    fp = io.BytesIO()
+    create_tar_archive(str(project_dir), 'project', fp, threads=1)
+    chunks = list(iter_tar_archive(str(project_dir), 'project', chunk_size=4096, threads=1))
+    assert max(map(len, chunks)) == 4096
+    assert gzip.decompress(b''.join(chunks)) == gzip.decompress(fp.getvalue())
+
+
+def test_project_manifest(project_dir, monkeypatch):
+    import ae5_tools.archiver as archiver
+    m1 = archiver.project_manifest(str(project_dir))
+    assert sorted(m1) == ['.projectignore', 'anaconda-project.yml', 'sub/data.bin']
+    hashed = []
+    monkeypatch.setattr(archiver, '_file_digest', lambda path: hashed.append(path) or 'x')
+    m2 = archiver.project_manifest(str(project_dir), m1)
+    assert m2 == m1 and not hashed
+    project_dir.join('anaconda-project.yml').write('name: proj2\n')
+    project_dir.join('new.txt').write('new')
+    project_dir.join('.projectignore').remove()
+    m3 = archiver.project_manifest(str(project_dir), m1)
+    assert len(hashed) == 3
+    assert archiver.manifest_changes(m1, m3) == {'added': ['new.txt', 'skip.log'],
+                                                 'modified': ['anaconda-project.yml'],
+                                                 'removed': ['.projectignore']}
@@ -9,10 +9,15 @@ import requests
 import tarfile
 import glob
 import uuid
+import json
+
+import click
 
 from datetime import datetime
 from collections import namedtuple
-from ae5_tools.api import AEUnexpectedResponseError
+from ae5_tools.api import AEUnexpectedResponseError, AEUserSession, AEException
+from ae5_tools.cli import login
+from ae5_tools.cli.commands.user import events
 
 from .utils import _cmd, CMDException
 
@@ -34,6 +39,44 @@ def test_project_info(project_list):
         assert rec2 == rec3
 
 
+def test_project_list_ndjson(project_list):
+    lines = _cmd('project list --collaborators --format ndjson', table=False).splitlines()
+    records = [json.loads(line) for line in lines]
+    assert sorted(rec['id'] for rec in records) == sorted(rec['id'] for rec in project_list)
+    rec0 = project_list[0]
+    rec1 = json.loads(_cmd(f'project info {rec0["id"]} --format ndjson', table=False))
+    assert rec1['id'] == rec0['id'] and rec1['name'] == rec0['name']
+
+
+def test_user_events_ndjson_streams(monkeypatch, capsys):
+    def iter_user_events(**kwargs):
+        assert kwargs == {'limit': 10, 'first': 0, 'type': 'LOGIN'}
+        yield {'id': 1, 'type': 'LOGIN', 'error': None, 'time': None}
+        # The first event is written before the iterator is exhausted
+        assert capsys.readouterr().out == '{"id":1}\n'
+        yield {'id': 2, 'type': 'LOGIN', 'error': 'invalid_user_credentials', 'time': 1577836800000}
+        yield {'id': 3, 'type': 'LOGOUT', 'time': 1577836800000}
+        if fail:
+            raise AEException('stream interrupted')
+
+    fail = False
+    session = AEUserSession.__new__(AEUserSession)
+    session.iter_user_events = iter_user_events
+    monkeypatch.setattr(login, 'cluster', lambda admin=False: session)
+    options = {'format': 'ndjson', 'filter': ('type=LOGIN',), 'columns': 'id,error,time'}
+    with click.Context(events, obj={'options': options}):
+        events.callback(param=('type=LOGIN',), limit=10, first=0)
+    lines = capsys.readouterr().out.splitlines()
+    # Timestamps are converted as they are for --format json
+    stamp = datetime.fromtimestamp(1577836800).isoformat()
+    assert [json.loads(line) for line in lines] == [{'id': 2, 'error': 'invalid_user_credentials', 'time': stamp}]
+    # Errors raised while the records are streamed are reported as usual
+    fail = True
+    with click.Context(events, obj={'options': options}):
+        with pytest.raises(click.ClickException, match='stream interrupted'):
+            events.callback(param=('type=LOGIN',), limit=10, first=0)
+
+
 def test_project_info_errors(project_list):
     with pytest.raises(CMDException) as excinfo:
         _cmd('project info testproj1')
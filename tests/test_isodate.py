@@ -0,0 +1,39 @@
+import pytest
+
+from datetime import datetime, timezone
+from dateutil import parser, tz
+
+from ae5_tools.isodate import parse_timestamp, parse_isodate
+
+
+@pytest.mark.parametrize('value', [
+    '2020-01-02T03:04:05',
+    '2020-01-02T03:04:05Z',
+    '2020-01-02T03:04:05.1Z',
+    '2020-01-02T03:04:05.123456Z',
+    '2020-01-02T03:04:05.123456789Z',
+    '2020-01-02T03:04:05+05:30',
+    '2020-01-02T03:04:05.5-08:00',
+])
+def test_parse_timestamp(value):
+    expected = parser.parse(value)
+    result = parse_timestamp(value)
+    assert result == expected
+    assert result.utcoffset() == expected.utcoffset()
+    assert parse_timestamp(value) is result
+
+
+def test_parse_timestamp_utc():
+    assert parse_timestamp('2020-01-02T03:04:05Z').tzinfo is tz.UTC
+
+
+@pytest.mark.parametrize('value', ['', 'abc', '2020-01-02', '2020-01-02 03:04:05', '2020-13-02T03:04:05Z'])
+def test_parse_timestamp_other(value):
+    assert parse_timestamp(value) is None
+
+
+def test_parse_isodate():
+    assert parse_isodate('2020-01-02') == datetime(2020, 1, 2)
+    assert parse_isodate('2020-01-02T03:04:05.25+00:00') == datetime(2020, 1, 2, 3, 4, 5, 250000, tzinfo=timezone.utc)
+    with pytest.raises(ValueError):
+        parse_isodate('not a date')
@@ -0,0 +1,56 @@
+import time
+import pytest
+
+from email.utils import formatdate
+
+from ae5_tools.retry import RetryPolicy, parse_retry_after
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('5') == 5.0
+    assert parse_retry_after('garbage') is None
+    assert 25 < parse_retry_after(formatdate(time.time() + 30, usegmt=True)) <= 30
+
+
+def test_backoff_bounds():
+    policy = RetryPolicy(base=0.5, cap=4)
+    for attempt in range(10):
+        assert 0 <= policy.backoff(attempt) <= min(4, 0.5 * 2 ** attempt)
+
+
+def test_retry_delay_rules():
+    policy = RetryPolicy(attempts=2, budget=100)
+    assert policy.retry_delay('get', 0, 503) is not None
+    assert policy.retry_delay('get', 2, 503) is None
+    assert policy.retry_delay('post', 0, 503) is None
+    assert policy.retry_delay('post', 0) is not None
+    assert policy.retry_delay('get', 0, 500) is None
+    assert policy.retry_delay('get', 0, 503, '3') >= 3
+    stats = policy.stats()
+    assert stats['status_retries'] == 2 and stats['connection_retries'] == 1
+
+
+def test_retry_budget():
+    policy = RetryPolicy(budget=2, budget_ratio=0.5)
+    assert policy.retry_delay('get', 0) is not None
+    assert policy.retry_delay('get', 0) is not None
+    assert policy.retry_delay('get', 0) is None
+    assert policy.stats()['budget_exhausted'] == 1
+    policy.success()
+    policy.success()
+    assert policy.retry_delay('get', 0) is not None
+
+
+def test_redirect_delay():
+    policy = RetryPolicy(base=0.5, redirect_timeout=10)
+    waited, attempt = 0, 0
+    while True:
+        delay = policy.redirect_delay(attempt, waited)
+        if delay is None:
+            break
+        assert 0 < delay <= 8
+        waited += delay
+        attempt += 1
+    assert waited == pytest.approx(10)
+    assert policy.stats()['budget'] == policy.budget
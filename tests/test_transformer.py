@@ -0,0 +1,176 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from urllib.parse import urlparse, parse_qs
+
+from ae5_tools.k8s.transformer import AE5K8STransformer
+
+from .utils import _run_async
+
+
+def _pod(name, **labels):
+    return {'metadata': {'name': name, 'labels': labels},
+            'spec': {'nodeName': 'node1',
+                     'containers': [{'name': 'app', 'resources': {'requests': {'nvidia.com/gpu': '0'}, 'limits': {}}}]},
+            'status': {'phase': 'Running',
+                       'conditions': [{'lastTransitionTime': '2020-01-01T00:00:00Z'}],
+                       'containerStatuses': [{'name': 'app', 'ready': True, 'restartCount': 0,
+                                              'state': {'running': {'startedAt': '2020-01-01T00:00:00Z'}}}]}}
+
+
+def _metrics(namespace, name, cpu):
+    return {'metadata': {'name': name, 'namespace': namespace}, 'window': '1m',
+            'timestamp': '2020-01-01T00:00:00Z',
+            'containers': [{'name': 'app', 'usage': {'cpu': cpu, 'memory': '1Mi'}}]}
+
+
+class FakeResponse(object):
+    def __init__(self, data):
+        self.status = 404 if data is None else 200
+        self.data = data
+
+    def raise_for_status(self):
+        if self.status != 200:
+            raise RuntimeError(f'Status {self.status}')
+
+    async def json(self):
+        return self.data
+
+
+class FakeSession(object):
+    '''Stands in for the aiohttp session of the transformer.
+
+    The cluster-wide metrics list holds 100m of usage for every pod, unless
+    metrics is set to (namespace, name, cpu) tuples, or to None for a 404.
+    Metrics retrieved for a single pod always show 200m.
+    '''
+    def __init__(self, *args, **kwargs):
+        self.pods = []
+        self.metrics = None
+        self.paths = []
+        self.delay = self.metrics_delay = 0
+
+    async def get(self, url, headers=None):
+        path = url.split('/api/v1/', 1)[1]
+        self.paths.append(path)
+        await asyncio.sleep(self.delay)
+        url = urlparse(path)
+        if url.path.startswith('namespaces/monitoring'):
+            await asyncio.sleep(self.metrics_delay)
+            if not url.path.endswith('/pods'):
+                return FakeResponse(_metrics('default', url.path.rsplit('/', 1)[-1], '200m'))
+            if self.metrics is None:
+                return FakeResponse(None)
+            return FakeResponse({'items': [_metrics(*m) for m in self.metrics]})
+        selector = parse_qs(url.query)['labelSelector'][0]
+        if ' in (' in selector:
+            label, values = selector.split(' in (')
+            values = values.rstrip(')').split(',')
+        else:
+            label, values = selector.split('=')
+            values = [values]
+        items = [p for p in self.pods if p['metadata']['labels'].get(label) in values]
+        return FakeResponse({'items': items})
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def transformer(monkeypatch):
+    # Builds transformers through the real constructor, with the aiohttp
+    # session replaced by a FakeSession serving the given pods
+    monkeypatch.setattr(aiohttp, 'TCPConnector', lambda **kwargs: None)
+    monkeypatch.setattr(aiohttp, 'ClientSession', FakeSession)
+    xfrms = []
+
+    def _transformer(pods, **kwargs):
+        xfrm = AE5K8STransformer('https://k8s.test', **kwargs)
+        xfrm._session.pods = pods
+        xfrm._session.metrics = [('default', p['metadata']['name'], '100m') for p in pods]
+        xfrms.append(xfrm)
+        return xfrm
+
+    yield _transformer
+    for xfrm in xfrms:
+        _run_async(xfrm.close())
+
+
+def test_pod_info_batched(transformer):
+    ids = [f'a2-{n:032x}' for n in range(300)]
+    pods = [_pod(f'app-{n}', **{'anaconda-app-id': id[3:]}) for n, id in enumerate(ids[:250])]
+    pods += [_pod(f'run-{n}', **{'job-name': f'anaconda-job-{id[3:]}'}) for n, id in enumerate(ids[250:290])]
+    xfrm = transformer(pods)
+    results = _run_async(xfrm.pod_info(ids + ['a2-xyz'], return_exceptions=True))
+    assert [r['name'] for r in results[:290]] == [p['metadata']['name'] for p in pods]
+    assert all(isinstance(r, KeyError) for r in results[290:300])
+    assert isinstance(results[300], ValueError)
+    assert results[0]['usage']['cpu'] == '100m'
+    # Three app-id chunks, one job-name chunk, and the metrics
+    assert len(xfrm._session.paths) == 5
+
+
+def test_pod_info_metrics(transformer):
+    ids = [f'a2-{n:032x}' for n in range(3)]
+    pods = [_pod(f'app-{n}', **{'anaconda-app-id': id[3:]}) for n, id in enumerate(ids)]
+    xfrm = transformer(pods)
+    session = xfrm._session
+    # A pod of the same name in another namespace is not mistaken for app-1,
+    # so the metrics of app-1 are retrieved directly
+    session.metrics = [('default', 'app-0', '100m'), ('other', 'app-1', '300m'), ('default', 'app-2', '100m')]
+    results = _run_async(xfrm.pod_info(ids))
+    assert [r['usage']['cpu'] for r in results] == ['100m', '200m', '100m']
+    assert session.paths[-1].endswith('/namespaces/default/pods/app-1')
+    # Without the metrics list, every pod is queried directly
+    session.metrics, session.paths = None, []
+    results = _run_async(xfrm.pod_info(ids))
+    assert [r['usage']['cpu'] for r in results] == ['200m'] * 3
+    assert len(session.paths) == 5
+
+
+def test_pod_info_metrics_timeout(transformer):
+    ids = [f'a2-{n:032x}' for n in range(3)]
+    pods = [_pod(f'app-{n}', **{'anaconda-app-id': id[3:]}) for n, id in enumerate(ids)]
+    xfrm = transformer(pods, timeout=0.05)
+    xfrm._session.metrics_delay = 1
+    # Metrics that time out are reported as missing usage
+    results = _run_async(xfrm.pod_info(ids))
+    assert [r['name'] for r in results] == ['app-0', 'app-1', 'app-2']
+    assert all(r['usage']['cpu'] == '0' and r['timestamp'] is None for r in results)
+    # The metrics list, then each pod directly
+    assert xfrm.stats()['timeouts'] == 4
+
+
+def test_pod_info_single(transformer):
+    ids = [f'a1-{n:032x}' for n in range(2)]
+    xfrm = transformer([_pod('session-0', **{'anaconda-session-id': ids[0][3:]})])
+    xfrm._pod_changes = lambda nrec: asyncio.sleep(0, None)
+    result = _run_async(xfrm.pod_info(ids[0]))
+    assert result['name'] == 'session-0' and len(xfrm._session.paths) == 2
+    results = _run_async(xfrm.pod_info(ids, return_exceptions=True))
+    assert results[0]['name'] == 'session-0' and isinstance(results[1], KeyError)
+
+
+def test_pod_info_bounded(transformer):
+    ids = [f'a2-{n:032x}' for n in range(500)]
+    pods = [_pod(f'app-{n}', **{'anaconda-app-id': id[3:]}) for n, id in enumerate(ids)]
+    xfrm = transformer(pods, max_concurrency=2)
+    xfrm._session.delay = 0.01
+    results = _run_async(xfrm.pod_info(ids))
+    assert len(results) == 500
+    stats = xfrm.stats()
+    # Five app-id chunks and the metrics, at most two at a time
+    assert stats['calls'] == 6 and stats['max_in_flight'] == 2
+    assert stats['in_flight'] == 0 and stats['queued'] >= 3
+    assert 0 < stats['max_queue_time'] <= stats['queue_time']
+
+
+def test_get_timeout(transformer):
+    xfrm = transformer([], timeout=0.01)
+    xfrm._session.delay = 1
+    with pytest.raises(asyncio.TimeoutError):
+        _run_async(xfrm.get('namespaces/default/pods?labelSelector=a%3Db'))
+    stats = xfrm.stats()
+    assert stats['timeouts'] == 1 and stats['in_flight'] == 0
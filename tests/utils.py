@@ -1,5 +1,6 @@
 import os
 import csv
+import asyncio
 import json
 import shlex
 import subprocess
@@ -48,3 +49,12 @@ def _cmd(cmd, table=True):
     if result and list(result[0].keys()) == ['field', 'value']:
         return {rec['field']: rec['value'] for rec in result}
     return result
+
+
+def _run_async(coro):
+    # asyncio.run requires Python 3.7
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()